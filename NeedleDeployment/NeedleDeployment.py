@@ -1,15 +1,40 @@
 import os
 import unittest
 import vtk, qt, ctk, slicer
+from vtk.util import numpy_support
 from slicer.ScriptedLoadableModule import *
 import logging
 import math
 import numpy as np
-from scipy.spatial import cKDTree
 import Resources.UI.Layouts as layouts
 import re
 import time
 import LoadSegmentations
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.logwriter import AsyncLogWriter
+from NeedleDeploymentLib.playback import MAX_SPEED, MIN_SPEED, PlaybackEngine
+from NeedleDeploymentLib.planmanager import DEFAULT_PLAN, PlanManager
+from NeedleDeploymentLib.plans import PlanProgress
+from NeedleDeploymentLib.poses import (
+    PoseInterpolator,
+    PosePredictor,
+    PoseSample,
+)
+from NeedleDeploymentLib.recordings import RecordingLibrary
+from NeedleDeploymentLib.scoring import scoreNeedleTips
+from NeedleDeploymentLib.sessionlog import (
+    SESSION_LOG_EXTENSION,
+    SESSION_LOG_NAME,
+    SessionLogWriter,
+)
+from NeedleDeploymentLib.sessions import SessionManager
+from NeedleDeploymentLib.tracking import (
+    LatestPoseSlot,
+    PoseIngestThread,
+    createPoseSource,
+    readLastPose,
+    readLastPoses,
+)
 
 _EPS = np.finfo(float).eps * 4.0
 #
@@ -86,6 +111,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         print(self.inputFolder)
 
         defaultTimeInterval = 20
+        self.refresh_interval = defaultTimeInterval
         self.timer = qt.QTimer()
         self.timer.setInterval(defaultTimeInterval)
         self.timer.connect("timeout()", self.onTimeOut)
@@ -95,6 +121,80 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.needle_file = self.inputFolder
         self.needle_pose_index = 0
         self.needle_data = []
+        self.pose_source = None
+        self.latest_pose = LatestPoseSlot()
+        self.ingest_thread = None
+
+        # live pose source: "file" tails needle-tracker.txt, "ring" maps needle-tracker.ring,
+        # "udp"/"tcp" receive pose packets on localhost
+        self.stream_source = "file"
+        self.stream_port = 5005
+
+        # live refresh: "timer" polls every defaultTimeInterval ms, "event" refreshes only when the
+        # ingest thread publishes a new pose, with a slow fallback timer in case a notification is missed
+        self.refresh_mode = "timer"
+        self.event_fallback_interval = 100
+        self.pose_notifier = None
+        self.tracker_watcher = None
+
+        # resample poses at the display rate: live samples by their timestamps (timer refresh mode only),
+        # recordings by their playback time
+        self.interpolate_poses = False
+
+        # recordings are played back in real time: by their timestamp column (t x y z qw qx qy qz)
+        # if they have one, otherwise at recording_rate Hz. Frames the timer is too slow for are dropped
+        self.recording_rate = 50
+        self.playback = None
+        self.playback_file = None
+
+        # recordings offered for playback: recording*.txt and demo*.txt in recordings_folder,
+        # converted once to .npy files that are memory-mapped when selected
+        self.recordings_folder = self.inputFolder
+        self.recording_library = RecordingLibrary(
+            self.recordings_folder, rate=self.recording_rate
+        )
+        self.pose_interpolator = PoseInterpolator()
+
+        # extrapolate live poses by the measured latency from sample capture to display (plus
+        # render_latency seconds for the frame still to be drawn). Predicted poses are logged
+        # to needle-predicted next to the raw ones
+        self.predict_poses = False
+        self.render_latency = 0.0
+        self.pipeline_latency = 0.0
+        self.pose_predictor = PosePredictor()
+        # time.perf_counter_ns() when the last pose was applied to the needle transform, logged with
+        # the tracker sample and ingest times (python -m NeedleDeploymentLib.latency reports them)
+        self.applied_ns = -1
+        # scoring.PoseScores of the pose shown, from onNeedleMove
+        self.needle_scores = None
+        # plans.PlanProgress of the needle tip in the last frame (None before the needle moved),
+        # also logged per pose in the binary session log
+        self.needle_progress = None
+
+        # session logs (needle-timestamps.txt, timestamps.txt, ...) are appended from a background
+        # thread in batches, at least every 0.5 s
+        self.log_writer = AsyncLogWriter()
+
+        # every session (first spacebar press until the environment is cleared) is logged to its own
+        # folder in sessions_folder, named after the participant. Logs are split into segments of at
+        # most 64 MB and session.json indexes where each trial (spacebar press) starts and stops
+        self.sessions_folder = os.path.join(os.path.expanduser("~"), "NeedleSessions")
+        self.participant = ""
+        self.session_manager = SessionManager(self.sessions_folder, self.log_writer)
+
+        # needle poses (scored against the plan) and spacebar presses go to the binary log
+        # needle-session-*.ndlog, `python -m NeedleDeploymentLib.sessionlog export` converts it to
+        # the text layout. False writes needle-timestamps-*.txt and timestamps-*.txt instead
+        self.binary_session_log = True
+        self.session_log = None
+
+        # needle plans loaded in the background (createNeedlePlan), their scene nodes and the active one
+        self.plan_manager = None
+        self.plan_scenes = {}
+        self.active_plan = None
+        # funnel segmentations of the plans are made once the skin segmentations are loaded
+        # (cleanSegmentations), for each plan when it is first shown
+        self.funnel_segmentations = False
 
         # hardcoded values for recorded data
         self.needle_registration = np.eye(4)
@@ -149,25 +249,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.dropDownMovementLabel.enabled = False
         self.dropDownMovementLabel.setAlignment(qt.Qt.AlignCenter)
         self.dropDownMovement.enabled = False
-        self.dropDownMovement.addItems(
-            [
-                "",
-                "recording1.txt",
-                "recording2.txt",
-                "recording3.txt",
-                "recording4.txt",
-                "recording5.txt",
-                "recording6.txt",
-                "recording7.txt",
-                "recording8.txt",
-                "demo.txt",
-                "demo_slow.txt",
-            ]
-        )
-        for index in range(self.dropDownMovement.model().rowCount()):
-            self.dropDownMovement.setItemData(
-                index, qt.Qt.AlignCenter, qt.Qt.TextAlignmentRole
-            )
+        self.populateRecordings()
         self.dropDownMovement.currentIndexChanged.connect(self.onDropDownMovementSelect)
 
         self.streamingCheckBox = qt.QCheckBox("Stream data?")
@@ -183,6 +265,20 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             self.streamingCheckBox, qt.Qt.AlignCenter
         )
 
+        # plans of the input folder, loaded in the background when the environment is loaded
+        self.dropDownPlan = qt.QComboBox()
+        self.dropDownPlanLabel = qt.QLabel("Select plan: ")
+        self.dropDownPlanLabel.enabled = False
+        self.dropDownPlanLabel.setAlignment(qt.Qt.AlignCenter)
+        self.dropDownPlan.enabled = False
+        self.dropDownPlan.toolTip = "Needle plan (needle_deployment*.txt) the needle is scored against"
+        self.dropDownPlan.currentIndexChanged.connect(self.onDropDownPlanSelect)
+
+        self.comboDropDownPlan = qt.QWidget()
+        self.comboDropDownPlanLayout = qt.QHBoxLayout(self.comboDropDownPlan)
+        self.comboDropDownPlanLayout.addWidget(self.dropDownPlanLabel)
+        self.comboDropDownPlanLayout.addWidget(self.dropDownPlan)
+
         self.comboDropDownMovement = qt.QWidget()
         self.comboDropDownMovementLayout = qt.QHBoxLayout(self.comboDropDownMovement)
         self.comboDropDownMovementLayout.addWidget(self.dropDownMovementLabel)
@@ -193,6 +289,31 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.resetNeedleButton.enabled = False
         self.resetNeedleButton.connect("clicked(bool)", self.onResetNeedleButton)
 
+        # recording playback controls: speed, frame stepping and scrubbing
+        self.playbackSpeedLabel = qt.QLabel("Speed: ")
+        self.playbackSpeedLabel.setAlignment(qt.Qt.AlignCenter)
+        self.playbackSpeed = qt.QDoubleSpinBox()
+        self.playbackSpeed.setRange(MIN_SPEED, MAX_SPEED)
+        self.playbackSpeed.setSingleStep(0.1)
+        self.playbackSpeed.setDecimals(1)
+        self.playbackSpeed.setSuffix("x")
+        self.playbackSpeed.setValue(1.0)
+        self.playbackSpeed.toolTip = "Playback speed of the recording"
+        self.playbackSpeed.valueChanged.connect(self.onPlaybackSpeedChanged)
+
+        self.stepBackButton = qt.QPushButton("<")
+        self.stepBackButton.toolTip = "Pause and step one frame back"
+        self.stepBackButton.connect("clicked(bool)", self.onStepBackClicked)
+        self.stepForwardButton = qt.QPushButton(">")
+        self.stepForwardButton.toolTip = "Pause and step one frame forward"
+        self.stepForwardButton.connect("clicked(bool)", self.onStepForwardClicked)
+
+        self.playbackSlider = qt.QSlider(qt.Qt.Horizontal)
+        self.playbackSlider.toolTip = "Scrub through the recording"
+        self.playbackSlider.valueChanged.connect(self.onPlaybackSliderMoved)
+        self.playbackTimeLabel = qt.QLabel("")
+        self.setPlaybackControlsEnabled(False)
+
         self.dropDownViewSelector = qt.QComboBox()
         self.dropDownViewSelectorLabel = qt.QLabel("Select View: ")
         self.dropDownViewSelectorLabel.enabled = True
@@ -234,9 +355,18 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
                 [None, self.comboViewSelectOrder],
                 [None, self.loadEnvironmentButton],
                 [None, self.clearEnvironmentButton],
+                [None, self.comboDropDownPlan],
                 [None, self.needleSettings],
                 [None, self.streamingCheckBoxWidget, self.comboDropDownMovement],
                 [None, self.StartButton, self.resetNeedleButton],
+                [
+                    None,
+                    self.playbackSpeedLabel,
+                    self.playbackSpeed,
+                    self.stepBackButton,
+                    self.stepForwardButton,
+                ],
+                [None, self.playbackSlider, self.playbackTimeLabel],
                 [None, self.toggleVisualizersWidget],
             ],
         )
@@ -285,6 +415,11 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         # update color shifting regions every {interval} ms
         interval = 20
 
+        # scene nodes of plans loading in the background are created once they are loaded
+        self.planLoadTimer = qt.QTimer()
+        self.planLoadTimer.setInterval(200)
+        self.planLoadTimer.connect("timeout()", self.onPlanLoadTimeout)
+
         self.regionColorTimer = qt.QTimer()
         self.regionColorTimer.setInterval(interval)
         self.regionColorTimer.connect("timeout()", self.updateRegionColor)
@@ -364,17 +499,11 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
                 controller.setLightBlueBackground()
             self.backgroundBlue = True
     
+    # the funnel of the active plan is shown as a segmentation with the skin, as a model without
     def onToggleSkin(self):
-        if self.skinVisible:
-            slicer.mrmlScene.GetFirstNodeByName("Segmentation_3").GetDisplayNode().SetVisibility(False)
-            slicer.mrmlScene.GetFirstNodeByName("funnel-segmentation").GetDisplayNode().SetVisibility(False)
-            slicer.mrmlScene.GetFirstNodeByName("needle-funnel").GetDisplayNode().SetVisibility(True)
-            self.skinVisible = False
-        else:
-            slicer.mrmlScene.GetFirstNodeByName("Segmentation_3").GetDisplayNode().SetVisibility(True)
-            slicer.mrmlScene.GetFirstNodeByName("funnel-segmentation").GetDisplayNode().SetVisibility(True)
-            slicer.mrmlScene.GetFirstNodeByName("needle-funnel").GetDisplayNode().SetVisibility(False)
-            self.skinVisible = True
+        self.skinVisible = not self.skinVisible
+        slicer.mrmlScene.GetFirstNodeByName("Segmentation_3").GetDisplayNode().SetVisibility(self.skinVisible)
+        self.setPlanSceneVisible(self.plan_scenes[self.active_plan], True)
 
 
     def needleControl(self):
@@ -481,16 +610,23 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
     def eventChange(self):
         # record timestamps for when spacebar pressed, collect needle time/position/orientation data
         if not self.eventChanged:
-            with open(self.inputFolder + "timestamps.txt", "a") as file:
-                file.write("\n")
-            with open(self.inputFolder + "needle-timestamps.txt", "a") as file:
-                file.write("\n")
+            self.session_manager.startSession(self.participant, module="NeedleDeployment")
+            if self.binary_session_log:
+                self.startSessionLog()
+            else:
+                self.session_manager.log("timestamps").write("\n")
+                self.session_manager.log("needle-timestamps").write("\n")
             self.startTime = time.time()
             self.eventChanged = True
+        elif self.session_log is not None:
+            self.session_log.addEvent(time.monotonic(), self.eventCount)
         else:
             timePassed = time.time() - self.startTime
-            with open(self.inputFolder + "timestamps.txt", "a") as file:
-                file.write(f"{timePassed}\n")
+            self.session_manager.log("timestamps").write(f"{timePassed}\n")
+        # every spacebar press starts the next trial of the session index
+        if self.session_log is not None:
+            self.session_log.flush()
+        self.session_manager.startTrial(self.eventCount)
 
         # boolean flag to decide whether insertion region should be a sphere or flat cylinder (circle)
         flag = self.eventCount < 15
@@ -710,7 +846,15 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         return section
 
     def cleanup(self):
-        pass
+        self.stopPoseIngest()
+        if self.pose_source is not None:
+            self.pose_source.close()
+        if self.session_log is not None:
+            self.session_log.close()
+        self.session_manager.close()
+        self.log_writer.close()
+        if self.plan_manager is not None:
+            self.plan_manager.close()
 
     # if streaming, read sensor updates, if recording selected, begin playback
     def onStartNeedleClicked(self):
@@ -725,6 +869,9 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             self.needle_update = False
             self.StartButton.text = "Start needle"
             self.timer.stop()
+            self.stopPoseIngest()
+            if self.playback is not None:
+                self.playback.stop()
             self.resetNeedleButton.enabled = True
 
         # if not yet running, turn it on
@@ -736,8 +883,66 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             self.streamingCheckBox.enabled = False
             self.needle_update = True
             self.StartButton.text = "Stop needle"
+            if self.stream_live_data:
+                self.startPoseIngest()
+            elif self.playback is not None:
+                self.playback.start()
             self.timer.start()
 
+    # live poses are read and parsed on a worker thread, the refresh timer only picks up the newest one
+    def startPoseIngest(self):
+        self.stopPoseIngest()
+        self.latest_pose.clear()
+        self.latest_pose.resetCounters()
+        self.pose_interpolator.clear()
+        self.pose_predictor.reset()
+        self.pipeline_latency = 0.0
+        self.ingest_thread = PoseIngestThread(self.pose_source, self.latest_pose)
+        self.ingest_thread.start()
+
+        if self.refresh_mode == "event":
+            self.pose_notifier = qt.QSocketNotifier(
+                self.latest_pose.notifier(), qt.QSocketNotifier.Read
+            )
+            self.pose_notifier.connect("activated(int)", self.onPoseAvailable)
+            # file-change notifications wake the ingest thread before its next adaptive poll
+            if self.stream_source in ("file", "ring"):
+                self.tracker_watcher = qt.QFileSystemWatcher()
+                self.tracker_watcher.addPath(self.needle_file)
+                self.tracker_watcher.connect(
+                    "fileChanged(QString)", self.onTrackerFileChanged
+                )
+            self.timer.setInterval(self.event_fallback_interval)
+
+    def stopPoseIngest(self):
+        if self.ingest_thread is not None:
+            self.ingest_thread.stop()
+            self.ingest_thread = None
+            print("Pose ingestion: " + self.latest_pose.summary())
+        if self.pose_notifier is not None:
+            self.pose_notifier.setEnabled(False)
+            self.pose_notifier.disconnect("activated(int)", self.onPoseAvailable)
+            self.pose_notifier = None
+            self.latest_pose.closeNotifier()
+        if self.tracker_watcher is not None:
+            self.tracker_watcher.disconnect(
+                "fileChanged(QString)", self.onTrackerFileChanged
+            )
+            self.tracker_watcher = None
+        self.timer.setInterval(self.refresh_interval)
+
+    # event refresh mode: a new pose was published by the ingest thread
+    def onPoseAvailable(self, socket):
+        if self.needle_update:
+            self.onNeedleRefresh()
+
+    def onTrackerFileChanged(self, path):
+        if self.ingest_thread is not None:
+            self.ingest_thread.wake()
+        # watch is dropped when the tracker replaces the file
+        if path not in self.tracker_watcher.files():
+            self.tracker_watcher.addPath(path)
+
     def onTimeOut(self):
         self.timer.stop()
         if self.needle_update:
@@ -745,59 +950,258 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             self.timer.start()
 
     def onNeedleRefresh(self):
-        if (not os.path.isfile(self.needle_file)) or (
-            not os.path.exists(self.needle_file)
-        ):
-            print(self.needle_file + " does not exist!")
-            return False
-
         # pre-recorded data
         if not self.stream_live_data:
+            if (not os.path.isfile(self.needle_file)) or (
+                not os.path.exists(self.needle_file)
+            ):
+                print(self.needle_file + " does not exist!")
+                return False
+
             if (
-                not self.needle_data
+                self.playback is None or self.playback_file != self.needle_file
             ):  # start streaming for the first time: load data from file
-                self.needle_data = self.loadDataFromFile(self.needle_file, 0)
-                self.needle_pose_index = 0
+                self.loadPlayback()
+                self.playback.start()
 
-            if self.needle_pose_index >= len(self.needle_data) - 1:  # last line reached
+            if self.playback.finished():  # last line reached
                 self.onStartNeedleClicked()  # click 'stop' button
-                self.needle_pose_index = 0
+                print("Playback: " + self.playback.summary())
+                self.playback.rewind()
 
-            self.needle_pose_index += 1
+            return self.updatePlayback()
 
-        # live data via ROS
+        # live data via ROS, samples published by the ingest thread since the last refresh.
+        # Only the newest one moves the needle, the intermediate ones are only logged.
         else:
-            d = self.loadDataFromFile(self.needle_file, 0)
-            if not d == []:
-                self.needle_data = d
-
-        data = self.needle_data[self.needle_pose_index]
-        if not len(data) == 7:
-            print("Unexpected file format")
-            print(data)
-            return False
+            samples = self.latest_pose.takeSamples()
+            if self.interpolate_poses:
+                self.pose_interpolator.addSamples(samples)
+                # the pose shown is between samples, so none of them gets an applied time
+                self.logNeedlePoses(samples)
+                pose = self.pose_interpolator.sample(time.time())
+                if pose is None:
+                    return False
+                return self.applyNeedlePose(pose[0:3], pose[3:7])
+            if not samples:
+                return False
+            if self.predict_poses:
+                return self.updateNeedlePredicted(samples)
+            self.logNeedlePoses(samples[:-1])
+            newest = samples[-1]
+            return self.updateNeedle(newest.pose[0:3], newest.pose[3:7], newest)
+
+    # show the recorded pose for the current playback time
+    def updatePlayback(self):
+        pose = self.playback.update()
+        self.needle_pose_index = self.playback.index
+        self.updatePlaybackControls()
+        return self.updateNeedle(pose[0:3], pose[3:7])
+
+    # load the selected recording, kept while the same recording is selected so
+    # restarting or seeking never parses the file again
+    def loadPlayback(self):
+        if self.playback is not None and self.playback_file == self.needle_file:
+            return
+        try:
+            # memory map of the binary copy, the text file is only parsed when it changes
+            self.needle_data = self.recording_library.load(
+                os.path.basename(self.needle_file)
+            )
+        except KeyError:  # not in the recordings folder
+            self.needle_data = self.loadDataFromFile(self.needle_file, 0)
+        self.playback = PlaybackEngine(
+            self.needle_data,
+            rate=self.recording_rate,
+            interpolate=self.interpolate_poses,
+        )
+        self.playback.setSpeed(self.playbackSpeed.value)
+        self.playback_file = self.needle_file
+        self.playbackSlider.blockSignals(True)
+        self.playbackSlider.setRange(0, len(self.playback) - 1)
+        self.playbackSlider.blockSignals(False)
+        self.updatePlaybackControls()
+
+    def setPlaybackControlsEnabled(self, enabled):
+        for widget in [
+            self.playbackSpeedLabel,
+            self.playbackSpeed,
+            self.stepBackButton,
+            self.stepForwardButton,
+            self.playbackSlider,
+            self.playbackTimeLabel,
+        ]:
+            widget.enabled = enabled
+
+    # move the scrub slider and time display to the playback position
+    def updatePlaybackControls(self):
+        self.playbackSlider.blockSignals(True)
+        self.playbackSlider.setValue(self.playback.index)
+        self.playbackSlider.blockSignals(False)
+        self.playbackTimeLabel.text = (
+            f"{self.playback.currentTime():.2f} / {self.playback.duration:.2f} s"
+        )
+
+    # show the frame at the playback position without logging it (seeking, stepping)
+    def showPlaybackFrame(self):
+        pose = self.playback.update()
+        self.needle_pose_index = self.playback.index
+        self.updatePlaybackControls()
+        self.applyNeedlePose(pose[0:3], pose[3:7])
 
-        pos = data[0:3]
-        quat = data[3:7]
+    def onPlaybackSpeedChanged(self, speed):
+        if self.playback is not None:
+            self.playback.setSpeed(speed)
 
-        success = self.updateNeedle(pos, quat)
-        return success
+    def onStepBackClicked(self):
+        self.stepPlayback(-1)
 
-    def updateNeedle(self, pos, quat):
+    def onStepForwardClicked(self):
+        self.stepPlayback(1)
+
+    # pause playback (same as clicking stop) and show a neighbouring frame
+    def stepPlayback(self, frames):
+        if self.playback is None:
+            return
+        if self.needle_update:
+            self.onStartNeedleClicked()
+        self.playback.step(frames)
+        self.showPlaybackFrame()
+
+    def onPlaybackSliderMoved(self, index):
+        if self.playback is None:
+            return
+        self.playback.seek(index)
+        self.showPlaybackFrame()
+
+    # show and log a pose, sample is the live PoseSample it came from
+    def updateNeedle(self, pos, quat, sample=None):
         if len(pos) != 3 or len(quat) != 4:
             return False
+        if sample is None:
+            now_ns = time.perf_counter_ns()
+            sample = PoseSample(time.time(), list(pos) + list(quat), now_ns, now_ns)
+        applied = self.applyNeedlePose(pos, quat)
+        self.logNeedlePoses([sample], applied_ns=self.applied_ns)
+        return applied
+
+    # filter the new samples and show the pose extrapolated to the time it reaches the screen
+    def updateNeedlePredicted(self, samples):
+        for sample in samples:
+            self.pose_predictor.update(sample.timestamp, sample.pose)
+        newest = samples[-1]
+        latency = time.time() - newest.timestamp + self.render_latency
+        # smoothed, a single late frame should not make the needle jump ahead
+        if self.pipeline_latency == 0.0:
+            self.pipeline_latency = latency
+        self.pipeline_latency = 0.9 * self.pipeline_latency + 0.1 * latency
+        pose = self.pose_predictor.predict(self.pipeline_latency)
+        applied = self.applyNeedlePose(pose[0:3], pose[3:7])
+
+        # the newest sample is the one shown, extrapolated
+        self.logNeedlePoses(samples, applied_ns=self.applied_ns)
+        self.logNeedlePoses(
+            [PoseSample(newest.timestamp + self.pipeline_latency, pose)],
+            "needle-predicted.txt",
+        )
+        return applied
+
+    # move the needle model to a tracker pose (without logging it)
+    def applyNeedlePose(self, pos, quat):
         current = self.getTransformRot(pos, self.quaternionToRotationMatrix(quat))
         T = np.matmul(self.needle_registration, current)
         # print(T)
-        if self.startTime is not None:
-            timePassed = time.time() - self.startTime
-            with open(self.inputFolder + "needle-timestamps.txt", "a") as file:
-                file.write(
-                    f"{timePassed} {pos[0]} {pos[1]} {pos[2]} {quat[0]} {quat[1]} {quat[2]} {quat[3]}\n"
-                )
+        self.needle_scores = None
         self.composite_needle.SetMatrixTransformToParent(self.npToVtkMatrix(T))
+        # the plan objects follow the needle in onNeedleMove before this returns
+        self.applied_ns = time.perf_counter_ns()
         return True
 
+    # begin the binary log of a session, with what is needed to rescore it offline
+    def startSessionLog(self):
+        self.session_log = SessionLogWriter(
+            self.session_manager.log(SESSION_LOG_NAME, SESSION_LOG_EXTENSION)
+        )
+        self.startLoggedSession()
+
+    # header of a new session in the binary log, with the registration and plan poses are scored with
+    def startLoggedSession(self):
+        self.session_log.startSession(
+            registration=self.needle_registration,
+            plan_hash=self.needle_plan.content_hash,
+            plan=self.active_plan,
+            use_plan_orientation=self.use_plan_orientation,
+        )
+
+    # append needle poses to the needle-timestamps (or filename) log of the session with their
+    # own capture times, or to the binary session log. applied_ns is the perf_counter_ns time
+    # the last sample was shown at, -1 if none was
+    def logNeedlePoses(self, samples, filename="needle-timestamps.txt", applied_ns=-1):
+        if self.startTime is None or not samples:
+            return
+        if self.session_log is not None and filename == "needle-timestamps.txt":
+            self.logSessionPoses(samples, applied_ns)
+            return
+        self.session_manager.log(os.path.splitext(filename)[0]).write(
+            "".join(
+                f"{sample.timestamp - self.startTime} {sample.pose[0]} {sample.pose[1]} {sample.pose[2]} "
+                f"{sample.pose[3]} {sample.pose[4]} {sample.pose[5]} {sample.pose[6]}\n"
+                for sample in samples
+            )
+        )
+
+    # append needle poses and their clock times to the binary session log. The last sample, if
+    # it was shown (applied_ns), is logged with the scores shown on the legends for it; the
+    # others were never shown and are left unscored
+    def logSessionPoses(self, samples, applied_ns=-1):
+        poses = np.array([sample.pose for sample in samples], dtype=np.float64)
+        # sample times are time.time(), log records use the monotonic clock
+        times = np.array([sample.timestamp for sample in samples]) + (
+            time.monotonic() - time.time()
+        )
+        sample_ns = [-1 if sample.sample_ns is None else sample.sample_ns for sample in samples]
+        ingest_ns = [-1 if sample.ingest_ns is None else sample.ingest_ns for sample in samples]
+        applied = np.full(len(samples), -1, dtype=np.int64)
+        applied[-1] = applied_ns
+        shown = 1 if applied_ns >= 0 and self.needle_scores is not None else 0
+        unscored = len(samples) - shown
+        if unscored:
+            self.session_log.addPoses(
+                times[:unscored],
+                poses[:unscored],
+                self.eventCount,
+                None,
+                sample_ns[:unscored],
+                ingest_ns[:unscored],
+                applied[:unscored],
+            )
+        if shown:
+            self.session_log.addPoses(
+                times[unscored:],
+                poses[unscored:],
+                self.eventCount,
+                self.needle_scores,
+                sample_ns[unscored:],
+                ingest_ns[unscored:],
+                applied[unscored:],
+            )
+
+    # fill the recording dropdown from the recordings folder, with their metadata as tooltips
+    def populateRecordings(self):
+        self.dropDownMovement.clear()
+        self.dropDownMovement.addItem("")
+        for recording in self.recording_library.scan():
+            self.dropDownMovement.addItem(recording.name)
+            self.dropDownMovement.setItemData(
+                self.dropDownMovement.count - 1,
+                self.recording_library.describe(recording.name),
+                qt.Qt.ToolTipRole,
+            )
+        for index in range(self.dropDownMovement.model().rowCount()):
+            self.dropDownMovement.setItemData(
+                index, qt.Qt.AlignCenter, qt.Qt.TextAlignmentRole
+            )
+
     # on recording selection in dropdown
     def onDropDownMovementSelect(self, index):
         text = self.dropDownMovement.itemText(index)
@@ -807,7 +1211,15 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         else:
             self.StartButton.enabled = True
             self.needleMovementSelected = True
-        self.needle_file = self.inputFolder + text
+        if text == "":
+            self.needle_file = self.inputFolder
+        else:
+            self.needle_file = os.path.join(self.recordings_folder, text)
+        if self.needleMovementSelected and os.path.isfile(self.needle_file):
+            self.loadPlayback()
+        self.setPlaybackControlsEnabled(
+            self.needleMovementSelected and self.playback is not None
+        )
 
     # on check/uncheck stream data checkbox
     def onStreamingCheck(self):
@@ -818,9 +1230,19 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             self.dropDownMovement.enabled = False
             self.dropDownMovementLabel.enabled = False
             self.stream_live_data = True
-            self.needle_file = self.inputFolder + "needle-tracker.txt"
+            if self.stream_source == "ring":
+                self.needle_file = self.inputFolder + "needle-tracker.ring"
+            else:
+                self.needle_file = self.inputFolder + "needle-tracker.txt"
+            self.pose_source = createPoseSource(
+                self.stream_source, self.needle_file, port=self.stream_port
+            )
             self.StartButton.enabled = True
         else:
+            self.stopPoseIngest()
+            if self.pose_source is not None:
+                self.pose_source.close()
+                self.pose_source = None
             self.StartButton.enabled = False
             self.stream_live_data = False
             self.needle_file = self.inputFolder
@@ -870,7 +1292,11 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
     # reset needle position and associated variables in 3d space (warning: breaks registration if streaming data)
     def onResetNeedleButton(self):
         self.needle_pose_index = 0
-        self.needle_data = []
+        # the loaded recording is kept, selecting it again only rewinds it
+        if self.playback is not None:
+            self.playback.stop()
+            self.playback.rewind()
+            self.updatePlaybackControls()
 
         # TODO update registration reset
         # self.needle_registration = np.eye(4)
@@ -913,6 +1339,16 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.StartButtonHotkey = None
         
         self.clearNeedleControls()
+        # everything logged so far is written before the logs are reopened for the next session
+        if self.session_log is not None:
+            self.session_log.close()
+        self.session_manager.close()
+        self.log_writer.close()
+        self.planLoadTimer.stop()
+        self.plan_manager.close()
+        self.dropDownPlan.blockSignals(True)
+        self.dropDownPlan.clear()
+        self.dropDownPlan.blockSignals(False)
 
         self.dropDownMovement.setCurrentIndex(0)
         self.dropDownViewSelector.setCurrentIndex(0)
@@ -925,6 +1361,8 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.resetNeedleButton.enabled = False
         self.dropDownMovement.enabled = False
         self.dropDownMovementLabel.enabled = False
+        self.dropDownPlan.enabled = False
+        self.dropDownPlanLabel.enabled = False
         self.loadEnvironmentButton.enabled = True
         self.toggleVisualizers.enabled = False
 
@@ -941,6 +1379,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.loadEnvironmentButton.enabled = False
         self.clearEnvironmentButton.enabled = True
 
+        self.populateRecordings()  # pick up recordings added since the module was opened
         self.createNeedlePlan()
         self.createCompositeNeedle()
         self.createPlanTracking()
@@ -955,6 +1394,8 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.resetNeedleButton.enabled = False
         self.dropDownMovement.enabled = True
         self.dropDownMovementLabel.enabled = True
+        self.dropDownPlan.enabled = True
+        self.dropDownPlanLabel.enabled = True
         self.toggleVisualizers.enabled = True
 
         self.setCameras()
@@ -979,45 +1420,40 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         needle_pos = self.getTransformMat(caller.GetName())
         needle_direction = needle_pos[:3, 2]
         needle_pos = needle_pos[:3, 3]
-        distance, index = self.ckdtree.query(needle_pos)
-        radius = self.funnel_radii[index]
-        transform = self.plan_transforms[index]
+        # closest plan point, searched from the one of the previous frame
+        projection = self.plan_tracker.project(needle_pos)
+        scores = scoreNeedleTips(
+            needle_pos, needle_direction, self.needle_plan, self.use_plan_orientation, projection
+        )
+        index = int(scores.index[0])
+        transform = self.planTransform(index)
 
-        self.updateAllowedAngle(index, transform, needle_pos, needle_direction)
+        self.updateAllowedAngle(index, transform, needle_pos, scores)
 
         if self.deviationCircle:
-            self.updateAllowedPos(index, transform, distance, radius)
+            self.updateAllowedPos(index, transform, scores)
         else:
-            self.updateAllowedPosDevLine(index, transform, needle_pos, distance, radius)
+            self.updateAllowedPosDevLine(index, transform, needle_pos, scores)
+
+        self.updateProgress(scores)
+        self.needle_scores = scores
+
+    # legend color, color map position and percentage for a precision score
+    def precisionColor(self, within, precision):
+        if not within:
+            return [1, 0, 0], 0, 0
+        colorPos = int(precision * (layouts.map_size - 1))
+        return layouts.colorMap(colorPos)[0], colorPos, round(precision * 100)
 
     # Set color for cone, angle accuracy color legend
-    def updateAllowedAngle(self, index, plan_transform, needle_pos, needle_direction):
+    def updateAllowedAngle(self, index, plan_transform, needle_pos, scores):
 
-        use_plan_orientation = False
         cone_height = 20
         
         #find color
-        cone_direction = self.cone_directions[index] if not use_plan_orientation else self.plan_directions[index]
-
-        cos_theta = np.dot(cone_direction, needle_direction) / (
-            np.linalg.norm(cone_direction) * np.linalg.norm(needle_direction)
+        color, colorPos, precision = self.precisionColor(
+            scores.angle_within[0], scores.angle_precision[0]
         )
-
-        cos_theta = np.clip(cos_theta, -1, 1)
-        theta = np.arccos(cos_theta)
-
-        # angle_difference = np.degrees(theta)
-        angle_difference = theta
-
-        if angle_difference > self.max_angle[index] / 2:
-            colorPos = 0
-            color = [1, 0, 0]
-            precision = 0
-        else:
-            precision = 1 - angle_difference / self.max_angle[index]
-            colorPos = int(precision * (layouts.map_size - 1))
-            color = layouts.colorMap(colorPos)[0]
-            precision = round(precision * 100)
         
         #update cone object
         model = self.makeCone(cone_height, np.degrees(self.max_angle[index]/2), 10)
@@ -1027,12 +1463,12 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         transform = self.getTransformMat(self.composite_needle.GetName())
 
         # update transform with cone orientation when data available
-        if use_plan_orientation:
-            transform = self.vtkToNpMatrix(plan_transform)
+        if self.use_plan_orientation:
+            transform = self.plan_transforms[index].copy()
             transform[:3,3] = needle_pos
         #compute cone orientation at actual needle position    
         else:
-            transform = self.cone_transforms[index]
+            transform = self.cone_transforms[index].copy()
             transform[:3,3] = needle_pos
 
         transform = self.npToVtkMatrix(transform)
@@ -1054,20 +1490,39 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             model, transform, "AllowedAngle", color, opacity
         )
 
+    # insertion progress along the plan, remaining path length to the Target and axial/lateral
+    # deviation of the current frame, shown on the progress legend
+    def updateProgress(self, scores):
+        self.needle_progress = PlanProgress(
+            float(scores.progress[0]),
+            float(scores.remaining[0]),
+            float(scores.axial_deviation[0]),
+            float(scores.lateral_deviation[0]),
+        )
+        progress = min(max(self.needle_progress.progress / 100, 0.0), 1.0)
+        color, colorPos, percent = self.precisionColor(True, progress)
+        self.updateLegendColor("ProgressLegend", color, colorPos, percent)
+
+        lines = [
+            f"{percent}%",
+            f"{self.needle_progress.remaining:.1f} mm left",
+            f"lateral {self.needle_progress.lateral_deviation:.1f} mm",
+        ]
+        # only off the plan's ends: before the start or past the Target
+        if abs(self.needle_progress.axial_deviation) >= 0.05:
+            lines.append(f"axial {self.needle_progress.axial_deviation:+.1f} mm")
+        self.colorTableLegends["ProgressLegendColorDisplayNode"].SetTitleText(
+            "Progress\n" + "\n".join(lines)
+        )
+
     # Set color, position and model for allowed position region
 
-    def updateAllowedPos(self, index, transform, distance, radius):
-        self.allowed_pos[0].SetPolyDataConnection(self.models[index].GetOutputPort())
+    def updateAllowedPos(self, index, transform, scores):
+        self.allowed_pos[0].SetPolyDataConnection(self.allowedPosModel(index).GetOutputPort())
         self.allowed_pos[2].SetMatrixTransformToParent(transform)
-        if distance > radius:
-            color = [1, 0, 0]
-            colorPos = 0
-            precision = 0
-        else:
-            precision = 1 - distance / radius
-            colorPos = int(precision * (layouts.map_size - 1))
-            color = layouts.colorMap(colorPos)[0]
-            precision = round(precision * 100)
+        color, colorPos, precision = self.precisionColor(
+            scores.position_within[0], scores.position_precision[0]
+        )
 
         self.allowed_pos[1].SetColor(color)
         self.updateLegendColor("AllowedPosLegend", color, colorPos, precision)
@@ -1075,7 +1530,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
     # Create object for allowed position
     def createAllowedPos(self):
 
-        transform = self.vtkToNpMatrix(self.plan_transforms[0])
+        transform = self.plan_transforms[0].copy()
 
         color = [0, 0, 1]
         opacity = 0.5
@@ -1085,10 +1540,9 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
             model, transform, "AllowedPosition", color, opacity
         )
 
-    def updateAllowedPosDevLine(self, index, transform, needle_pos, distance, radius):
-        distance_ipl, index_ipl = self.ckdinterpolated.query(needle_pos)
-
-        p1 = self.interpolated_positions[index_ipl]
+    def updateAllowedPosDevLine(self, index, transform, needle_pos, scores):
+        # from the closest point on the plan to the needle tip
+        p1 = scores.point[0]
         p2 = needle_pos
 
         # find angle between deviation line and plan direction to toggle line visibility
@@ -1114,16 +1568,9 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
         self.allowedPosDevLine[1].SetVisibility(visible)
 
-        if distance > radius:
-            color = [1, 0, 0]
-            colorPos = 0
-            precision = 0
-            visible = False
-        else:
-            precision = (1 - distance / radius) if radius > 0 else 0
-            colorPos = int(precision * (layouts.map_size - 1))
-            color = layouts.colorMap(colorPos)[0]
-            precision = round(precision * 100)
+        color, colorPos, precision = self.precisionColor(
+            scores.position_within[0], scores.position_precision[0]
+        )
 
         model = self.makeConnectingLine(p1, p2, 0.2)
 
@@ -1159,18 +1606,14 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
         self.createColorLegend("AllowedPosLegend", "Position", [0.98, 0.95], [0.13, 0.51])
         self.createColorLegend("AllowedAngleLegend", "Orientation", [0.89, 0.95], [0.13, 0.51])
+        self.createColorLegend("ProgressLegend", "Progress", [0.80, 0.95], [0.13, 0.51])
 
         # self.createColorLegend("AllowedPosLegend", "Position", [0.85, 0.4], [0.1, 0.85])
         # self.createColorLegend("AllowedAngleLegend", "Orientation", [0.98, 0.4], [0.1, 0.85])
 
-        # vtk models for allowed positions at each point using radius
-        self.models = []
-        for radius in self.funnel_radii:
-            model = self.makeCylinder(0.3, radius)
-            self.models.append(model)
-        print(len(self.models))
-
         self.deviationCircle = False
+        # measure the needle angle against the plan orientation instead of the cone axes
+        self.use_plan_orientation = False
 
         if self.deviationCircle:
             self.createAllowedPos()
@@ -1179,130 +1622,262 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
         self.createAllowedAngle()
 
-    def computeConeTransform(self, cone_direction):
-
-        z = -(cone_direction[0] + cone_direction[1]) / cone_direction[2]
-        x_dir = np.array([1,1,z])
-        x_dir = x_dir/np.linalg.norm(x_dir)
-        y_dir = np.cross(cone_direction, x_dir)
-        cone_transform = np.eye(4)
-        cone_transform[:3,0] = x_dir
-        cone_transform[:3,1] = y_dir
-        cone_transform[:3,2] = cone_direction
-
-        # x_dir = plan_transform[0:3,0]
-        # x_dir = [0,0,0]
-        # y_dir = np.cross(cone_direction, x_dir)
-        # y_dir = np.expand_dims(y_dir/np.linalg.norm(y_dir),1)
-        # cone_transform = plan_transform
-        # cone_transform[0:3, 1:2] = y_dir
-        # cone_transform[0:3, 2:3] = np.expand_dims(cone_direction,1)
-        return cone_transform
-
-    # loads needle deployment data and creates plan and funnel shapes
-    def createNeedlePlan(self):
-        path = self.inputFolder + "needle_deployment.txt"
-        data = np.array(self.loadDataFromFile(path, 1))
-
-        # organize data
-
-        # needle plan
-        self.plan_positions = data[:, 7:10]
-        self.interpolated_positions = []
-        prev = None
-        for pos in self.plan_positions:
-            if prev is not None:
-                interpolated = (pos + prev) / 2
-                self.interpolated_positions.append(interpolated)
-            self.interpolated_positions.append(pos)
-            prev = pos
-        self.interpolated_positions = np.array(self.interpolated_positions)
-
-
-        # ckdtree for nearest neighbor search
-        self.ckdtree = cKDTree(self.plan_positions)
-        self.ckdinterpolated = cKDTree(self.interpolated_positions)
-        plan_quaternions = data[:, 10:14]
-
-        # create collection of matrices with full plan transforms
-        plan_transforms = []
-        for quat in plan_quaternions:
-            plan_transforms.append(self.quaternionToRotationMatrix(quat))
+    # allowed position cylinder at plan point index
+    def allowedPosModel(self, index):
+        model = self.models.get(index)
+        if model is None:
+            model = self.models[index] = self.makeCylinder(0.3, self.funnel_radii[index])
+        return model
 
-        plan_transforms = np.array(plan_transforms)
-        self.plan_directions = plan_transforms[:, :, 2]
+    # VTK matrix of the plan frame at index, only made for the frames that are shown
+    def planTransform(self, index):
+        matrix = self.plan_vtk_transforms.get(index)
+        if matrix is None:
+            matrix = self.npToVtkMatrix(self.plan_transforms[index])
+            self.plan_vtk_transforms[index] = matrix
+        return matrix
 
-        # rotate transforms to align with allowable position axes
-        # plan_transforms = np.matmul(plan_transforms, self.rotateAroundX(np.radians(90)))
-        plan_transforms = np.round(plan_transforms, 2)
+    # loads the needle plans of the input folder (needle_deployment*.txt) in the background and
+    # shows needle_deployment.txt. The plan dropdown switches between them with selectPlan
+    def createNeedlePlan(self):
+        self.plan_manager = PlanManager()
+        names = self.plan_manager.scan(self.inputFolder)
+        self.populatePlans(names)
+        # the environment is built around a plan, the first one is waited for
+        self.plan_manager.plan(names[0])
+        self.selectPlan(names[0])
+        # scene nodes of the other plans are created as soon as they are loaded
+        self.planLoadTimer.start()
+
+    # plan and funnel meshes of a loaded plan, read from the plan cache or built and cached.
+    # VTK is only used on the main thread
+    def planMeshes(self, loaded):
+        cache = loaded.cache
+        plan_mesh = self.readPolyData(cache.meshPath("plan")) if loaded.cached else None
+        funnel_mesh = self.readPolyData(cache.meshPath("funnel")) if loaded.cached else None
+        if plan_mesh is None or funnel_mesh is None:
+            data = loaded.arrays["data"]
+            # num_points = data.shape[0]
+            interpolated_positions = loaded.arrays["interpolated_positions"]
+            num_points = interpolated_positions.shape[0]
+            plan_radii = np.full((num_points, 1), 0.1)
+            plan_mesh = self.makeTube(interpolated_positions, plan_radii)
+            # position deviation: distance to original plan, maximum allowable distance
+            position_dev = data[:, 14:16]
+            funnel_mesh = self.makeTube(data[:, 7:10], position_dev[:, 1])
+            self.savePlanCache(cache, loaded.arrays, plan_mesh, funnel_mesh)
+        return plan_mesh, funnel_mesh
+
+    # scene nodes of a loaded plan: plan and funnel lines and the target fiducial, hidden until
+    # the plan is activated
+    def createPlanScene(self, loaded):
+        plan_mesh, funnel_mesh = self.planMeshes(loaded)
+        suffix = "" if loaded.name == DEFAULT_PLAN else f" ({loaded.name})"
 
-        plan_transforms = np.concatenate(
-            (plan_transforms, self.plan_positions.reshape(-1, 3, 1)), axis=2
+        # create Line structures for the plan and the surrounding funnel
+        [plan_node, plan_display_node] = self.createLine(
+            plan_mesh, [0, 0, 1], 0.4, "needle-plan" + suffix
+        )
+        [funnel_node, funnel_display_node] = self.createLine(
+            funnel_mesh, [0, 0, 1], 0.2, "needle-funnel" + suffix
         )
-        self.plan_transforms = []
 
-        for transform in plan_transforms:
-            self.plan_transforms.append(self.npToVtkMatrix(transform))
+        # plan line lighting
+        plan_display_node.SetAmbient(1)
+        plan_display_node.SetDiffuse(0.65)
 
-        # actual trajectory
-        trajectory_positions = data[:, 0:3]
-        trajectory_quaternions = data[:, 3:7]
+        # create a target fiducial
+        target_node = self.createFiducial(loaded.arrays["data"][-1, 7:10], node_name="Target" + suffix)
+
+        scene = {
+            "suffix": suffix,
+            "plan_display_node": plan_display_node,
+            "funnel_node": funnel_node,
+            "funnel_display_node": funnel_display_node,
+            # made by createFunnelSegmentation
+            "funnel_segmentation": None,
+            "target_node": target_node,
+            # VTK matrices of planTransform and allowed position models of allowedPosModel
+            "vtk_transforms": {},
+            "models": {},
+        }
+        self.setPlanSceneVisible(scene, False)
+        self.plan_scenes[loaded.name] = scene
+        return scene
+
+    # show or hide the nodes of a plan, its funnel as a segmentation while the skin is shown
+    def setPlanSceneVisible(self, scene, visible):
+        segmentation = scene["funnel_segmentation"]
+        scene["plan_display_node"].SetVisibility(visible)
+        scene["funnel_display_node"].SetVisibility(
+            visible and (segmentation is None or not self.skinVisible)
+        )
+        if segmentation is not None:
+            segmentation.GetDisplayNode().SetVisibility(visible and self.skinVisible)
+        scene["target_node"].SetDisplayVisibility(visible)
+
+    # activate the selected plan once it is loaded and create the scene nodes of plans that
+    # finished loading, one per timeout so the views stay responsive
+    def onPlanLoadTimeout(self):
+        pending = self.plan_manager.pending
+        try:
+            loaded = self.plan_manager.poll()
+        except Exception as error:
+            print(f"Could not switch to plan {pending}: {error}")
+            self.showActivePlan()
+            loaded = None
+        if loaded is not None:
+            self.activatePlan(loaded)
+
+        new_plans = [
+            plan for plan in self.plan_manager.ready() if plan.name not in self.plan_scenes
+        ]
+        if new_plans:
+            self.createPlanScene(new_plans[0])
+        if (
+            not self.plan_manager.loading
+            and self.plan_manager.pending is None
+            and len(new_plans) <= 1
+        ):
+            self.planLoadTimer.stop()
+
+    # switch to a plan, right away if it is loaded or else once it is (onPlanLoadTimeout)
+    def selectPlan(self, name):
+        loaded = self.plan_manager.activate(name)
+        if loaded is None:
+            print(f"Plan {name} is still loading, it is shown once it is loaded")
+            self.planLoadTimer.start()
+        else:
+            self.activatePlan(loaded)
+
+    # make a loaded plan the one the needle is shown with and scored against: its arrays replace
+    # the current ones and its nodes are shown instead, nothing is rebuilt once it is loaded
+    def activatePlan(self, loaded):
+        name = loaded.name
+        scene = self.plan_scenes.get(name) or self.createPlanScene(loaded)
+        if self.funnel_segmentations and scene["funnel_segmentation"] is None:
+            self.createFunnelSegmentation(scene)
+        previous = self.plan_scenes.get(self.active_plan)
+        if previous is not None:
+            self.setPlanSceneVisible(previous, False)
+        self.setPlanSceneVisible(scene, True)
+        self.active_plan = name
+        self.plan_display_node = scene["plan_display_node"]
+        self.funnel_display_node = scene["funnel_display_node"]
+
+        data = loaded.arrays["data"]
+
+        # needle plan, and with segment midpoints for the plan tube
+        self.plan_positions = data[:, 7:10]
+        self.interpolated_positions = loaded.arrays["interpolated_positions"]
 
-        # position deviation: distance to original plan, maximum allowable distance
-        position_dev = data[:, 14:16]
+        # plan arrays used for scoring the needle pose, with the plan geometry for closest point search
+        self.needle_plan = loaded.plan
+        self.plan_tracker = loaded.tracker
+        self.plan_tracker.reset()
+        # (N, 4, 4) plan frames, VTK matrices are only made for the frames shown (planTransform)
+        self.plan_transforms = loaded.arrays["plan_transforms"]
+        self.plan_vtk_transforms = scene["vtk_transforms"]
+        self.plan_directions = self.needle_plan.directions
 
         # funnel radii
-        self.funnel_radii = data[:, 15]
+        self.funnel_radii = self.needle_plan.funnel_radii
+        # vtk models for allowed positions at each point using radius, made when first shown
+        self.models = scene["models"]
 
-        # orientation deviation: angle between simulated trajectory orientation and original plan, maximum allowable angle
-        orientation_dev = data[:, 16:18]
-        self.max_angle = orientation_dev[:, 1]
+        # orientation deviation: maximum allowable angle
+        self.max_angle = self.needle_plan.max_angle
 
         # precompute cone direction rotation components
-        self.cone_directions = data[:, 18:21]
-        self.cone_transforms = []
-        for direction in self.cone_directions:
-            self.cone_transforms.append(self.computeConeTransform(direction))
-
-        # create Line structures for the plan and the surrounding funnel
-        # num_points = data.shape[0]
-        num_points = self.interpolated_positions.shape[0]
-        plan_radii = np.full((num_points, 1), 0.1)
-        [plan_node, self.plan_display_node] = self.createLine(
-            self.interpolated_positions, plan_radii, [0, 0, 1], 0.4, "needle-plan"
-        )
-        [funnel_node, funnel_display_node] = self.createLine(
-            self.plan_positions, position_dev[:, 1], [0, 0, 1], 0.2, "needle-funnel"
-        )
-
-        # plan line lighting
-        self.plan_display_node.SetAmbient(1)
-        self.plan_display_node.SetDiffuse(0.65)
+        self.cone_directions = self.needle_plan.cone_directions
+        self.cone_transforms = loaded.arrays["cone_transforms"]
 
-        # create a target fiducial
-        self.createFiducial(self.plan_positions[-1, :])
-
-    def createLine(self, points, radii, color=[0, 0, 1], plan_opacity=0.5, name=" "):
+        # poses logged after a switch are scored against the new plan, the session goes on
+        if self.session_log is not None:
+            self.session_log.changePlan(
+                self.needle_plan.content_hash, self.eventCount, plan=self.active_plan
+            )
+        if self.composite_needle is not None:
+            self.onNeedleMove(self.composite_needle, None)
+
+    # fill the plan dropdown, plans still loading are loaded when selected
+    def populatePlans(self, names):
+        self.dropDownPlan.blockSignals(True)
+        self.dropDownPlan.clear()
+        for name in names:
+            self.dropDownPlan.addItem(name)
+        self.dropDownPlan.blockSignals(False)
+
+    # on plan selection in dropdown
+    def onDropDownPlanSelect(self, index):
+        name = self.dropDownPlan.itemText(index)
+        if self.plan_manager is None or not name or name == self.active_plan:
+            return
+        try:
+            self.selectPlan(name)
+        except Exception as error:
+            print(f"Could not switch to plan {name}: {error}")
+            self.showActivePlan()
+
+    # select the active plan in the dropdown again
+    def showActivePlan(self):
+        self.dropDownPlan.blockSignals(True)
+        self.dropDownPlan.setCurrentIndex(self.dropDownPlan.findText(self.active_plan))
+        self.dropDownPlan.blockSignals(False)
+
+    # derived plan arrays and meshes are saved for the next load of the same plan
+    def savePlanCache(self, cache, arrays, plan_mesh, funnel_mesh):
+        try:
+            cache.prepare()
+            self.writePolyData(plan_mesh, cache.meshPath("plan"))
+            self.writePolyData(funnel_mesh, cache.meshPath("funnel"))
+            # arrays last, they mark the meshes as complete
+            cache.save(arrays)
+        except OSError as error:
+            print(f"Could not cache the needle plan: {error}")
+
+    # polydata of a .vtp file, None if it is missing or empty
+    def readPolyData(self, path):
+        if not os.path.isfile(path):
+            return None
+        reader = vtk.vtkXMLPolyDataReader()
+        reader.SetFileName(path)
+        reader.Update()
+        polydata = reader.GetOutput()
+        if polydata is None or polydata.GetNumberOfPoints() == 0:
+            return None
+        return polydata
+
+    def writePolyData(self, polydata, path):
+        writer = vtk.vtkXMLPolyDataWriter()
+        writer.SetFileName(path)
+        writer.SetInputData(polydata)
+        writer.SetDataModeToBinary()
+        if not writer.Write():
+            raise OSError(f"failed to write {path}")
+
+    # tube around the polyline through points, with radius radii (+ 0.05) at each point
+    def makeTube(self, points, radii):
         plan = vtk.vtkPolyData()
         pts = vtk.vtkPoints()
         npoints = len(points)
-        pts.SetNumberOfPoints(npoints)
-        for i in range(npoints):
-            pts.SetPoint(i, points[i][0], points[i][1], points[i][2])
+        pts.SetData(numpy_support.numpy_to_vtk(np.asarray(points, dtype=np.float64), deep=True))
+        # a single polyline through all points
+        id_type = numpy_support.get_numpy_array_type(vtk.VTK_ID_TYPE)
         polyline = vtk.vtkCellArray()
-        polyline.InsertNextCell(npoints)
-        for i in range(npoints):
-            polyline.InsertCellPoint(i)
+        polyline.SetData(
+            numpy_support.numpy_to_vtkIdTypeArray(np.array([0, npoints], dtype=id_type), deep=True),
+            numpy_support.numpy_to_vtkIdTypeArray(np.arange(npoints, dtype=id_type), deep=True),
+        )
         plan.SetPoints(pts)
         plan.SetLines(polyline)
 
-        radius_array = vtk.vtkDoubleArray()
-        radius_array.SetName("radius")
-        radius_array.SetNumberOfValues(npoints)
         # radius may have negative values so we just offset using the minimum value
         radii_offset = 0.05
-        for i in range(npoints):
-            radius_array.SetValue(i, radii[i] + radii_offset)
+        radius_array = numpy_support.numpy_to_vtk(
+            np.ravel(radii).astype(np.float64) + radii_offset, deep=True
+        )
+        radius_array.SetName("radius")
         plan.GetPointData().AddArray(radius_array)
 
         plan_filter = vtk.vtkTubeFilter()
@@ -1315,10 +1890,12 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         plan_filter.SetVaryRadiusToVaryRadiusByAbsoluteScalar()
         plan_filter.CappingOff()
         plan_filter.Update()
+        return plan_filter.GetOutput()
 
+    def createLine(self, polydata, color=[0, 0, 1], plan_opacity=0.5, name=" "):
         plan_node = slicer.vtkMRMLModelNode()
         plan_node.SetName(name)
-        plan_node.SetPolyDataConnection(plan_filter.GetOutputPort())
+        plan_node.SetAndObservePolyData(polydata)
 
         plan_display_node = slicer.vtkMRMLModelDisplayNode()
         plan_display_node.SetColor(color[0], color[1], color[2])
@@ -1330,13 +1907,14 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
         return plan_node, plan_display_node
 
-    def createFiducial(self, point, name=" "):
+    def createFiducial(self, point, name=" ", node_name="Target"):
 
         fiducial_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsFiducialNode")
-        fiducial_node.SetName("Target")
+        fiducial_node.SetName(node_name)
         fiducial_node.GetDisplayNode().SetSelectedColor([1, 0, 1])
         fiducial_node.SetDisplayVisibility(True)
         fiducial_node.AddControlPoint(point[0], point[1], point[2], name)
+        return fiducial_node
 
     # creates cloth associated nodes
     def createCloth(self):
@@ -1350,11 +1928,12 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         self.clothDisplay.SetColor(color)
         self.clothDisplay.SetVisibility(False)
     
-    def cleanSegmentations(self):
-        funnel = slicer.mrmlScene.GetFirstNodeByName('needle-funnel')
+    # funnel segmentation of a plan: its funnel model outside of the body
+    def createFunnelSegmentation(self, scene):
+        funnel = scene["funnel_node"]
         funnelSegNode = slicer.mrmlScene.AddNewNodeByClass('vtkMRMLSegmentationNode')
         funnelSegNode.CreateDefaultDisplayNodes()
-        funnelSegNode.SetName('funnel-segmentation')
+        funnelSegNode.SetName('funnel-segmentation' + scene["suffix"])
         slicer.modules.segmentations.logic().ImportModelToSegmentationNode(funnel, funnelSegNode)
         funnelSegNode.CreateClosedSurfaceRepresentation()
     
@@ -1372,6 +1951,19 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         segEditor.activeEffect().setParameter('ModifierSegmentID', 'Segment_1')
         segEditor.activeEffect().self().onApply()
 
+        funnelSegNode.GetDisplayNode().SetOpacity(.3)
+        funnelSegNode.GetDisplayNode().SetOpacity3D(.65)
+        scene["funnel_segmentation"] = funnelSegNode
+
+    def cleanSegmentations(self):
+        # funnel segmentation of the active plan, the other plans get theirs when activated
+        self.funnel_segmentations = True
+        scene = self.plan_scenes[self.active_plan]
+        self.createFunnelSegmentation(scene)
+        self.setPlanSceneVisible(scene, True)
+
+        segEditor = slicer.modules.segmenteditor.widgetRepresentation().self().editor
+
         # Increase opacity for vessels from .5 default
         slicer.mrmlScene.GetFirstNodeByName("Segmentation_1").GetDisplayNode().SetOpacity3D(.7)
 
@@ -1379,10 +1971,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
         slicer.mrmlScene.GetFirstNodeByName("Segmentation_3").GetDisplayNode().SetSegmentOverrideColor('Skin', 249/255, 203/255, 156/255)
         slicer.mrmlScene.GetFirstNodeByName("Segmentation_3").GetDisplayNode().SetOpacity3D(.65)
 
-        slicer.mrmlScene.GetFirstNodeByName("needle-funnel").GetDisplayNode().SetVisibility(False)
         slicer.mrmlScene.GetFirstNodeByName("Segmentation_4").SetDisplayVisibility(False)
-        funnelSegNode.GetDisplayNode().SetOpacity(.3)
-        funnelSegNode.GetDisplayNode().SetOpacity3D(.65)
 
         segEditor.setSegmentationNode(slicer.mrmlScene.GetFirstNodeByName('Segmentation_2'))
         segEditor.setSourceVolumeNode(slicer.mrmlScene.GetFirstNodeByName('LiverTissue'))
@@ -1883,10 +2472,7 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
     # creates markup representing steerable needle motion planning (currently unused)
     def createPlan(self):
-        plan_data = self.loadDataFromFile(
-            self.inputFolder + "plan.txt", ignoreFirstLines=1
-        )
-        plan = np.array(plan_data)
+        plan = self.loadDataFromFile(self.inputFolder + "plan.txt", ignoreFirstLines=1)
 
         plan_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode")
         plan_node.SetName("Plan")
@@ -2437,34 +3023,9 @@ class NeedleDeploymentWidget(ScriptedLoadableModuleWidget):
 
     def loadDataFromFile(self, fullPath, ignoreFirstLines=1):
         print("Loading points from " + str(fullPath))
-
-        planFile = open(fullPath)
-        lines = planFile.readlines()
-        count = 0
-
-        data = []
-        linecount = -1
-
-        for line in lines:
-            linecount += 1
-            if ignoreFirstLines > linecount:
-                continue
-            fields = line.split(" ")
-
-            if fields[-1] == "\n":  # Remove newline
-                fields = fields[:-1]
-
-            if fields[-1][-1] == "\n":  # Remove newline not separated from last number
-                fields[-1] = fields[-1][:-1]
-
-            if len(fields) > 1:
-                d = [float(f) for f in fields]
-                data.append(d)
-                count += 1
-
-        planFile.close()
-        print(str(count) + " lines loaded.")
-
+        # float64 array, one row per line, header lines skipped and column count checked
+        data = loadData(fullPath, ignoreFirstLines)
+        print(str(len(data)) + " lines loaded.")
         return data
 
 
@@ -2551,28 +3112,12 @@ class NeedleDeploymentLogic(ScriptedLoadableModuleLogic):
 
         return True
 
-    def readLastLine(self, filename):
-        fin = open(filename)
-        lines = fin.readlines()
-        pos = []
-        quat = []
-        if len(lines) > 0:
-            latestLine = lines[-1]
-            fields = latestLine.split(" ")
-            if fields[-1] == "\n":
-                n = len(fields)
-                fields = fields[0 : n - 1]
-
-            if len(fields) == 7:
-                fieldsPos = fields[:3]
-                fieldsQuat = fields[3:]
-                pos = map(float, fieldsPos)
-                quat = map(float, fieldsQuat)
-        # else:
-        # print(filename + " is empty!")
-
-        fin.close()
-        return [pos, quat]
+    # newest pose (pos + quat) in a tracker file, None if there is none. With count, the poses
+    # on the last count lines as an (N, 7) array instead. Only the end of the file is read.
+    def readLastLine(self, filename, count=None):
+        if count is not None:
+            return readLastPoses(filename, count)
+        return readLastPose(filename)
 
 
 class NeedleDeploymentTest(ScriptedLoadableModuleTest):
@@ -0,0 +1,5 @@
+"""Helpers shared by the needle interface modules.
+
+Everything in this package only depends on NumPy/SciPy so it can also be used
+outside of Slicer, e.g. for offline analysis of recorded sessions.
+"""
@@ -0,0 +1,330 @@
+"""Score recorded sessions against the needle plan in parallel.
+
+Usage (from the NeedleDeployment directory):
+
+    python -m NeedleDeploymentLib.batchscore SESSIONS_DIR [--plan PLAN_FILE_OR_DIR ...]
+        [--output scores.csv] [--workers N] [--registration registration.txt]
+
+The directory tree is searched for session logs and recordings:
+
+- needle-timestamps.txt: `t x y z qw qx qy qz` lines, a blank line at the start of
+  every session. The timestamps.txt next to it holds the spacebar presses of each
+  session (same blank line layout), which split a session into trials.
+- *.ndlog: binary session logs (see sessionlog), split into trials at their
+  spacebar events and scored with the registration and the plan they were
+  recorded with. Trials during which the plan was switched are skipped.
+- session folders (see sessions): each trial of the index is read on its own from
+  the binary log of the session, or its needle-timestamps log.
+- recording*.txt / demo*.txt: plain pose recordings, scored as a single trial.
+
+Binary logs name their plans by content hash, which is looked up among the --plan
+files (needle_deployment*.txt of the given folders, by default Resources/Data).
+Everything else is scored against the first plan file, needle_deployment.txt if
+it is among them.
+
+Each file is one task for a process pool, so only one file per worker is in memory
+at a time. Workers load the plans and build their KD-trees once, when they start.
+The per-trial results are written to one CSV table.
+"""
+
+import argparse
+import concurrent.futures
+import csv
+import fnmatch
+import os
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.planmanager import findPlanFiles
+from NeedleDeploymentLib.recordings import RECORDING_PATTERNS
+from NeedleDeploymentLib.scoring import NeedlePlan, scorePoses
+from NeedleDeploymentLib.sessionlog import (
+    POSE,
+    SESSION_LOG_EXTENSION,
+    SESSION_LOG_NAME,
+    SessionLog,
+)
+from NeedleDeploymentLib.sessions import (
+    isSessionDirectory,
+    loadTrial,
+    loadTrialLog,
+    readSessionIndex,
+)
+
+SESSION_LOG = "needle-timestamps.txt"
+MARKER_LOG = "timestamps.txt"
+
+COLUMNS = [
+    "file",
+    "session",
+    "trial",
+    "plan",
+    "frames",
+    "duration",
+    "position_precision",
+    "angle_precision",
+    "position_within",
+    "angle_within",
+    "final_distance",
+    "final_angle",
+    "final_position_precision",
+    "final_angle_precision",
+    "lateral_deviation",
+    "final_progress",
+    "final_remaining",
+]
+
+# plans of this worker process by content hash with their names, the default plan and the
+# registration, set by _initWorker
+_plans = {}
+_plan_names = {}
+_plan = None
+_registration = None
+
+
+def _initWorker(plan_paths, registration):
+    global _plan, _registration
+    for path in plan_paths:
+        plan = NeedlePlan.fromFile(path)
+        _plans.setdefault(plan.content_hash, plan)
+        _plan_names.setdefault(plan.content_hash, os.path.splitext(os.path.basename(path))[0])
+        if _plan is None:
+            _plan = plan
+    _registration = registration
+
+
+# plan files of the --plan arguments: files as given, the plan files of folders with the
+# default plan first
+def findPlans(paths):
+    plans = []
+    for path in paths:
+        plans.extend(findPlanFiles(path) if os.path.isdir(path) else [path])
+    return plans
+
+
+# plan the poses of a binary log were scored against, from the numbers (see
+# sessionlog.LoggedSession.plans) of the plans current at the poses
+def _loggedPlan(session, numbers):
+    hashes = {session.plans[number]["plan_hash"] for number in np.unique(numbers).tolist()}
+    if len(hashes) > 1:
+        raise ValueError(f"the plan was switched {len(hashes) - 1} times during the trial")
+    plan_hash = hashes.pop() if hashes else None
+    if plan_hash is None:
+        return _plan
+    if plan_hash not in _plans:
+        raise ValueError(f"plan {plan_hash[:12]} not found, pass its file with --plan")
+    return _plans[plan_hash]
+
+
+# summary row of a binary log trial scored against its plan, none if that is not known
+def _summarizeLoggedTrial(row, poses, times, registration, session, numbers):
+    try:
+        plan = _loggedPlan(session, numbers)
+    except ValueError as error:
+        print(f"Skipping {row['file']} session {row['session']} trial {row['trial']}: {error}")
+        return []
+    row.update(summarizeTrial(poses, times, registration, plan))
+    return [row]
+
+
+# split a log written with a blank line at the start of every session into one
+# (N, columns) array per session, empty sessions included so logs written side by side line up
+def readSessions(path, columns):
+    sessions = [[]]
+    with open(path) as file:
+        for line in file:
+            if line.strip():
+                sessions[-1].append(line)
+            else:
+                sessions.append([])
+    if not sessions[0]:
+        sessions.pop(0)  # nothing logged before the first session started
+    return [
+        np.loadtxt(lines, dtype=np.float64, ndmin=2) if lines else np.empty((0, columns))
+        for lines in sessions
+    ]
+
+
+# split a session (rows starting with a time column) at the marker times
+def splitTrials(session, markers):
+    if len(session) == 0:
+        return []
+    bounds = np.searchsorted(session[:, 0], np.asarray(markers).ravel(), side="left")
+    return [trial for trial in np.split(session, bounds) if len(trial)]
+
+
+def summarizeTrial(poses, times, registration=None, plan=None):
+    plan = plan if plan is not None else _plan
+    scores = scorePoses(poses, plan, registration)
+    return {
+        "plan": _plan_names.get(plan.content_hash, plan.content_hash[:12]),
+        "frames": len(poses),
+        "duration": float(times[-1] - times[0]) if len(times) else 0.0,
+        "position_precision": 100 * float(scores.position_precision.mean()),
+        "angle_precision": 100 * float(scores.angle_precision.mean()),
+        "position_within": 100 * float(scores.position_within.mean()),
+        "angle_within": 100 * float(scores.angle_within.mean()),
+        "final_distance": float(scores.distance[-1]),
+        "final_angle": float(np.degrees(scores.angle[-1])),
+        "final_position_precision": 100 * float(scores.position_precision[-1]),
+        "final_angle_precision": 100 * float(scores.angle_precision[-1]),
+        "lateral_deviation": float(scores.lateral_deviation.mean()),
+        "final_progress": float(scores.progress[-1]),
+        "final_remaining": float(scores.remaining[-1]),
+    }
+
+
+# score the trials of a session folder
+def scoreSessionDirectory(path):
+    index = readSessionIndex(path)
+    rows = []
+    binary = SESSION_LOG_NAME in index["logs"]
+    for entry in index["trials"]:
+        row = {"file": path, "session": 1, "trial": entry["trial"]}
+        if not binary:
+            samples = loadTrial(path, entry["trial"], os.path.splitext(SESSION_LOG)[0], index)
+            if len(samples):
+                row.update(summarizeTrial(samples[:, 1:8], samples[:, 0], _registration))
+                rows.append(row)
+            continue
+        for session in loadTrialLog(path, entry["trial"], SESSION_LOG_NAME, index).sessions:
+            registration = _registration if _registration is not None else session.registration
+            records = session.records
+            pose = records["kind"] == POSE
+            if not pose.any():
+                continue
+            poses = np.column_stack([records["position"][pose], records["quaternion"][pose]])
+            times, plans = records["time"][pose], session.recordPlans()[pose]
+            rows.extend(
+                _summarizeLoggedTrial(dict(row), poses, times, registration, session, plans)
+            )
+    return rows
+
+
+# score one session log, session folder or recording, returns one result row per trial
+def scoreFile(path, rate=50.0):
+    rows = []
+    if os.path.isdir(path):
+        rows = scoreSessionDirectory(path)
+    elif os.path.basename(path) == SESSION_LOG:
+        sessions = readSessions(path, 8)
+        marker_path = os.path.join(os.path.dirname(path), MARKER_LOG)
+        markers = readSessions(marker_path, 1) if os.path.isfile(marker_path) else []
+        for number, session in enumerate(sessions, 1):
+            session_markers = markers[number - 1] if number <= len(markers) else []
+            for trial, samples in enumerate(splitTrials(session, session_markers), 1):
+                row = {"file": path, "session": number, "trial": trial}
+                row.update(summarizeTrial(samples[:, 1:8], samples[:, 0], _registration))
+                rows.append(row)
+    elif path.endswith(SESSION_LOG_EXTENSION):
+        for number, session in enumerate(SessionLog(path).sessions, 1):
+            registration = _registration if _registration is not None else session.registration
+            # plan number as a last column, so it is split along with the poses
+            plans = session.recordPlans()[session.records["kind"] == POSE]
+            table = np.column_stack([session.poseTable(), plans])
+            for trial, samples in enumerate(splitTrials(table, session.eventTimes()), 1):
+                row = {"file": path, "session": number, "trial": trial}
+                rows.extend(
+                    _summarizeLoggedTrial(
+                        row, samples[:, 1:8], samples[:, 0], registration, session, samples[:, 8]
+                    )
+                )
+    else:
+        poses = loadData(path)
+        # leading timestamp column (t x y z qw qx qy qz) or a fixed sample rate
+        if poses.shape[1] == 8:
+            times, poses = poses[:, 0], poses[:, 1:]
+        else:
+            times = np.arange(len(poses)) / rate
+        if len(poses):
+            row = {"file": path, "session": 1, "trial": 1}
+            row.update(summarizeTrial(poses, times, _registration))
+            rows.append(row)
+    return rows
+
+
+# a failing file should not abort the whole run
+def _scoreFileTask(path, rate):
+    try:
+        return path, scoreFile(path, rate), None
+    except Exception as error:
+        return path, [], error
+
+
+def findLogs(root, patterns=None):
+    patterns = patterns or RECORDING_PATTERNS
+    paths = []
+    for directory, subdirectories, files in os.walk(root):
+        # a session folder is scored as a whole, from its index
+        if isSessionDirectory(directory):
+            paths.append(directory)
+            subdirectories[:] = []
+            continue
+        subdirectories.sort()
+        for name in sorted(files):
+            if (
+                name == SESSION_LOG
+                or name.endswith(SESSION_LOG_EXTENSION)
+                or any(fnmatch.fnmatch(name, p) for p in patterns)
+            ):
+                paths.append(os.path.join(directory, name))
+    return paths
+
+
+def scoreTree(root, plan_paths, output, workers=None, registration=None, rate=50.0):
+    plan_paths = findPlans([plan_paths] if isinstance(plan_paths, str) else plan_paths)
+    if not plan_paths:
+        raise ValueError("No plan files to score against")
+    paths = findLogs(root)
+    print(f"Scoring {len(paths)} files from {root}")
+    trials = 0
+    with open(output, "w", newline="") as file:
+        writer = csv.DictWriter(file, fieldnames=COLUMNS)
+        writer.writeheader()
+        with concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_initWorker,
+            initargs=(plan_paths, registration),
+        ) as executor:
+            # results come back in file order, each written as soon as it and its predecessors are done
+            for path, rows, error in executor.map(
+                _scoreFileTask, paths, [rate] * len(paths)
+            ):
+                if error is not None:
+                    print(f"Failed to score {path}: {error}")
+                    continue
+                writer.writerows(rows)
+                trials += len(rows)
+    print(f"{trials} trials written to {output}")
+    return trials
+
+
+def main():
+    default_plans = os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Resources", "Data"
+    )
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sessions", help="directory searched for session logs and recordings")
+    parser.add_argument(
+        "--plan",
+        action="append",
+        help="plan file or folder of needle_deployment*.txt plans, may be repeated (default: Resources/Data)",
+    )
+    parser.add_argument("--output", default="scores.csv", help="summary table (CSV)")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument(
+        "--registration",
+        help="4x4 tracker to plan transform (text), by default the one stored in binary logs, else identity",
+    )
+    parser.add_argument("--rate", type=float, default=50.0, help="sample rate of plain recordings in Hz")
+    args = parser.parse_args()
+
+    registration = np.loadtxt(args.registration) if args.registration else None
+    scoreTree(
+        args.sessions, args.plan or [default_plans], args.output, args.workers, registration, args.rate
+    )
+
+
+if __name__ == "__main__":
+    main()
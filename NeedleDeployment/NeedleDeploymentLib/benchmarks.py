@@ -0,0 +1,274 @@
+"""Micro-benchmarks for the data handling helpers, comparing them with the code they replaced.
+
+Usage (from the NeedleDeployment directory):
+
+    python -m NeedleDeploymentLib.benchmarks loader [--lines 1000000]
+    python -m NeedleDeploymentLib.benchmarks lastline [--size-gb 2] [--legacy-max-mb 256]
+    python -m NeedleDeploymentLib.benchmarks plan [--samples 100000]
+    python -m NeedleDeploymentLib.benchmarks nearest [--samples 1000000] [--frames 20000]
+"""
+
+import argparse
+import math
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.plans import (
+    PlanGeometry,
+    PlanTracker,
+    coneTransforms,
+    insertMidpoints,
+    planTransforms,
+)
+from NeedleDeploymentLib.tracking import readLastPose
+
+
+# loadDataFromFile as it was before NeedleDeploymentLib.datafiles, kept for comparison
+def legacyLoadDataFromFile(fullPath, ignoreFirstLines=1):
+    planFile = open(fullPath)
+    lines = planFile.readlines()
+    data = []
+    linecount = -1
+    for line in lines:
+        linecount += 1
+        if ignoreFirstLines > linecount:
+            continue
+        fields = line.split(" ")
+        if fields[-1] == "\n":
+            fields = fields[:-1]
+        if fields[-1][-1] == "\n":
+            fields[-1] = fields[-1][:-1]
+        if len(fields) > 1:
+            data.append([float(f) for f in fields])
+    planFile.close()
+    return data
+
+
+# NeedleDeploymentLogic.readLastLine as it was before tracking.readLastPose, kept for comparison
+def legacyReadLastLine(filename):
+    fin = open(filename)
+    lines = fin.readlines()
+    pos = []
+    quat = []
+    if len(lines) > 0:
+        fields = lines[-1].split(" ")
+        if fields[-1] == "\n":
+            fields = fields[:-1]
+        if len(fields) == 7:
+            pos = map(float, fields[:3])
+            quat = map(float, fields[3:])
+    fin.close()
+    return [pos, quat]
+
+
+# NeedleDeploymentWidget.quaternionToRotationMatrix, used per plan sample before plans.planTransforms
+def legacyQuaternionToRotationMatrix(quaternion):
+    q = np.array(quaternion, dtype=np.float64, copy=True)
+    n = np.dot(q, q)
+    if n < 0.0000001:
+        return np.identity(3)
+
+    q *= math.sqrt(2.0 / n)
+    q = np.outer(q, q)
+    return np.array(
+        [
+            [1.0 - q[2, 2] - q[3, 3], q[1, 2] - q[3, 0], q[1, 3] + q[2, 0]],
+            [q[1, 2] + q[3, 0], 1.0 - q[1, 1] - q[3, 3], q[2, 3] - q[1, 0]],
+            [q[1, 3] - q[2, 0], q[2, 3] + q[1, 0], 1.0 - q[1, 1] - q[2, 2]],
+        ]
+    )
+
+
+# NeedleDeploymentWidget.computeConeTransform, used per plan sample before plans.coneTransforms
+def legacyComputeConeTransform(cone_direction):
+    z = -(cone_direction[0] + cone_direction[1]) / cone_direction[2]
+    x_dir = np.array([1, 1, z])
+    x_dir = x_dir / np.linalg.norm(x_dir)
+    y_dir = np.cross(cone_direction, x_dir)
+    cone_transform = np.eye(4)
+    cone_transform[:3, 0] = x_dir
+    cone_transform[:3, 1] = y_dir
+    cone_transform[:3, 2] = cone_direction
+    return cone_transform
+
+
+# the array part of createNeedlePlan before plans.py (without the per-row VTK matrices)
+def legacyPlanPreprocessing(data):
+    plan_positions = data[:, 7:10]
+    interpolated_positions = []
+    prev = None
+    for pos in plan_positions:
+        if prev is not None:
+            interpolated_positions.append((pos + prev) / 2)
+        interpolated_positions.append(pos)
+        prev = pos
+    interpolated_positions = np.array(interpolated_positions)
+
+    plan_transforms = np.array([legacyQuaternionToRotationMatrix(q) for q in data[:, 10:14]])
+    plan_transforms = np.round(plan_transforms, 2)
+    plan_transforms = np.concatenate((plan_transforms, plan_positions.reshape(-1, 3, 1)), axis=2)
+    cone_transforms = [legacyComputeConeTransform(d) for d in data[:, 18:21]]
+    return interpolated_positions, plan_transforms, np.array(cone_transforms)
+
+
+def planPreprocessing(data):
+    return (
+        insertMidpoints(data[:, 7:10]),
+        planTransforms(data[:, 7:10], data[:, 10:14]),
+        coneTransforms(data[:, 18:21]),
+    )
+
+
+# synthetic needle_deployment.txt rows: a smooth curved path with unit quaternions and cone axes
+def syntheticPlan(samples, seed=0):
+    rng = np.random.default_rng(seed)
+    data = np.zeros((samples, 21))
+    t = np.linspace(0.0, 1.0, samples)
+    data[:, 7:10] = np.column_stack([100 * t, 20 * np.sin(3 * t), -50 * t])
+    quats = 1.0 + np.cumsum(rng.normal(scale=0.001, size=(samples, 4)), axis=0)
+    data[:, 10:14] = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    directions = np.column_stack([np.ones(samples), 0.5 * np.cos(t), -np.ones(samples)])
+    data[:, 18:21] = directions / np.linalg.norm(directions, axis=1, keepdims=True)
+    return data
+
+
+# synthetic recording: a slow random walk in position with slowly turning unit quaternions
+def writeSyntheticRecording(path, lines, seed=0):
+    rng = np.random.default_rng(seed)
+    poses = np.empty((lines, 7))
+    poses[:, 0:3] = np.cumsum(rng.normal(scale=0.1, size=(lines, 3)), axis=0)
+    quats = 1.0 + np.cumsum(rng.normal(scale=0.001, size=(lines, 4)), axis=0)
+    poses[:, 3:7] = quats / np.linalg.norm(quats, axis=1, keepdims=True)
+    np.savetxt(path, poses, fmt="%g")
+    return poses
+
+
+def _time(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return time.perf_counter() - start, result
+
+
+def benchmarkLoader(lines=1000000):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "recording-benchmark.txt")
+        print(f"Writing {lines} line synthetic recording ...")
+        writeSyntheticRecording(path, lines)
+        size = os.path.getsize(path) / 1e6
+
+        # what callers actually need: the list of rows converted to an array
+        legacy, legacy_data = _time(lambda: np.array(legacyLoadDataFromFile(path, 0)))
+        new, new_data = _time(loadData, path)
+
+    assert np.array_equal(legacy_data, new_data)
+    print(f"{lines} lines, {size:.1f} MB")
+    print(f"  legacy loadDataFromFile + np.array: {legacy:.3f} s")
+    print(f"  datafiles.loadData:                 {new:.3f} s ({legacy / new:.1f}x)")
+
+
+# grow a tracker log to at least `size` bytes by appending copies of a block of pose lines
+def growTrackerLog(path, size, block_lines=100000):
+    rng = np.random.default_rng(0)
+    poses = rng.normal(scale=100.0, size=(block_lines, 7))
+    block = b"".join(b"%g %g %g %g %g %g %g\n" % tuple(pose) for pose in poses)
+    with open(path, "ab") as file:
+        while file.tell() < size:
+            file.write(block)
+
+
+def _best(function, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        elapsed, result = _time(function, *args)
+        best = min(best, elapsed)
+    return best, result
+
+
+def benchmarkLastLine(size_gb=2.0, legacy_max_mb=256):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "needle-tracker.txt")
+        open(path, "wb").close()
+        for size in [1e6, 1e8, size_gb * 1e9]:
+            growTrackerLog(path, int(size))
+            actual = os.path.getsize(path)
+            new, pose = _best(readLastPose, path, repeat=100)
+            line = f"{actual / 1e6:10.0f} MB  readLastPose {new * 1e6:8.1f} us"
+            if actual <= legacy_max_mb * 1e6:
+                legacy, (pos, quat) = _best(
+                    lambda: [list(v) for v in legacyReadLastLine(path)], repeat=1
+                )
+                assert np.array_equal(pose, np.array(pos + quat))
+                line += f"   legacy readlines {legacy * 1e6:12.1f} us ({legacy / new:.0f}x)"
+            else:
+                line += "   legacy skipped (would hold the whole file in memory)"
+            print(line)
+
+
+def benchmarkPlan(samples=100000):
+    data = syntheticPlan(samples)
+    legacy, legacy_result = _time(legacyPlanPreprocessing, data)
+    new, new_result = _best(planPreprocessing, data)
+
+    interpolated, plan_transforms, cone_transforms = new_result
+    assert np.allclose(legacy_result[0], interpolated)
+    assert np.allclose(legacy_result[1], plan_transforms[:, :3, :])
+    assert np.allclose(legacy_result[2], cone_transforms)
+    print(f"{samples} plan samples (midpoints, plan frames, cone frames)")
+    print(f"  per sample loops: {legacy * 1000:.1f} ms")
+    print(f"  plans.py:         {new * 1000:.1f} ms ({legacy / new:.0f}x)")
+
+
+# closest plan point per frame of a needle moving smoothly along a dense plan: global search
+# against PlanTracker
+def benchmarkNearest(samples=1000000, frames=20000, seed=0):
+    data = syntheticPlan(samples)
+    geometry = PlanGeometry(data[:, 7:10], np.full(samples, 2.0))
+    rng = np.random.default_rng(seed)
+    path = data[np.linspace(0, samples - 1, frames).astype(int), 7:10]
+    points = path + np.cumsum(rng.normal(scale=0.005, size=(frames, 3)), axis=0)
+
+    global_time, global_result = _time(lambda: [geometry.project(p) for p in points])
+    tracker = PlanTracker(geometry)
+    tracker_time, tracker_result = _time(lambda: [tracker.project(p) for p in points])
+
+    for a, b in zip(global_result, tracker_result):
+        assert np.isclose(a.distance[0], b.distance[0])
+    print(f"{frames} frames along a {samples} sample plan")
+    print(f"  global search: {global_time / frames * 1e6:.1f} us per frame")
+    print(
+        f"  PlanTracker:   {tracker_time / frames * 1e6:.1f} us per frame "
+        f"({global_time / tracker_time:.1f}x, {tracker.fallbacks} global searches)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    loader = subparsers.add_parser("loader", help="text data file loading")
+    loader.add_argument("--lines", type=int, default=1000000)
+    lastline = subparsers.add_parser("lastline", help="newest pose of a growing tracker log")
+    lastline.add_argument("--size-gb", type=float, default=2.0)
+    lastline.add_argument("--legacy-max-mb", type=float, default=256)
+    plan = subparsers.add_parser("plan", help="needle plan preprocessing")
+    plan.add_argument("--samples", type=int, default=100000)
+    nearest = subparsers.add_parser("nearest", help="closest plan point per frame")
+    nearest.add_argument("--samples", type=int, default=1000000)
+    nearest.add_argument("--frames", type=int, default=20000)
+    args = parser.parse_args()
+
+    if args.benchmark == "loader":
+        benchmarkLoader(args.lines)
+    elif args.benchmark == "lastline":
+        benchmarkLastLine(args.size_gb, args.legacy_max_mb)
+    elif args.benchmark == "plan":
+        benchmarkPlan(args.samples)
+    elif args.benchmark == "nearest":
+        benchmarkNearest(args.samples, args.frames)
+
+
+if __name__ == "__main__":
+    main()
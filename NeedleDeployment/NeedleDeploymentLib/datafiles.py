@@ -0,0 +1,151 @@
+"""Loader for the whitespace separated data files in Resources/Data.
+
+All files share one layout: optional header lines (``#`` comments, or a plain text
+column list as in needle_deployment.txt) followed by one row of numbers per line.
+loadData() returns the rows as a contiguous float64 array and checks the column
+count against the file type, so a truncated or corrupted row is reported with its
+line number instead of surfacing later as an index error.
+"""
+
+import fnmatch
+import os
+import warnings
+
+import numpy as np
+
+# number of columns per data file, matched against the file name. A tuple lists the counts
+# allowed: recordings are poses, optionally with a leading timestamp column
+FILE_COLUMNS = [
+    ("needle_deployment*.txt", 21),
+    ("recording*.txt", (7, 8)),
+    ("demo*.txt", (7, 8)),
+    ("needle-tracker.txt", 7),
+    ("needle.txt", 7),
+    ("startpose.txt", 7),
+    ("angle.txt", 7),
+    ("tissue.txt", 6),
+    ("obstacle*.txt", 4),
+    ("region.txt", 4),
+    ("plan.txt", 3),
+    ("goal.txt", 3),
+    ("starttext.txt", 3),
+]
+
+# malformed rows listed in a DataFileError message
+MAX_REPORTED_ROWS = 10
+
+
+class DataFileError(ValueError):
+    """A data file has rows that are not numeric or have the wrong number of columns.
+
+    `rows` holds (line number, problem) pairs, line numbers start at 1.
+    """
+
+    def __init__(self, path, rows):
+        self.path = path
+        self.rows = rows
+        lines = [f"line {number}: {problem}" for number, problem in rows[:MAX_REPORTED_ROWS]]
+        if len(rows) > MAX_REPORTED_ROWS:
+            lines.append(f"... and {len(rows) - MAX_REPORTED_ROWS} more")
+        ValueError.__init__(
+            self, f"{len(rows)} malformed rows in {path}:\n  " + "\n  ".join(lines)
+        )
+
+
+# expected number of columns (or tuple of allowed counts) for a data file, None for unknown
+# file types
+def expectedColumns(path):
+    name = os.path.basename(path)
+    for pattern, columns in FILE_COLUMNS:
+        if fnmatch.fnmatch(name, pattern):
+            return columns
+    return None
+
+
+def _isNumeric(token):
+    try:
+        float(token)
+        return True
+    except ValueError:
+        return False
+
+
+def _isHeader(line):
+    stripped = line.strip()
+    if stripped.startswith("#"):
+        return True
+    fields = stripped.replace(",", " ").split()
+    return bool(fields) and not _isNumeric(fields[0])
+
+
+# column counts allowed by a count or tuple of counts, None allows any
+def _allowedColumns(columns):
+    if columns is None or isinstance(columns, tuple):
+        return columns
+    if isinstance(columns, int):
+        return (columns,)
+    return tuple(columns)
+
+
+# list every malformed row after line `first_line` (slow, only run once parsing failed).
+# Every row must have the column count of the first one, which must be one of `columns`
+def _findMalformedRows(path, first_line, columns):
+    allowed = _allowedColumns(columns)
+    columns = None
+    rows = []
+    with open(path) as file:
+        for number, line in enumerate(file, 1):
+            if number <= first_line:
+                continue
+            fields = line.split("#", 1)[0].split()
+            if not fields:
+                continue
+            if columns is None:
+                if allowed is not None and len(fields) not in allowed:
+                    expected = " or ".join(str(count) for count in allowed)
+                    rows.append((number, f"expected {expected} columns, found {len(fields)}"))
+                    continue
+                columns = len(fields)
+            if len(fields) != columns:
+                rows.append((number, f"expected {columns} columns, found {len(fields)}"))
+            elif not all(_isNumeric(f) for f in fields):
+                bad = [f for f in fields if not _isNumeric(f)]
+                rows.append((number, "not a number: " + ", ".join(bad)))
+    return rows
+
+
+# load a data file into an (N, columns) float64 array.
+# skip_lines drops the first lines of the file (header included), header lines right after
+# them are skipped as well. columns (a count or a tuple of allowed counts) defaults to the
+# count expected for the file name.
+def loadData(path, skip_lines=0, columns=None):
+    if columns is None:
+        columns = expectedColumns(path)
+    allowed = _allowedColumns(columns)
+
+    with open(path) as file:
+        first_line = 0
+        for _ in range(skip_lines):
+            if not file.readline():
+                break
+            first_line += 1
+        while True:
+            position = file.tell()
+            line = file.readline()
+            if not line or not _isHeader(line):
+                file.seek(position)
+                break
+            first_line += 1
+
+        try:
+            with warnings.catch_warnings():  # empty files are fine, not worth a warning
+                warnings.simplefilter("ignore", UserWarning)
+                data = np.loadtxt(file, dtype=np.float64, comments="#", ndmin=2)
+        except ValueError:
+            data = None
+
+    if data is None or (allowed is not None and data.size and data.shape[1] not in allowed):
+        raise DataFileError(path, _findMalformedRows(path, first_line, columns))
+    if data.size == 0:
+        return np.empty((0, allowed[0] if allowed else 0))
+    return np.ascontiguousarray(data)
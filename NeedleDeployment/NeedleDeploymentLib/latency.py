@@ -0,0 +1,131 @@
+"""Latency of the live needle pipeline, from the clocks of binary session logs.
+
+Every pose record of a binary session log carries three
+time.perf_counter_ns() times: when the tracker sampled the pose (the receive
+time for sources that carry no timestamps), when the ingest thread read it and
+when it was applied to the needle transform. This reports their distribution
+per session, to tune the refresh interval and pose prediction. Only the newest
+sample of a refresh is applied, the others have no applied time. With pose
+interpolation the needle shows a pose between two samples rather than a
+logged one, so none of its records has an applied time and those sessions
+only report the tracker to ingest stage. Usage (from the NeedleDeployment
+directory):
+
+    python -m NeedleDeploymentLib.latency ~/NeedleSessions/p01-20240501-101500 [...]
+
+Session folders and .ndlog files are accepted.
+"""
+
+import argparse
+import glob
+import os
+
+import numpy as np
+
+from NeedleDeploymentLib.sessionlog import (
+    POSE,
+    SESSION_LOG_EXTENSION,
+    SESSION_LOG_NAME,
+    SessionLog,
+)
+from NeedleDeploymentLib.sessions import isSessionDirectory, readSessionIndex
+
+# (name, from field, to field)
+STAGES = [
+    ("tracker to ingest", "sample_ns", "ingest_ns"),
+    ("ingest to applied", "ingest_ns", "applied_ns"),
+    ("tracker to applied", "sample_ns", "applied_ns"),
+]
+PERCENTILES = (50, 90, 99)
+
+
+# count, mean, percentiles and max of durations in nanoseconds, in milliseconds
+def distribution(durations_ns):
+    durations = np.asarray(durations_ns, dtype=np.float64) / 1e6
+    if len(durations) == 0:
+        return {"count": 0}
+    stats = {"count": len(durations), "mean": float(durations.mean())}
+    for percentile, value in zip(PERCENTILES, np.percentile(durations, PERCENTILES)):
+        stats[f"p{percentile}"] = float(value)
+    stats["max"] = float(durations.max())
+    return stats
+
+
+# latency distribution of every stage, and of the interval between applied poses, for session
+# log records. Records without both times of a stage (-1) are left out of it
+def latencyDistribution(records):
+    records = records[records["kind"] == POSE]
+    result = {}
+    for name, start, stop in STAGES:
+        valid = (records[start] >= 0) & (records[stop] >= 0)
+        result[name] = distribution(records[stop][valid] - records[start][valid])
+    applied = np.sort(records["applied_ns"][records["applied_ns"] >= 0])
+    result["frame interval"] = distribution(np.diff(applied))
+    return result
+
+
+# (name, records) per session of a session folder or .ndlog file
+def sessionRecords(path):
+    if os.path.isdir(path):
+        if not isSessionDirectory(path):
+            raise ValueError(f"{path} is not a session folder")
+        segments = readSessionIndex(path)["logs"].get(SESSION_LOG_NAME, [])
+        if not segments:
+            raise ValueError(f"{path} has no binary session log")
+        # segments repeat the session header, so the parts of the session are merged again
+        data = np.concatenate(
+            [np.fromfile(os.path.join(path, segment), dtype=np.uint8) for segment in segments]
+        )
+        logs = [(path, SessionLog(data=data))]
+    else:
+        logs = [(path, SessionLog(path))]
+
+    sessions = []
+    for name, log in logs:
+        for number, session in enumerate(log.sessions, 1):
+            label = name if len(log.sessions) == 1 else f"{name} session {number}"
+            sessions.append((label, session.records))
+    return sessions
+
+
+def formatDistribution(result):
+    lines = []
+    for name, stats in result.items():
+        if stats["count"] == 0:
+            lines.append(f"  {name:<20} no samples")
+            continue
+        percentiles = " ".join(f"p{p} {stats[f'p{p}']:7.2f}" for p in PERCENTILES)
+        lines.append(
+            f"  {name:<20} {stats['count']:7d} samples, mean {stats['mean']:7.2f} "
+            f"{percentiles} max {stats['max']:7.2f} ms"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("sessions", nargs="+", help="session folders or .ndlog files")
+    args = parser.parse_args()
+
+    paths = []
+    for path in args.sessions:
+        if os.path.isdir(path) and not isSessionDirectory(path):
+            # a folder of session folders
+            paths.extend(sorted(p for p in glob.glob(os.path.join(path, "*")) if isSessionDirectory(p)))
+            paths.extend(sorted(glob.glob(os.path.join(path, "*" + SESSION_LOG_EXTENSION))))
+        else:
+            paths.append(path)
+
+    for path in paths:
+        try:
+            sessions = sessionRecords(path)
+        except (OSError, ValueError) as error:
+            print(f"Skipping {path}: {error}")
+            continue
+        for name, records in sessions:
+            print(name)
+            print(formatDistribution(latencyDistribution(records)))
+
+
+if __name__ == "__main__":
+    main()
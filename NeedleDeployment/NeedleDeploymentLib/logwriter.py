@@ -0,0 +1,191 @@
+"""Buffered log files written from a background thread.
+
+The widgets log every needle pose (needle-timestamps.txt) and every spacebar
+press (timestamps.txt). Opening, writing and closing a file on the GUI thread
+for each of these puts disk latency on the render loop, so lines are handed to
+an AsyncLogWriter instead:
+
+    writer = AsyncLogWriter()
+    writer.write(path, "0.02 1.0 2.0 3.0 1.0 0.0 0.0 0.0\n")
+    writer.flush()  # wait until everything written so far is on disk
+    writer.close()
+
+The writer thread keeps each log file open and appends the queued lines in
+batches, once `flush_interval` seconds passed since the oldest pending line or
+`max_pending_bytes` are pending, whichever comes first. Lines of one file are
+written in the order they were queued, and binary files (bytes instead of str)
+are appended the same way. The queue is bounded: if the disk falls so far
+behind that `max_queued` lines are waiting, write() blocks for up to
+`max_block` seconds for room and then drops the line (counted in `dropped`)
+rather than growing without limit or freezing the caller. A file that fails to
+write is reported and counted in `errors` without stopping the other logs, and
+if the writer thread stops anyway, flush() and close() return instead of
+waiting for it.
+"""
+
+import queue
+import threading
+import time
+
+# queue entries that are not (path, text) lines
+_FLUSH = "flush"
+_CLOSE = "close"
+
+
+class AsyncLogWriter:
+    """Appends text to log files on a background thread (see module docstring)."""
+
+    def __init__(
+        self, flush_interval=0.5, max_pending_bytes=64 * 1024, max_queued=10000, max_block=1.0
+    ):
+        self.flush_interval = flush_interval
+        self.max_pending_bytes = max_pending_bytes
+        self.max_block = max_block
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closed = False
+        # writer thread state
+        self._files = {}
+        self._pending = {}
+        self._pending_bytes = 0
+        self._pending_since = None
+        self.errors = 0
+        self.last_error = None
+        self.dropped = 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _start(self):
+        with self._lock:
+            if self._closed:
+                raise ValueError("Log writer is closed")
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="AsyncLogWriter", daemon=True
+                )
+                self._thread.start()
+
+    # queue text (str, or bytes for binary files) to be appended to the file at path (created if missing).
+    # A file takes either str or bytes, as decided by the first write. Returns False if the text was
+    # dropped because the queue stayed full or the writer thread stopped
+    def write(self, path, text):
+        if not text:
+            return True
+        if self._thread is None:
+            self._start()
+        elif self._closed:
+            raise ValueError("Log writer is closed")
+        if self.running:
+            try:
+                self._queue.put((path, text), timeout=self.max_block)
+                return True
+            except queue.Full:
+                pass
+        self.dropped += 1
+        return False
+
+    # wait for event while the writer thread runs, False on timeout or if the thread stopped
+    def _wait(self, event, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while not event.is_set() and self.running:
+            wait = 0.1 if deadline is None else min(0.1, deadline - time.monotonic())
+            if wait <= 0:
+                break
+            event.wait(wait)
+        return event.is_set()
+
+    # queue a flush or close request for the writer thread and wait for it
+    def _request(self, kind, timeout=None):
+        done = threading.Event()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.running:
+            try:
+                self._queue.put((kind, done), timeout=0.1)
+            except queue.Full:
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                continue
+            remaining = None if deadline is None else max(deadline - time.monotonic(), 0.0)
+            return self._wait(done, remaining)
+        return False
+
+    # write everything queued so far and wait until it is on disk (or timeout seconds passed).
+    # Returns False on timeout or if the writer thread stopped
+    def flush(self, timeout=None):
+        if self._thread is None:
+            return True
+        return self._request(_FLUSH, timeout)
+
+    # flush, close the log files and stop the thread. Further writes raise ValueError
+    def close(self, timeout=None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        if self._thread is None:
+            return
+        if self._request(_CLOSE, timeout) or not self.running:
+            self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            timeout = None
+            if self._pending_since is not None:
+                timeout = max(self._pending_since + self.flush_interval - time.monotonic(), 0.0)
+            try:
+                path, text = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._writePending()
+                continue
+
+            if path is _FLUSH or path is _CLOSE:
+                self._writePending()
+                if path is _CLOSE:
+                    self._closeFiles()
+                text.set()
+                if path is _CLOSE:
+                    return
+                continue
+
+            self._pending.setdefault(path, []).append(text)
+            self._pending_bytes += len(text)
+            if self._pending_since is None:
+                self._pending_since = time.monotonic()
+            if self._pending_bytes >= self.max_pending_bytes:
+                self._writePending()
+
+    def _writePending(self):
+        for path, lines in self._pending.items():
+            try:
+                file = self._files.get(path)
+                if file is None:
+                    mode = "ab" if isinstance(lines[0], bytes) else "a"
+                    file = self._files[path] = open(path, mode)
+                file.write(lines[0][:0].join(lines))
+                file.flush()
+            except Exception as error:
+                # a failing log must not stop the others, the lines of this batch are lost
+                self.errors += 1
+                self.last_error = error
+                print(f"Failed to write {path}: {error}")
+                file = self._files.pop(path, None)
+                if file is not None:
+                    try:
+                        file.close()
+                    except OSError:
+                        pass
+        self._pending = {}
+        self._pending_bytes = 0
+        self._pending_since = None
+
+    def _closeFiles(self):
+        for path, file in self._files.items():
+            try:
+                file.close()
+            except OSError as error:
+                self.errors += 1
+                print(f"Failed to close {path}: {error}")
+        self._files = {}
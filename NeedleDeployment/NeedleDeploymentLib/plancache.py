@@ -0,0 +1,102 @@
+"""Cache of the data derived from a needle plan file.
+
+Loading the environment parses needle_deployment.txt and derives the plan
+frames, cone frames and the tube meshes of the plan and the funnel from it.
+PlanCache keeps these next to the plan, in a hidden folder of its directory
+(or the temp folder if that is not writable): the arrays as one .npz file
+and the meshes as .vtp files written by the widget. Entries are named after
+a hash of the plan file's content and PLAN_CACHE_SCHEMA, so an edited plan
+or a change of what is cached is picked up without clearing anything:
+
+    cache = PlanCache("Resources/Data/needle_deployment.txt")
+    arrays = cache.load()
+    if arrays is None:
+        arrays = derivePlanArrays(loadData(cache.plan_path, 1))
+        cache.save(arrays)
+"""
+
+import hashlib
+import os
+import re
+import tempfile
+import zipfile
+
+import numpy as np
+
+from NeedleDeploymentLib.plans import coneTransforms, insertMidpoints, planTransforms
+
+# bump when the cached arrays or meshes change, older entries are then ignored and replaced
+PLAN_CACHE_SCHEMA = 1
+CACHE_FOLDER = ".plan-cache"
+
+
+# derived plan arrays cached by PlanCache, from the needle_deployment.txt data
+def derivePlanArrays(data):
+    data = np.ascontiguousarray(data, dtype=np.float64)
+    return {
+        "data": data,
+        "interpolated_positions": insertMidpoints(data[:, 7:10]),
+        "plan_transforms": planTransforms(data[:, 7:10], data[:, 10:14]),
+        "cone_transforms": coneTransforms(data[:, 18:21]),
+    }
+
+
+# hash of the plan file's content and the cache schema
+def planCacheKey(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(1024 * 1024), b""):
+            digest.update(block)
+    return f"{digest.hexdigest()[:16]}-v{PLAN_CACHE_SCHEMA}"
+
+
+class PlanCache:
+    """Cached arrays and meshes of the plan file at `plan_path` (see module docstring)."""
+
+    def __init__(self, plan_path, cache_directory=None):
+        self.plan_path = plan_path
+        self.name = os.path.splitext(os.path.basename(plan_path))[0]
+        if cache_directory is None:
+            directory = os.path.dirname(os.path.abspath(plan_path))
+            cache_directory = os.path.join(directory, CACHE_FOLDER)
+            if not os.access(cache_directory if os.path.isdir(cache_directory) else directory, os.W_OK):
+                cache_directory = os.path.join(tempfile.gettempdir(), "NeedleDeployment" + CACHE_FOLDER)
+        self.cache_directory = cache_directory
+        self.key = planCacheKey(plan_path)
+
+    def _path(self, suffix):
+        return os.path.join(self.cache_directory, f"{self.name}-{self.key}{suffix}")
+
+    @property
+    def arrays_path(self):
+        return self._path(".npz")
+
+    # .vtp file of a cached mesh. The arrays are saved last, so the meshes of a plan with cached
+    # arrays are complete
+    def meshPath(self, mesh):
+        return self._path(f"-{mesh}.vtp")
+
+    # cached arrays of the plan, None if there are none for its current content
+    def load(self):
+        try:
+            with np.load(self.arrays_path) as cached:
+                if str(cached["key"]) != self.key:
+                    return None
+                return {name: cached[name] for name in cached.files if name != "key"}
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile):
+            return None
+
+    # create the cache folder and remove the entries of earlier versions of the plan
+    def prepare(self):
+        os.makedirs(self.cache_directory, exist_ok=True)
+        # entries of this plan only, not of plans whose names start with the same text
+        entry = re.compile(re.escape(self.name) + r"-[0-9a-f]{16}-v\d+(-\w+\.vtp|\.npz)(\.tmp)?")
+        for name in os.listdir(self.cache_directory):
+            if entry.fullmatch(name) and self.key not in name:
+                os.remove(os.path.join(self.cache_directory, name))
+
+    def save(self, arrays):
+        self.prepare()
+        with open(self.arrays_path + ".tmp", "wb") as file:
+            np.savez(file, key=np.array(self.key), **arrays)
+        os.replace(self.arrays_path + ".tmp", self.arrays_path)
@@ -0,0 +1,156 @@
+"""Needle plans loaded in the background, for switching plans without reloading the environment.
+
+A study session cycles through several plans. PlanManager loads every plan
+file it is given on a thread pool: the plan arrays (from the plan cache, see
+plancache, or parsed and derived) and the scoring arrays with their KD-tree.
+Only NumPy work runs there, the widget builds the VTK meshes of a plan on the
+main thread once it is loaded. Making a loaded plan the active one only swaps
+references, and activating a plan never waits for it to load:
+
+    manager = PlanManager()
+    manager.scan("Resources/Data")  # needle_deployment*.txt, loading starts right away
+    loaded = manager.activate("needle_deployment")  # None while it is still loading
+    while loaded is None:
+        loaded = manager.poll()  # from a timer, the plan is active once this returns it
+    scores = scoreNeedleTips(tips, directions, loaded.plan)
+"""
+
+import collections
+import concurrent.futures
+import fnmatch
+import os
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.plancache import PlanCache, derivePlanArrays
+from NeedleDeploymentLib.plans import PlanTracker
+from NeedleDeploymentLib.scoring import NeedlePlan
+
+# plan files picked up by a scan
+PLAN_PATTERNS = ["needle_deployment*.txt"]
+DEFAULT_PLAN = "needle_deployment"
+
+# name       plan file name without extension
+# path       of the plan file
+# cache      its plancache.PlanCache
+# arrays     plancache.derivePlanArrays of the plan
+# plan       scoring.NeedlePlan, with the KD-tree of the plan points
+# tracker    plans.PlanTracker for the live closest point search
+# cached     whether the arrays came from the plan cache
+LoadedPlan = collections.namedtuple(
+    "LoadedPlan", ["name", "path", "cache", "arrays", "plan", "tracker", "cached"]
+)
+
+
+# load a plan file and everything derived from it (see LoadedPlan)
+def loadPlan(path):
+    cache = PlanCache(path)
+    arrays = cache.load()
+    cached = arrays is not None
+    if not cached:
+        arrays = derivePlanArrays(loadData(path, 1))
+    plan = NeedlePlan(arrays["data"])
+    name = os.path.splitext(os.path.basename(path))[0]
+    return LoadedPlan(name, path, cache, arrays, plan, PlanTracker(plan.geometry), cached)
+
+
+def _planOrder(name):
+    return (name != DEFAULT_PLAN, name)
+
+
+# paths of the plan files in directory, the default plan first
+def findPlanFiles(directory, patterns=None):
+    patterns = patterns or PLAN_PATTERNS
+    files = [
+        name
+        for name in os.listdir(directory)
+        if any(fnmatch.fnmatch(name, pattern) for pattern in patterns)
+    ]
+    files.sort(key=lambda name: _planOrder(os.path.splitext(name)[0]))
+    return [os.path.join(directory, name) for name in files]
+
+
+class PlanManager:
+    """Plans loading in the background on `max_workers` threads, one of them active.
+
+    `pending` is the plan to activate once it is loaded (see activate and poll).
+    """
+
+    def __init__(self, max_workers=2):
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="PlanManager"
+        )
+        self._futures = collections.OrderedDict()
+        self._failed = set()
+        self.active = None
+        self.pending = None
+
+    # start loading the plan file at path, returns its name
+    def add(self, path):
+        name = os.path.splitext(os.path.basename(path))[0]
+        if name not in self._futures:
+            self._futures[name] = self._executor.submit(loadPlan, path)
+        return name
+
+    # start loading the plan files in directory, the default plan first. Returns the names of all
+    # plans in that order
+    def scan(self, directory, patterns=None):
+        for path in findPlanFiles(directory, patterns):
+            self.add(path)
+        return self.names()
+
+    def names(self):
+        return sorted(self._futures, key=_planOrder)
+
+    def isReady(self, name):
+        return self._futures[name].done()
+
+    # plans that finished loading, failed loads are reported and left out
+    def ready(self):
+        loaded = []
+        for name, future in self._futures.items():
+            if not future.done():
+                continue
+            if future.cancelled() or future.exception() is not None:
+                if name not in self._failed and not future.cancelled():
+                    print(f"Failed to load plan {name}: {future.exception()}")
+                self._failed.add(name)
+                continue
+            loaded.append(future.result())
+        return loaded
+
+    @property
+    def loading(self):
+        return any(not future.done() for future in self._futures.values())
+
+    # LoadedPlan of name, waiting up to timeout seconds (None: no limit) if it is still loading.
+    # Raises the error of a failed load
+    def plan(self, name, timeout=None):
+        return self._futures[name].result(timeout)
+
+    # make name the active plan as soon as it is loaded, without waiting for it. Returns its
+    # LoadedPlan if it is active already, None while it is loading (see poll). Raises the error
+    # of a failed load
+    def activate(self, name):
+        if name not in self._futures:
+            raise KeyError(f"Unknown plan {name}")
+        self.pending = name
+        return self.poll()
+
+    # LoadedPlan of the pending plan once it is loaded and made the active plan, None while it is
+    # still loading or if no plan is pending. Raises the error of a failed load, the active plan
+    # is then kept
+    def poll(self):
+        if self.pending is None or not self._futures[self.pending].done():
+            return None
+        name, self.pending = self.pending, None
+        loaded = self._futures[name].result()
+        self.active = name
+        return loaded
+
+    @property
+    def activePlan(self):
+        return None if self.active is None else self.plan(self.active)
+
+    # stop loading, plans already loaded stay available
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,281 @@
+"""Needle plan geometry derived from needle_deployment.txt.
+
+Everything is computed for all plan samples at once with array operations, so
+preparing a plan of 10^5 samples takes milliseconds. The frames are plain
+(N, 4, 4) arrays; the widget converts the few it shows to VTK matrices when
+they are needed. PlanGeometry finds the closest point on the plan polyline,
+which is what the needle deviation is measured to.
+"""
+
+import collections
+
+import numpy as np
+from scipy.spatial import cKDTree
+
+from NeedleDeploymentLib.poses import quaternionsToRotationMatrices
+
+
+# plan positions with the midpoint of every segment inserted between its end points, (2N - 1, 3)
+def insertMidpoints(positions):
+    positions = np.asarray(positions, dtype=np.float64)
+    if len(positions) == 0:
+        return positions.reshape(0, 3)
+    dense = np.empty((2 * len(positions) - 1, positions.shape[1]))
+    dense[0::2] = positions
+    dense[1::2] = (positions[1:] + positions[:-1]) / 2
+    return dense
+
+
+# (N, 4, 4) frames of the plan: rotation of the plan quaternions, rounded to `decimals`,
+# and the plan positions as translation
+def planTransforms(positions, quaternions, decimals=2):
+    transforms = np.zeros((len(positions), 4, 4))
+    transforms[:, :3, :3] = np.round(quaternionsToRotationMatrices(quaternions), decimals)
+    transforms[:, :3, 3] = positions
+    transforms[:, 3, 3] = 1.0
+    return transforms
+
+
+# (N, 4, 4) frames of the allowed angle cones: z along the cone axis, x the unit vector
+# (1, 1, z) orthogonal to it, no translation
+def coneTransforms(directions):
+    directions = np.asarray(directions, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        x_dirs = np.ones_like(directions)
+        x_dirs[:, 2] = -(directions[:, 0] + directions[:, 1]) / directions[:, 2]
+        x_dirs /= np.linalg.norm(x_dirs, axis=1, keepdims=True)
+    transforms = np.zeros((len(directions), 4, 4))
+    transforms[:, :3, 0] = x_dirs
+    transforms[:, :3, 1] = np.cross(directions, x_dirs)
+    transforms[:, :3, 2] = directions
+    transforms[:, 3, 3] = 1.0
+    return transforms
+
+
+# closest points on the plan polyline, one entry per query point:
+# segment     index of the plan segment (plan points segment and segment + 1) the point is on
+# t           position along that segment, 0 at its start and 1 at its end
+# arc_length  distance along the plan from the first plan point
+# point       closest point on the plan
+# distance    from the query point to the plan
+# index       plan point nearest to the closest point (segment, or segment + 1 past the midpoint)
+# radius      funnel radius at the closest point, interpolated along the segment
+# max_angle   cone opening angle at the closest point, interpolated along the segment
+PlanProjection = collections.namedtuple(
+    "PlanProjection",
+    ["segment", "t", "arc_length", "point", "distance", "index", "radius", "max_angle"],
+)
+
+
+# insertion progress of needle tips, one entry per tip:
+# progress           arc length of the closest point in percent of the plan length
+# remaining          path length left to the end of the plan (the Target), negative past it
+# axial_deviation    tip offset along the plan direction at the closest point, nonzero before
+#                    the start or past the end of the plan (positive past the end)
+# lateral_deviation  tip distance across the plan
+PlanProgress = collections.namedtuple(
+    "PlanProgress", ["progress", "remaining", "axial_deviation", "lateral_deviation"]
+)
+
+
+class PlanGeometry:
+    """Plan polyline with a KD-tree over its points, for closest point queries.
+
+    project() returns the exact closest point on the polyline, not only the
+    nearest plan point. The tree gives the `k` nearest plan points, whose
+    adjacent segments are the candidates. The closest point of a segment is
+    at most half the segment length from one of its ends, so when the k-th
+    nearest plan point is farther than sqrt(distance^2 + (longest segment / 2)^2)
+    no other segment can be closer; the rare queries for which that does not
+    hold check every segment around the plan points within that distance.
+    """
+
+    def __init__(self, positions, funnel_radii=None, max_angle=None, k=8):
+        positions = np.ascontiguousarray(positions, dtype=np.float64)
+        if funnel_radii is not None:
+            funnel_radii = np.asarray(funnel_radii, dtype=np.float64)
+        if max_angle is not None:
+            max_angle = np.asarray(max_angle, dtype=np.float64)
+        if len(positions) == 1:
+            # a single plan point is a segment of length 0
+            positions = np.repeat(positions, 2, axis=0)
+            funnel_radii = None if funnel_radii is None else np.repeat(funnel_radii, 2)
+            max_angle = None if max_angle is None else np.repeat(max_angle, 2)
+        self.positions = positions
+        self.starts = positions[:-1]
+        self.vectors = np.diff(positions, axis=0)
+        self.lengths = np.linalg.norm(self.vectors, axis=1)
+        squared = self.lengths ** 2
+        self.inverse_squared_lengths = np.divide(
+            1.0, squared, out=np.zeros_like(squared), where=squared > 0
+        )
+        # unit direction of every segment, segments of length 0 take the one of the segment before
+        # (or after, at the start of the plan)
+        self.tangents = self.vectors * (self.inverse_squared_lengths * self.lengths)[:, None]
+        if len(self.lengths) and (self.lengths > 0).any():
+            nonzero = np.where(self.lengths > 0, np.arange(len(self.lengths)), -1)
+            nonzero = np.maximum.accumulate(nonzero)
+            nonzero[nonzero < 0] = np.argmax(self.lengths > 0)
+            self.tangents = self.tangents[nonzero]
+        # arc length at every plan point, for the insertion progress
+        self.arc_lengths = np.concatenate(([0.0], np.cumsum(self.lengths)))
+        self.half_max_length = self.lengths.max() / 2 if len(self.lengths) else 0.0
+        self.funnel_radii = funnel_radii
+        self.max_angle = max_angle
+        self.k = min(k, len(positions))
+        self.kdtree = cKDTree(positions)
+
+    def __len__(self):
+        return len(self.positions)
+
+    @property
+    def length(self):
+        return self.arc_lengths[-1]
+
+    # segments before and after plan points (..., ) as (..., 2) segment indices
+    def adjacentSegments(self, indices):
+        indices = np.asarray(indices)
+        return np.clip(np.stack((indices - 1, indices), axis=-1), 0, len(self.lengths) - 1)
+
+    # closest points of points (N, 3) on candidate segments (N, K): (segment, t, distance) of the
+    # closest candidate per point
+    def closestOnSegments(self, points, segments):
+        offsets = points[:, None, :] - self.starts[segments]
+        t = np.einsum("nkj,nkj->nk", offsets, self.vectors[segments])
+        t = np.clip(t * self.inverse_squared_lengths[segments], 0.0, 1.0)
+        deviations = offsets - t[..., None] * self.vectors[segments]
+        squared = np.einsum("nkj,nkj->nk", deviations, deviations)
+        best = np.argmin(squared, axis=1)
+        rows = np.arange(len(points))
+        return segments[rows, best], t[rows, best], np.sqrt(squared[rows, best])
+
+    # values given per plan point at positions t along segments
+    @staticmethod
+    def interpolate(values, segment, t):
+        return values[segment] + t * (values[segment + 1] - values[segment])
+
+    def project(self, points):
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        vertex_distances, vertices = self.kdtree.query(points, k=self.k)
+        vertex_distances = vertex_distances.reshape(len(points), -1)
+        vertices = vertices.reshape(len(points), -1)
+        segments = self.adjacentSegments(vertices).reshape(len(points), -1)
+        segment, t, distance = self.closestOnSegments(points, segments)
+
+        if self.k < len(self.positions):
+            bound = np.sqrt(distance ** 2 + self.half_max_length ** 2)
+            for row in np.flatnonzero(vertex_distances[:, -1] <= bound):
+                nearby = self.kdtree.query_ball_point(points[row], bound[row])
+                candidates = np.unique(self.adjacentSegments(nearby))
+                result = self.closestOnSegments(points[row : row + 1], candidates[None, :])
+                segment[row], t[row], distance[row] = (value[0] for value in result)
+
+        return self.projection(segment, t, distance)
+
+    # PlanProgress of points (N, 3) from their projection
+    def progress(self, points, projection):
+        points = np.atleast_2d(np.asarray(points, dtype=np.float64))
+        deviations = points - projection.point
+        tangents = self.tangents[projection.segment]
+        axial = np.einsum("ij,ij->i", deviations, tangents)
+        lateral = np.linalg.norm(deviations - axial[:, None] * tangents, axis=1)
+        length = self.length
+        progress = 100 * projection.arc_length / length if length > 0 else np.zeros(len(points))
+        remaining = length - projection.arc_length - axial
+        return PlanProgress(progress, remaining, axial, lateral)
+
+    # PlanProjection of positions t along segments, at distance from the query points
+    def projection(self, segment, t, distance):
+        point = self.starts[segment] + t[:, None] * self.vectors[segment]
+        arc_length = self.arc_lengths[segment] + t * self.lengths[segment]
+        index = segment + (t > 0.5)
+        radius = None if self.funnel_radii is None else self.interpolate(self.funnel_radii, segment, t)
+        max_angle = None if self.max_angle is None else self.interpolate(self.max_angle, segment, t)
+        return PlanProjection(segment, t, arc_length, point, distance, index, radius, max_angle)
+
+
+class PlanTracker:
+    """Closest point on the plan for a needle that moves smoothly along it.
+
+    The search starts from the segment of the previous frame and checks the
+    segments on either side, as many as the closest point moved in the
+    previous frame but at least `window`. While the closest of them is the
+    first or last segment checked, the plan may come closer beyond it, so
+    the search is extended twice as far in that direction, up to
+    `max_extensions` times. A frame costs the same for any plan size. The
+    whole plan is searched with PlanGeometry.project when this walk gives up
+    or its result is farther from the plan than the funnel radius there (or
+    `max_distance` for plans without radii): outside the funnel another part
+    of the plan may be closer.
+    """
+
+    def __init__(self, geometry, window=8, max_extensions=8, max_distance=None):
+        self.geometry = geometry
+        self.window = window
+        self.max_extensions = max_extensions
+        self.max_distance = max_distance
+        self.segment = None
+        self.span = window
+        self.local_hits = 0
+        self.fallbacks = 0
+
+    def reset(self):
+        self.segment = None
+        self.span = self.window
+
+    def project(self, point):
+        point = np.asarray(point, dtype=np.float64).reshape(3)
+        projection = None
+        if self.segment is not None:
+            projection = self._projectLocal(point)
+        if projection is None:
+            self.fallbacks += 1
+            projection = self.geometry.project(point)
+        else:
+            self.local_hits += 1
+        segment = int(projection.segment[0])
+        if self.segment is not None:
+            self.span = max(self.window, 2 * abs(segment - self.segment))
+        self.segment = segment
+        return projection
+
+    # closest point of point (3,) on segments first to last: (segment, t, squared distance)
+    def _closestInRange(self, point, first, last):
+        geometry = self.geometry
+        offsets = point - geometry.starts[first : last + 1]
+        vectors = geometry.vectors[first : last + 1]
+        t = (offsets * vectors).sum(axis=1) * geometry.inverse_squared_lengths[first : last + 1]
+        np.clip(t, 0.0, 1.0, out=t)
+        deviations = offsets - t[:, None] * vectors
+        squared = (deviations * deviations).sum(axis=1)
+        best = int(np.argmin(squared))
+        return first + best, t[best], squared[best]
+
+    def _projectLocal(self, point):
+        last = len(self.geometry.lengths) - 1
+        first_segment = max(self.segment - self.span, 0)
+        last_segment = min(self.segment + self.span, last)
+        best = None
+        for _ in range(self.max_extensions + 1):
+            result = self._closestInRange(point, first_segment, last_segment)
+            if best is None or result[2] < best[2]:
+                best = result
+            segment = best[0]
+            extend = 2 * (last_segment - first_segment + 1)
+            if segment == first_segment and first_segment > 0:
+                first_segment, last_segment = max(first_segment - extend, 0), first_segment - 1
+            elif segment == last_segment and last_segment < last:
+                first_segment, last_segment = last_segment + 1, min(last_segment + extend, last)
+            else:
+                break
+        else:
+            return None
+
+        segment, t, squared = best
+        projection = self.geometry.projection(
+            np.array([segment]), np.array([t]), np.array([np.sqrt(squared)])
+        )
+        max_distance = projection.radius[0] if projection.radius is not None else self.max_distance
+        if max_distance is not None and projection.distance[0] > max_distance:
+            return None
+        return projection
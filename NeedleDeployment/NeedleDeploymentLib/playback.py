@@ -0,0 +1,134 @@
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.poses import interpolatePoses
+
+# number of values per pose: position (x, y, z) + quaternion (qw, qx, qy, qz)
+POSE_FIELDS = 7
+
+# playback speed range, as a multiple of real time
+MIN_SPEED = 0.1
+MAX_SPEED = 10.0
+
+
+class PlaybackEngine:
+    """Plays a recorded needle motion back in real time.
+
+    The recording is held as an (N, 7) pose array with a matching array of
+    capture times in seconds. Times come from the first column of an (N, 8)
+    recording (`t x y z qw qx qy qz`, as written to needle-timestamps.txt) or,
+    for plain (N, 7) recordings, from the declared sample `rate` in Hz.
+
+    Playback time follows a monotonic clock, so update() returns the pose that
+    was current at that moment of the recording no matter how often it is
+    called: frames that fall between two calls are dropped (and counted), and
+    with `interpolate` the pose between two frames is interpolated.
+
+    The playback clock runs at `speed` times real time and can be paused
+    (stop), moved to any frame (seek, step) or time (seekTime) without touching
+    the recording, so seeking costs the same for any recording length.
+    """
+
+    def __init__(self, recording, times=None, rate=50.0, interpolate=False, clock=time.monotonic):
+        recording = np.asarray(recording, dtype=np.float64)
+        if recording.ndim != 2 or len(recording) == 0:
+            raise ValueError("Recording is empty")
+        if times is None:
+            if recording.shape[1] == POSE_FIELDS + 1:
+                times = recording[:, 0]
+                recording = recording[:, 1:]
+            else:
+                times = np.arange(len(recording)) / rate
+        if recording.shape[1] != POSE_FIELDS:
+            raise ValueError(f"Expected {POSE_FIELDS} pose columns, found {recording.shape[1]}")
+        times = np.asarray(times, dtype=np.float64)
+        if np.any(np.diff(times) < 0):
+            raise ValueError("Recording timestamps are not increasing")
+
+        self.poses = np.ascontiguousarray(recording)
+        self.times = times - times[0]
+        self.duration = float(self.times[-1])
+        self.interpolate = interpolate
+        self.clock = clock
+
+        self.index = 0  # frame shown by the last update()
+        self.dropped = 0
+        self.speed = 1.0
+        # playback time at the anchor, and the clock time it was taken at (None while stopped)
+        self._anchor_time = 0.0
+        self._anchor_clock = None
+
+    def __len__(self):
+        return len(self.poses)
+
+    @property
+    def running(self):
+        return self._anchor_clock is not None
+
+    # restart the playback clock at playback time t
+    def _anchor(self, t):
+        self._anchor_time = min(max(t, 0.0), self.duration)
+        if self._anchor_clock is not None:
+            self._anchor_clock = self.clock()
+
+    def start(self):
+        if self._anchor_clock is None:
+            self._anchor_clock = self.clock()
+
+    def stop(self):
+        if self._anchor_clock is not None:
+            self._anchor_time = self.currentTime()
+            self._anchor_clock = None
+
+    def setSpeed(self, speed):
+        self._anchor(self.currentTime())
+        self.speed = min(max(float(speed), MIN_SPEED), MAX_SPEED)
+
+    def rewind(self):
+        self.seek(0)
+        self.dropped = 0
+
+    # jump to a frame, keeps running if playback is running
+    def seek(self, index):
+        index = int(min(max(index, 0), len(self.times) - 1))
+        self._anchor(self.times[index])
+        self.index = index
+
+    def seekTime(self, t):
+        self._anchor(t)
+        self.index = self.frameIndex(self._anchor_time)
+
+    # pause and move by a number of frames (negative steps back)
+    def step(self, frames=1):
+        self.stop()
+        self.seek(self.frameIndex(self.currentTime()) + frames)
+
+    # seconds into the recording
+    def currentTime(self):
+        if self._anchor_clock is None:
+            return self._anchor_time
+        elapsed = (self.clock() - self._anchor_clock) * self.speed
+        return min(self._anchor_time + elapsed, self.duration)
+
+    def finished(self):
+        return self.currentTime() >= self.duration
+
+    # index of the frame that is current at playback time t
+    def frameIndex(self, t):
+        index = np.searchsorted(self.times, t, side="right") - 1
+        return int(min(max(index, 0), len(self.times) - 1))
+
+    # pose for the current playback time
+    def update(self):
+        t = self.currentTime()
+        index = self.frameIndex(t)
+        if index > self.index + 1:
+            self.dropped += index - self.index - 1
+        self.index = index
+        if self.interpolate:
+            return interpolatePoses(self.times, self.poses, t)[0]
+        return self.poses[index]
+
+    def summary(self):
+        return f"{self.index + 1} of {len(self)} frames played, {self.dropped} dropped"
@@ -0,0 +1,293 @@
+import collections
+import time
+
+import numpy as np
+
+# pose (pos + quat) with the time it was captured, or received if the source carries no timestamps.
+# For latency analysis, sample_ns and ingest_ns are the same moments on the time.perf_counter_ns()
+# clock: the capture (the receive time if the source carries no timestamps) and the moment the
+# ingest thread read the pose
+PoseSample = collections.namedtuple(
+    "PoseSample", ["timestamp", "pose", "sample_ns", "ingest_ns"], defaults=(None, None)
+)
+
+
+# convert an (N, 4) array of quaternions [qw, qx, qy, qz] into an (N, 3, 3) stack of
+# rotation matrices, batched equivalent of quaternionToRotationMatrix
+def quaternionsToRotationMatrices(quaternions):
+    q = np.array(quaternions, dtype=np.float64, ndmin=2)
+    n = np.einsum("ij,ij->i", q, q)
+    valid = n >= 0.0000001
+    q[valid] *= np.sqrt(2.0 / n[valid])[:, None]
+    w, x, y, z = q[:, 0], q[:, 1], q[:, 2], q[:, 3]
+
+    R = np.empty((q.shape[0], 3, 3))
+    R[:, 0, 0] = 1.0 - y * y - z * z
+    R[:, 0, 1] = x * y - z * w
+    R[:, 0, 2] = x * z + y * w
+    R[:, 1, 0] = x * y + z * w
+    R[:, 1, 1] = 1.0 - x * x - z * z
+    R[:, 1, 2] = y * z - x * w
+    R[:, 2, 0] = x * z - y * w
+    R[:, 2, 1] = y * z + x * w
+    R[:, 2, 2] = 1.0 - x * x - y * y
+    R[~valid] = np.eye(3)
+    return R
+
+
+def normalizeQuaternions(quaternions):
+    q = np.asarray(quaternions, dtype=np.float64)
+    return q / np.linalg.norm(q, axis=-1, keepdims=True)
+
+
+# spherical linear interpolation between quaternion arrays q0, q1 (N, 4) at fractions t (N,)
+def slerp(q0, q1, t):
+    q0 = normalizeQuaternions(q0)
+    q1 = normalizeQuaternions(q1)
+    t = np.asarray(t, dtype=np.float64)[..., None]
+
+    dot = np.sum(q0 * q1, axis=-1, keepdims=True)
+    # q and -q are the same rotation, take the short way around
+    q1 = np.where(dot < 0, -q1, q1)
+    dot = np.abs(dot)
+
+    theta = np.arccos(np.clip(dot, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    # nearly identical orientations: fall back to normalized linear interpolation
+    close = sin_theta < 1e-6
+    safe_sin = np.where(close, 1.0, sin_theta)
+    w0 = np.where(close, 1.0 - t, np.sin((1.0 - t) * theta) / safe_sin)
+    w1 = np.where(close, t, np.sin(t * theta) / safe_sin)
+    return normalizeQuaternions(w0 * q0 + w1 * q1)
+
+
+# interpolate (N, 7) poses sampled at increasing times to query_times: position linearly,
+# orientation with slerp. Queries outside the sampled range hold the first/last pose.
+def interpolatePoses(times, poses, query_times):
+    times = np.asarray(times, dtype=np.float64)
+    poses = np.asarray(poses, dtype=np.float64)
+    query_times = np.atleast_1d(np.asarray(query_times, dtype=np.float64))
+    if len(times) == 1:
+        return np.repeat(poses, len(query_times), axis=0)
+
+    index = np.clip(np.searchsorted(times, query_times, side="right") - 1, 0, len(times) - 2)
+    dt = times[index + 1] - times[index]
+    t = np.where(dt > 0, (query_times - times[index]) / np.where(dt > 0, dt, 1.0), 1.0)
+    t = np.clip(t, 0.0, 1.0)
+
+    p0 = poses[index]
+    p1 = poses[index + 1]
+    result = np.empty((len(query_times), 7))
+    result[:, 0:3] = p0[:, 0:3] + t[:, None] * (p1[:, 0:3] - p0[:, 0:3])
+    result[:, 3:7] = slerp(p0[:, 3:7], p1[:, 3:7], t)
+    return result
+
+
+class PoseInterpolator:
+    """Resamples timestamped tracker poses at the display rate.
+
+    Samples are buffered as they arrive and sample(now) returns the pose at
+    `now - delay`, interpolated between the two surrounding samples, so the
+    needle moves smoothly even when the tracker is slower than the display or
+    its samples arrive unevenly. Rendering lags by `delay`; if it is None the
+    median tracker interval of the buffered samples is used.
+    """
+
+    def __init__(self, delay=None, history=64):
+        self.delay = delay
+        self._times = collections.deque(maxlen=history)
+        self._poses = collections.deque(maxlen=history)
+
+    def clear(self):
+        self._times.clear()
+        self._poses.clear()
+
+    def addSamples(self, samples):
+        for sample in samples:
+            # samples read in the same batch share a timestamp, keep the newest one
+            if self._times and sample.timestamp <= self._times[-1]:
+                self._poses[-1] = sample.pose
+                continue
+            self._times.append(sample.timestamp)
+            self._poses.append(sample.pose)
+
+    def currentDelay(self):
+        if self.delay is not None:
+            return self.delay
+        if len(self._times) < 2:
+            return 0.0
+        return float(np.median(np.diff(self._times)))
+
+    # interpolated pose for display time now, None before the first sample
+    def sample(self, now):
+        if not self._times:
+            return None
+        return interpolatePoses(self._times, self._poses, now - self.currentDelay())[0]
+
+
+def quaternionConjugate(q):
+    q = np.array(q, dtype=np.float64)
+    q[..., 1:] *= -1
+    return q
+
+
+# Hamilton product of [qw, qx, qy, qz] quaternion arrays
+def quaternionMultiply(a, b):
+    a = np.asarray(a, dtype=np.float64)
+    b = np.asarray(b, dtype=np.float64)
+    aw, ax, ay, az = a[..., 0], a[..., 1], a[..., 2], a[..., 3]
+    bw, bx, by, bz = b[..., 0], b[..., 1], b[..., 2], b[..., 3]
+    return np.stack(
+        [
+            aw * bw - ax * bx - ay * by - az * bz,
+            aw * bx + ax * bw + ay * bz - az * by,
+            aw * by - ax * bz + ay * bw + az * bx,
+            aw * bz + ax * by - ay * bx + az * bw,
+        ],
+        axis=-1,
+    )
+
+
+# rotation vector (axis * angle) of a unit quaternion
+def quaternionToRotationVector(q):
+    q = normalizeQuaternions(q)
+    q = np.where(q[..., :1] < 0, -q, q)
+    sin_half = np.linalg.norm(q[..., 1:], axis=-1, keepdims=True)
+    angle = 2.0 * np.arctan2(sin_half, q[..., :1])
+    scale = np.where(sin_half > 1e-12, angle / np.where(sin_half > 1e-12, sin_half, 1.0), 2.0)
+    return q[..., 1:] * scale
+
+
+def rotationVectorToQuaternion(v):
+    v = np.asarray(v, dtype=np.float64)
+    angle = np.linalg.norm(v, axis=-1, keepdims=True)
+    half = 0.5 * angle
+    scale = np.where(angle > 1e-12, np.sin(half) / np.where(angle > 1e-12, angle, 1.0), 0.5)
+    return np.concatenate([np.cos(half), v * scale], axis=-1)
+
+
+class PosePredictor:
+    """Extrapolates tracker poses forward to compensate pipeline latency.
+
+    Position uses a constant-velocity Kalman filter (the three axes share one
+    2x2 covariance, since they have the same noise model). Orientation uses an
+    exponentially smoothed angular velocity estimated from consecutive samples.
+    A rotation faster than `max_angular_speed` (rad/s) between two samples is a
+    tracker jump rather than motion: the angular velocity is then reset instead
+    of extrapolating the jump.
+    update() filters a new sample, predict(lookahead) returns the pose
+    `lookahead` seconds after the last sample.
+    """
+
+    def __init__(
+        self,
+        process_noise=5000.0,
+        measurement_noise=0.05,
+        rate_smoothing=0.5,
+        max_lookahead=0.2,
+        max_angular_speed=10.0,
+    ):
+        self.process_noise = process_noise
+        self.measurement_noise = measurement_noise
+        self.rate_smoothing = rate_smoothing
+        self.max_lookahead = max_lookahead
+        self.max_angular_speed = max_angular_speed
+        self.reset()
+
+    def reset(self):
+        self.timestamp = None
+        self.state = np.zeros((2, 3))  # rows: position, velocity
+        self.covariance = np.eye(2) * 1e3
+        self.quat = None
+        self.angular_velocity = np.zeros(3)
+
+    def update(self, timestamp, pose):
+        pos = np.asarray(pose[0:3], dtype=np.float64)
+        quat = normalizeQuaternions(pose[3:7])
+
+        if self.timestamp is None:
+            self.timestamp = timestamp
+            self.state[0] = pos
+            self.state[1] = 0.0
+            self.covariance = np.diag([self.measurement_noise, 1e3])
+            self.quat = quat
+            return
+
+        dt = timestamp - self.timestamp
+        if dt <= 0:  # same batch, just correct with the newer measurement
+            dt = 0.0
+
+        # predict
+        F = np.array([[1.0, dt], [0.0, 1.0]])
+        Q = self.process_noise * np.array(
+            [[dt**3 / 3.0, dt**2 / 2.0], [dt**2 / 2.0, dt]]
+        )
+        self.state = F @ self.state
+        P = F @ self.covariance @ F.T + Q
+
+        # correct, measurement is the position row
+        innovation = pos - self.state[0]
+        gain = P[:, 0] / (P[0, 0] + self.measurement_noise)
+        self.state += np.outer(gain, innovation)
+        self.covariance = P - np.outer(gain, P[0, :])
+
+        if dt > 0:
+            if np.dot(quat, self.quat) < 0:
+                quat = -quat
+            delta = quaternionMultiply(quat, quaternionConjugate(self.quat))
+            rate = quaternionToRotationVector(delta) / dt
+            if np.linalg.norm(rate) > self.max_angular_speed:
+                self.angular_velocity = np.zeros(3)
+            else:
+                a = self.rate_smoothing
+                self.angular_velocity = a * rate + (1.0 - a) * self.angular_velocity
+        self.quat = quat
+        self.timestamp = timestamp
+
+    # pose extrapolated lookahead seconds past the last update
+    def predict(self, lookahead):
+        if self.timestamp is None:
+            return None
+        dt = float(np.clip(lookahead, 0.0, self.max_lookahead))
+        pose = np.empty(7)
+        pose[0:3] = self.state[0] + self.state[1] * dt
+        rotation = rotationVectorToQuaternion(self.angular_velocity * dt)
+        pose[3:7] = normalizeQuaternions(quaternionMultiply(rotation, self.quat))
+        return pose
+
+
+# replay (N, 7) poses sampled at `rate` Hz through a predictor and compare the pose
+# predicted `steps` samples ahead with the recorded one. Returns per-sample
+# (predicted position error, held position error, predicted angle error, held angle error)
+# and the mean time per update + predict call in seconds.
+def evaluatePredictor(poses, rate=50.0, steps=2, predictor=None):
+    if predictor is None:
+        predictor = PosePredictor()
+    poses = np.asarray(poses, dtype=np.float64)
+    lookahead = steps / rate
+    n = len(poses) - steps
+    predicted = np.empty((n, 7))
+
+    start = time.perf_counter()
+    for i in range(n):
+        predictor.update(i / rate, poses[i])
+        predicted[i] = predictor.predict(lookahead)
+    elapsed = (time.perf_counter() - start) / max(n, 1)
+
+    actual = poses[steps:]
+    held = poses[:n]
+
+    def angleError(q0, q1):
+        dot = np.abs(np.sum(normalizeQuaternions(q0) * normalizeQuaternions(q1), axis=1))
+        return 2.0 * np.arccos(np.clip(dot, -1.0, 1.0))
+
+    errors = np.stack(
+        [
+            np.linalg.norm(predicted[:, 0:3] - actual[:, 0:3], axis=1),
+            np.linalg.norm(held[:, 0:3] - actual[:, 0:3], axis=1),
+            angleError(predicted[:, 3:7], actual[:, 3:7]),
+            angleError(held[:, 3:7], actual[:, 3:7]),
+        ],
+        axis=1,
+    )
+    return errors, elapsed
@@ -0,0 +1,171 @@
+"""Library of recorded needle motions with a binary cache.
+
+Recordings are text files (one pose per line, optionally with a leading
+timestamp column). The first time a recording is seen it is parsed once and
+stored as a .npy array in the cache directory, under a name derived from its
+path, size and modification time, so an edited recording is converted again
+automatically. Later loads memory-map the .npy file instead of parsing text.
+Per recording metadata (frames, duration, position bounding box) is kept in
+an index next to the cached arrays.
+"""
+
+import collections
+import fnmatch
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+
+# files picked up by a scan
+RECORDING_PATTERNS = ["recording*.txt", "demo*.txt"]
+
+CACHE_FOLDER = ".recording-cache"
+INDEX_FILE = "index.json"
+
+Recording = collections.namedtuple(
+    "Recording",
+    ["name", "path", "frames", "duration", "bbox_min", "bbox_max", "cache_path"],
+)
+
+
+def _cacheKey(path, stat):
+    key = f"{os.path.abspath(path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return hashlib.sha1(key.encode()).hexdigest()[:16]
+
+
+class RecordingLibrary:
+    """Recordings found in `directory`, converted to memory-mappable arrays on demand.
+
+    `rate` is the sample rate in Hz assumed for recordings without a timestamp
+    column when computing their duration. The cache lives in `cache_directory`
+    (by default a hidden folder in `directory`, or the temp folder if that is
+    not writable).
+    """
+
+    def __init__(self, directory, cache_directory=None, patterns=None, rate=50.0):
+        self.directory = directory
+        self.patterns = patterns or RECORDING_PATTERNS
+        self.rate = rate
+        self.cache_directory = cache_directory or os.path.join(directory, CACHE_FOLDER)
+        self._index = None
+        self.recordings = collections.OrderedDict()
+
+    def _prepareCache(self):
+        try:
+            os.makedirs(self.cache_directory, exist_ok=True)
+            if not os.access(self.cache_directory, os.W_OK):
+                raise OSError("cache folder is read-only")
+        except OSError:
+            self.cache_directory = os.path.join(
+                tempfile.gettempdir(), "NeedleDeployment" + CACHE_FOLDER
+            )
+            os.makedirs(self.cache_directory, exist_ok=True)
+
+    def _loadIndex(self):
+        if self._index is None:
+            try:
+                with open(os.path.join(self.cache_directory, INDEX_FILE)) as file:
+                    self._index = json.load(file)
+            except (OSError, ValueError):
+                self._index = {}
+        return self._index
+
+    def _saveIndex(self):
+        path = os.path.join(self.cache_directory, INDEX_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(self._index, file, indent=1)
+        os.replace(path + ".tmp", path)
+
+    # parse a recording and store it as .npy, returns its metadata entry
+    def _convert(self, name, path, key):
+        data = loadData(path)
+        cache_path = os.path.join(self.cache_directory, f"{os.path.splitext(name)[0]}-{key}.npy")
+        with open(cache_path + ".tmp", "wb") as file:
+            np.save(file, data)
+        os.replace(cache_path + ".tmp", cache_path)
+
+        # leading timestamp column (t x y z qw qx qy qz) or a fixed sample rate
+        if data.shape[1] == 8:
+            positions = data[:, 1:4]
+            duration = float(data[-1, 0] - data[0, 0]) if len(data) else 0.0
+        else:
+            positions = data[:, 0:3]
+            duration = max(len(data) - 1, 0) / self.rate
+        if len(data):
+            bbox_min, bbox_max = positions.min(axis=0).tolist(), positions.max(axis=0).tolist()
+        else:
+            bbox_min, bbox_max = [0.0] * 3, [0.0] * 3
+        return {
+            "key": key,
+            "cache": os.path.basename(cache_path),
+            "frames": len(data),
+            "duration": duration,
+            "bbox_min": bbox_min,
+            "bbox_max": bbox_max,
+        }
+
+    # find recordings in the directory, converting new and changed ones. Returns them sorted by name
+    def scan(self):
+        self._prepareCache()
+        index = self._loadIndex()
+        changed = False
+        names = sorted(
+            name
+            for name in os.listdir(self.directory)
+            if any(fnmatch.fnmatch(name, pattern) for pattern in self.patterns)
+        )
+
+        self.recordings = collections.OrderedDict()
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                key = _cacheKey(path, os.stat(path))
+                entry = index.get(name)
+                cache_path = entry and os.path.join(self.cache_directory, entry["cache"])
+                if entry is None or entry["key"] != key or not os.path.isfile(cache_path):
+                    if entry is not None and os.path.isfile(cache_path):
+                        os.remove(cache_path)  # stale conversion of an edited recording
+                    entry = self._convert(name, path, key)
+                    index[name] = entry
+                    changed = True
+            except (OSError, ValueError) as error:
+                print(f"Skipping recording {name}: {error}")
+                continue
+            self.recordings[name] = Recording(
+                name,
+                path,
+                entry["frames"],
+                entry["duration"],
+                np.array(entry["bbox_min"]),
+                np.array(entry["bbox_max"]),
+                os.path.join(self.cache_directory, entry["cache"]),
+            )
+
+        for name in [name for name in index if name not in self.recordings]:
+            del index[name]
+            changed = True
+        if changed:
+            self._saveIndex()
+        return list(self.recordings.values())
+
+    def names(self):
+        return list(self.recordings.keys())
+
+    # recording array as a read-only memory map of its cached conversion
+    def load(self, name):
+        if name not in self.recordings:
+            self.scan()
+        return np.load(self.recordings[name].cache_path, mmap_mode="r")
+
+    # one line summary for tooltips
+    def describe(self, name):
+        recording = self.recordings[name]
+        size = recording.bbox_max - recording.bbox_min
+        return (
+            f"{recording.frames} frames, {recording.duration:.1f} s, "
+            f"bounding box {size[0]:.0f} x {size[1]:.0f} x {size[2]:.0f} mm"
+        )
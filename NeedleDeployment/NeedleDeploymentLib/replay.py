@@ -0,0 +1,125 @@
+"""Replays a recorded needle motion over a localhost socket.
+
+Simulates the needle tracker for the "udp"/"tcp"/"ring" live pose sources, e.g.
+
+    python -m NeedleDeploymentLib.replay Resources/Data/recording2.txt --rate 200
+
+Recordings with a leading timestamp column are replayed at their recorded
+timing unless --rate is given, plain recordings at 50 Hz. Run from the
+NeedleDeployment module directory.
+"""
+
+import argparse
+import socket
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.ringbuffer import PoseRingBufferWriter
+from NeedleDeploymentLib.tracking import (
+    DEFAULT_HOST,
+    DEFAULT_PORT,
+    POSE_FIELDS,
+    packPose,
+    unpackPose,
+)
+
+
+# (N, 7) poses of a recording and their times in seconds, None for recordings without a
+# timestamp column (t x y z qw qx qy qz)
+def loadRecording(path):
+    data = loadData(path, columns=(POSE_FIELDS, POSE_FIELDS + 1))
+    if len(data) == 0:
+        raise ValueError(f"{path} holds no poses")
+    if data.shape[1] == POSE_FIELDS + 1:
+        return data[:, 1:], data[:, 0] - data[0, 0]
+    return data, None
+
+
+class _RingSender:
+    def __init__(self, ring_path):
+        self.writer = PoseRingBufferWriter(ring_path)
+
+    def sendall(self, packet):
+        self.writer.write(unpackPose(packet))
+
+    def close(self):
+        self.writer.close()
+
+
+def replay(
+    path,
+    protocol="udp",
+    host=DEFAULT_HOST,
+    port=DEFAULT_PORT,
+    rate=None,
+    loop=False,
+    ring_path=None,
+):
+    poses, times = loadRecording(path)
+    if times is None or rate is not None:
+        rate = rate or 50.0
+        times = np.arange(len(poses)) / rate
+    if protocol == "udp":
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.connect((host, port))
+        target = f"udp://{host}:{port}"
+    elif protocol == "tcp":
+        sock = socket.create_connection((host, port))
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        target = f"tcp://{host}:{port}"
+    else:
+        sock = _RingSender(ring_path)
+        target = ring_path
+
+    timing = f"{rate} Hz" if rate else "recorded timing"
+    print(f"Replaying {len(poses)} poses from {path} to {target} at {timing}")
+    # a loop restarts one sample interval after the last pose
+    period = times[-1] + (times[-1] - times[-2] if len(times) > 1 else 1.0 / 50.0)
+    try:
+        start = time.perf_counter()
+        while True:
+            for pose, t in zip(poses, times):
+                delay = start + t - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                sock.sendall(packPose(pose))
+            if not loop:
+                break
+            start += period
+    finally:
+        sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "recording", help="recording file with 7 values (pos + quat) per line, optionally after a time"
+    )
+    parser.add_argument("--protocol", choices=["udp", "tcp", "ring"], default="udp")
+    parser.add_argument("--host", default=DEFAULT_HOST)
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument(
+        "--rate", type=float, help="poses per second (default: recorded timing, or 50)"
+    )
+    parser.add_argument(
+        "--ring-path",
+        default="Resources/Data/needle-tracker.ring",
+        help="ring buffer file written with --protocol ring",
+    )
+    parser.add_argument("--loop", action="store_true", help="restart at the end of the recording")
+    args = parser.parse_args(argv)
+    replay(
+        args.recording,
+        args.protocol,
+        args.host,
+        args.port,
+        args.rate,
+        args.loop,
+        args.ring_path,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,256 @@
+"""Memory-mapped ring buffer for tracker poses.
+
+File layout (little endian):
+
+    header   HEADER_DTYPE, HEADER_SIZE bytes: magic, version, capacity,
+             record size and the sequence number of the newest record
+    records  capacity * RECORD_DTYPE: seq_begin, timestamp, pose (pos + quat), seq_end
+
+Sequence numbers start at 1. Record ``seq`` lives in slot ``(seq - 1) % capacity``.
+The writer stamps seq_begin, fills the record, stamps seq_end and only then
+publishes the new sequence in the header. A reader that sees seq_begin and
+seq_end disagree with the sequence it expects has caught the record mid-write
+(torn read) and retries.
+"""
+
+import mmap
+import os
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.poses import PoseSample
+
+MAGIC = b"NDRB"
+VERSION = 1
+DEFAULT_CAPACITY = 1024
+
+HEADER_DTYPE = np.dtype(
+    [
+        ("magic", "S4"),
+        ("version", "<u4"),
+        ("capacity", "<u4"),
+        ("record_size", "<u4"),
+        ("sequence", "<u8"),
+        ("reserved", "u1", (40,)),
+    ]
+)
+HEADER_SIZE = HEADER_DTYPE.itemsize
+
+RECORD_DTYPE = np.dtype(
+    [
+        ("seq_begin", "<u8"),
+        ("timestamp", "<f8"),
+        ("pose", "<f8", (7,)),
+        ("seq_end", "<u8"),
+    ]
+)
+
+# number of attempts to read the newest record while the writer keeps overwriting it
+READ_RETRIES = 3
+
+
+def _views(buffer, capacity=None):
+    header = np.frombuffer(buffer, dtype=HEADER_DTYPE, count=1)
+    if capacity is None:
+        capacity = int(header["capacity"][0])
+    records = np.frombuffer(
+        buffer, dtype=RECORD_DTYPE, count=capacity, offset=HEADER_SIZE
+    )
+    return header, records
+
+
+class PoseRingBufferWriter:
+    """Tracker side of the ring buffer: appends timestamped poses."""
+
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        size = HEADER_SIZE + capacity * RECORD_DTYPE.itemsize
+        # never truncate a buffer a reader may still have mapped, the new buffer is
+        # set up under a temporary name and then replaces the old file
+        tmp_path = path + ".tmp"
+        self._file = open(tmp_path, "w+b")
+        self._file.truncate(size)
+        self._mmap = mmap.mmap(self._file.fileno(), size)
+
+        self._header, self._records = _views(self._mmap, capacity)
+        self._header["magic"] = MAGIC
+        self._header["version"] = VERSION
+        self._header["capacity"] = capacity
+        self._header["record_size"] = RECORD_DTYPE.itemsize
+        self._header["sequence"] = 0
+        self._mmap.flush()
+        os.replace(tmp_path, path)
+        self.sequence = 0
+
+    def write(self, pose, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        seq = self.sequence + 1
+        record = self._records[(seq - 1) % len(self._records)]
+        record["seq_begin"] = seq
+        record["timestamp"] = timestamp
+        record["pose"] = pose[:7]
+        record["seq_end"] = seq
+        self._header["sequence"] = seq
+        self.sequence = seq
+        return seq
+
+    def close(self):
+        if self._mmap is not None:
+            del self._header, self._records
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+
+
+class PoseRingBuffer:
+    """Reader side of the ring buffer, usable as a live pose source.
+
+    The file is mapped read-only and records are accessed through NumPy views,
+    so reading the newest sample involves no text parsing. If the file does not
+    exist yet, every poll() retries opening it. A file that is not a pose ring
+    buffer (or is cut short) is reported once and then ignored until it changes.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.last_sequence = 0
+        self.torn_reads = 0
+        self.overruns = 0
+        self._file = None
+        self._mmap = None
+        # (inode, size, mtime) of a file rejected by _checkHeader
+        self._rejected = None
+
+    # why the mapped file is not a usable ring buffer, None if it is one
+    def _checkHeader(self):
+        if len(self._mmap) < HEADER_SIZE:
+            return "header is cut short"
+        header = np.frombuffer(self._mmap, dtype=HEADER_DTYPE, count=1)
+        if (
+            header["magic"][0] != MAGIC
+            or header["version"][0] != VERSION
+            or header["record_size"][0] != RECORD_DTYPE.itemsize
+        ):
+            return f"not a version {VERSION} pose ring buffer"
+        capacity = int(header["capacity"][0])
+        if capacity == 0 or len(self._mmap) < HEADER_SIZE + capacity * RECORD_DTYPE.itemsize:
+            return "records are cut short"
+        return None
+
+    def _open(self):
+        try:
+            stat = os.stat(self.path)
+        except OSError:  # not created yet
+            return False
+        file_id = (stat.st_ino, stat.st_size, stat.st_mtime_ns)
+        if file_id == self._rejected:
+            return False
+        try:
+            self._file = open(self.path, "rb")
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):  # missing or still empty file
+            if self._file is not None:
+                self._file.close()
+            self._file = None
+            return False
+        self._inode = os.fstat(self._file.fileno()).st_ino
+        error = self._checkHeader()
+        if error is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
+            self._rejected = file_id
+            print(f"Ignoring pose ring buffer {self.path}: {error}")
+            return False
+        self._rejected = None
+        self._header, self._records = _views(self._mmap)
+        self.last_sequence = 0
+        return True
+
+    def close(self):
+        if self._mmap is not None:
+            del self._header, self._records
+            self._mmap.close()
+            self._file.close()
+        self._mmap = None
+        self._file = None
+
+    @property
+    def sequence(self):
+        return int(self._header["sequence"][0])
+
+    # record with sequence number seq as (timestamp, pose copy), None if overwritten or torn
+    def read(self, seq):
+        record = self._records[(seq - 1) % len(self._records)]
+        if record["seq_end"] == seq:
+            timestamp = float(record["timestamp"])
+            pose = record["pose"].copy()
+            # a newer write into this slot stamps seq_begin first
+            if record["seq_begin"] == seq:
+                return timestamp, pose
+        self.torn_reads += 1
+        return None
+
+    # newest record as (seq, timestamp, pose), None if the buffer is empty
+    def latest(self):
+        if self._mmap is None and not self._open():
+            return None
+        for attempt in range(READ_RETRIES):
+            seq = self.sequence
+            if seq == 0:
+                return None
+            sample = self.read(seq)
+            if sample is not None:
+                return (seq,) + sample
+        return None
+
+    # all records written since the previous call as PoseSamples, oldest first.
+    # If the reader fell more than a full buffer behind, the overwritten records are counted
+    # in `overruns` and skipped.
+    def readSamples(self):
+        if self._mmap is None and not self._open():
+            return []
+        if self.sequence == self.last_sequence and self._wasReplaced():
+            self.close()
+            if not self._open():
+                return []
+        seq = self.sequence
+        if seq < self.last_sequence:
+            self.last_sequence = 0
+        first = max(self.last_sequence + 1, seq - len(self._records) + 1)
+        self.overruns += first - (self.last_sequence + 1)
+        ingest_ns = time.perf_counter_ns()
+        # records are stamped with time.time(), sample_ns is the same moment on the perf counter clock
+        clock_offset = ingest_ns - time.time_ns()
+        samples = []
+        for s in range(first, seq + 1):
+            sample = self.read(s)
+            if sample is not None:
+                timestamp, pose = sample
+                sample_ns = int(timestamp * 1e9) + clock_offset
+                samples.append(PoseSample(timestamp, pose, sample_ns, ingest_ns))
+        self.last_sequence = seq
+        return samples
+
+    # true if the tracker replaced the buffer file since it was mapped
+    def _wasReplaced(self):
+        try:
+            return os.stat(self.path).st_ino != self._inode
+        except OSError:
+            return False
+
+    # newest pose written since the previous call, None if there is none
+    def poll(self):
+        latest = self.latest()
+        if latest is None or latest[0] == self.last_sequence:
+            if self._mmap is not None and self._wasReplaced():
+                self.close()
+                latest = self.latest()
+            if latest is None or latest[0] == self.last_sequence:
+                return None
+        self.last_sequence = latest[0]
+        return latest[2]
+
@@ -0,0 +1,146 @@
+"""Precision of needle poses with respect to a needle plan.
+
+This is the math behind the position and orientation legends of the
+NeedleDeployment module, vectorized over any number of poses so recorded
+trials can be scored offline without Slicer:
+
+    plan = NeedlePlan.fromFile("Resources/Data/needle_deployment.txt")
+    scores = scorePoses(loadData("Resources/Data/recording5.txt"), plan)
+    precisionPercent(scores.position_precision)
+"""
+
+import collections
+import hashlib
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.plans import PlanGeometry
+from NeedleDeploymentLib.poses import quaternionsToRotationMatrices
+
+# per-frame scores, one array entry per pose:
+# index               plan point nearest to the closest point on the plan
+# distance            to the closest point on the plan polyline
+# radius              allowed distance (funnel radius) at the closest point
+# position_within     distance <= radius
+# position_precision  1 - distance / radius inside the funnel, 0 outside
+# angle               between needle direction and the allowed cone axis at index, in radians
+# max_angle           cone opening angle at the closest point, in radians
+# angle_within        angle <= max_angle / 2
+# angle_precision     1 - angle / max_angle inside the cone, 0 outside
+# segment             plan segment of the closest point
+# arc_length          of the closest point along the plan
+# point               closest point on the plan, (N, 3)
+# progress            insertion progress in percent of the plan length
+# remaining           path length left to the Target (end of the plan), negative past it
+# axial_deviation     tip offset along the plan before its start or past its end
+# lateral_deviation   tip distance across the plan
+PoseScores = collections.namedtuple(
+    "PoseScores",
+    [
+        "index",
+        "distance",
+        "radius",
+        "position_within",
+        "position_precision",
+        "angle",
+        "max_angle",
+        "angle_within",
+        "angle_precision",
+        "segment",
+        "arc_length",
+        "point",
+        "progress",
+        "remaining",
+        "axial_deviation",
+        "lateral_deviation",
+    ],
+)
+
+
+class NeedlePlan:
+    """Plan arrays needed for scoring, from the columns of needle_deployment.txt."""
+
+    def __init__(self, data):
+        data = np.ascontiguousarray(data, dtype=np.float64)
+        # identifies the plan in session logs
+        self.content_hash = hashlib.sha1(data.tobytes()).hexdigest()
+        self.positions = np.ascontiguousarray(data[:, 7:10])
+        self.quaternions = np.ascontiguousarray(data[:, 10:14])
+        self.directions = quaternionsToRotationMatrices(self.quaternions)[:, :, 2]
+        self.funnel_radii = np.ascontiguousarray(data[:, 15])
+        self.max_angle = np.ascontiguousarray(data[:, 17])
+        self.cone_directions = np.ascontiguousarray(data[:, 18:21])
+        self.geometry = PlanGeometry(self.positions, self.funnel_radii, self.max_angle)
+
+    @classmethod
+    def fromFile(cls, path):
+        return cls(loadData(path, 1))
+
+    def __len__(self):
+        return len(self.positions)
+
+
+# score needle tip positions (N, 3) and needle directions (N, 3), in plan coordinates.
+# With use_plan_orientation the angle is measured against the plan direction instead of the cone axis.
+# projection is the plans.PlanProjection of positions if already known (e.g. from a PlanTracker)
+def scoreNeedleTips(positions, directions, plan, use_plan_orientation=False, projection=None):
+    positions = np.atleast_2d(np.asarray(positions, dtype=np.float64))
+    directions = np.atleast_2d(np.asarray(directions, dtype=np.float64))
+
+    if projection is None:
+        projection = plan.geometry.project(positions)
+    index = projection.index
+    distance = projection.distance
+    radius = projection.radius
+    position_within = distance <= radius
+    safe_radius = np.where(radius > 0, radius, 1.0)
+    position_precision = np.where(
+        position_within & (radius > 0), 1.0 - distance / safe_radius, 0.0
+    )
+
+    reference = plan.directions[index] if use_plan_orientation else plan.cone_directions[index]
+    cos_theta = np.einsum("ij,ij->i", reference, directions) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(directions, axis=1)
+    )
+    angle = np.arccos(np.clip(cos_theta, -1.0, 1.0))
+    max_angle = projection.max_angle
+    angle_within = angle <= max_angle / 2
+    safe_max_angle = np.where(max_angle > 0, max_angle, 1.0)
+    angle_precision = np.where(
+        angle_within & (max_angle > 0), 1.0 - angle / safe_max_angle, 0.0
+    )
+
+    return PoseScores(
+        index,
+        distance,
+        radius,
+        position_within,
+        position_precision,
+        angle,
+        max_angle,
+        angle_within,
+        angle_precision,
+        projection.segment,
+        projection.arc_length,
+        projection.point,
+        *plan.geometry.progress(positions, projection),
+    )
+
+
+# score (N, 7) tracker poses (pos + quat). registration is the 4x4 tracker to plan
+# transform applied to the needle model (needle_registration), identity by default
+def scorePoses(poses, plan, registration=None, use_plan_orientation=False):
+    poses = np.atleast_2d(np.asarray(poses, dtype=np.float64))
+    positions = poses[:, 0:3]
+    directions = quaternionsToRotationMatrices(poses[:, 3:7])[:, :, 2]
+    if registration is not None:
+        registration = np.asarray(registration, dtype=np.float64)
+        positions = positions @ registration[:3, :3].T + registration[:3, 3]
+        directions = directions @ registration[:3, :3].T
+    return scoreNeedleTips(positions, directions, plan, use_plan_orientation)
+
+
+# precision fractions as the integer percentages shown on the legends
+def precisionPercent(precision):
+    return np.round(np.asarray(precision) * 100).astype(int)
@@ -0,0 +1,471 @@
+"""Binary session log: needle poses and spacebar events of the study sessions.
+
+The file is append-only and made of chunks, each a 16 byte chunk header (magic,
+kind, payload length) followed by its payload:
+
+- a header chunk starts every session. Its JSON payload holds the schema
+  version, the record layout, the needle registration, the hash of the plan
+  the poses were scored against and the wall clock and monotonic times the
+  session started at.
+- a records chunk holds fixed-size records (RECORD_DTYPE) of the current
+  session: the session start, every needle pose (the poses shown with their
+  nearest plan index, position/angle precision and insertion progress as on
+  the legends) and every spacebar press (phase change).
+- a plan chunk marks a switch to another plan during the session. Its JSON
+  payload holds the number of the switch, the hash of the new plan and the
+  time of the switch, and a PLAN_CHANGE record with that number follows it.
+  Poses after the record were scored against the new plan.
+
+Record times are time.monotonic() seconds. A file can be memory-mapped and its
+records used as NumPy arrays without parsing, and an interrupted write only
+loses the records of the last, incomplete chunk. The widgets write the log in
+segments (see sessions), each starting with the header of its session and its
+last plan chunk. Usage
+(from the NeedleDeployment directory):
+
+    python -m NeedleDeploymentLib.sessionlog info needle-session-0001.ndlog [...]
+    python -m NeedleDeploymentLib.sessionlog export needle-session-0001.ndlog [...]
+        [--poses needle-timestamps.txt] [--markers timestamps.txt]
+
+export writes the text layout of the widgets' previous logs: a blank line at
+the start of every session, then `t x y z qw qx qy qz` per pose or the time of
+each spacebar press, in seconds since the session started.
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+SESSION_LOG_NAME = "needle-session"
+SESSION_LOG_EXTENSION = ".ndlog"
+SCHEMA_VERSION = 1
+
+CHUNK_MAGIC = b"NDLC"
+CHUNK_HEADER_DTYPE = np.dtype([("magic", "S4"), ("kind", "<u4"), ("length", "<u8")])
+HEADER_CHUNK = 1
+RECORDS_CHUNK = 2
+PLAN_CHUNK = 3
+
+# record kinds
+POSE = 0
+SESSION_START = 1
+EVENT = 2
+PLAN_CHANGE = 3
+
+# kind               POSE, SESSION_START, EVENT or PLAN_CHANGE
+# phase              eventCount of the widget when the record was written
+# index              nearest plan point of a pose (-1 if not scored), number of the plan
+#                    switch of a PLAN_CHANGE record
+# time               time.monotonic() seconds
+# position           needle position (x, y, z) in tracker coordinates
+# quaternion         needle orientation (qw, qx, qy, qz)
+# position_precision as on the legends, 0 to 1 (NaN if not scored)
+# angle_precision    as on the legends, 0 to 1 (NaN if not scored)
+# sample_ns          time.perf_counter_ns() of the tracker sample (-1 if unknown)
+# ingest_ns          time.perf_counter_ns() when the ingest thread read the pose (-1 if unknown)
+# applied_ns         time.perf_counter_ns() when the pose was applied to the needle transform
+#                    (-1 if it was only logged)
+# progress           insertion progress in percent of the plan length (NaN if not scored)
+# remaining          path length left to the Target in mm (NaN if not scored)
+# axial_deviation    tip offset along the plan before its start or past its end (NaN if not scored)
+# lateral_deviation  tip distance across the plan (NaN if not scored)
+RECORD_DTYPE = np.dtype(
+    [
+        ("kind", "<u2"),
+        ("phase", "<u2"),
+        ("index", "<i4"),
+        ("time", "<f8"),
+        ("position", "<f8", (3,)),
+        ("quaternion", "<f8", (4,)),
+        ("position_precision", "<f4"),
+        ("angle_precision", "<f4"),
+        ("sample_ns", "<i8"),
+        ("ingest_ns", "<i8"),
+        ("applied_ns", "<i8"),
+        ("progress", "<f4"),
+        ("remaining", "<f4"),
+        ("axial_deviation", "<f4"),
+        ("lateral_deviation", "<f4"),
+    ]
+)
+
+# insertion progress fields, logged from the scoring.PoseScores fields of the same name
+PROGRESS_FIELDS = ("progress", "remaining", "axial_deviation", "lateral_deviation")
+
+
+def _chunk(kind, payload):
+    # payloads are padded to 8 bytes so records stay aligned in a memory map
+    payload = payload + b"\0" * (-len(payload) % 8)
+    header = np.array([(CHUNK_MAGIC, kind, len(payload))], dtype=CHUNK_HEADER_DTYPE)
+    return header.tobytes() + payload
+
+
+class SessionLogWriter:
+    """Writes sessions to a binary log.
+
+    `output` is the log (a sessions.SegmentedLog), anything with a write(bytes)
+    method. If it has a `preamble` attribute, the header of the current session
+    (and its last plan chunk) is stored there. Records are collected in a buffer of `chunk_records`
+    records and written as one chunk when it is full, `flush_interval` seconds
+    after its first record, or on flush() and close().
+    """
+
+    def __init__(self, output, chunk_records=256, flush_interval=0.5):
+        self.output = output
+        self.flush_interval = flush_interval
+        self._buffer = np.zeros(chunk_records, dtype=RECORD_DTYPE)
+        self._count = 0
+        self._since = None
+        self.start_time = None
+        self._header = b""
+        self._plan_changes = 0
+
+    # write the header of a new session and its start record
+    def startSession(self, registration=None, plan_hash=None, **metadata):
+        self.flush()
+        self.start_time = time.monotonic()
+        header = {
+            "schema": SCHEMA_VERSION,
+            "record_dtype": RECORD_DTYPE.descr,
+            "registration": np.asarray(
+                registration if registration is not None else np.eye(4), dtype=np.float64
+            ).tolist(),
+            "plan_hash": plan_hash,
+            "wall_time": time.time(),
+            "start_time": self.start_time,
+        }
+        header.update(metadata)
+        self._header = _chunk(HEADER_CHUNK, json.dumps(header).encode())
+        self._plan_changes = 0
+        if hasattr(self.output, "preamble"):
+            self.output.preamble = self._header
+        self.output.write(self._header)
+        self.addEvent(self.start_time, 0, SESSION_START)
+
+    # switch the current session to another plan: poses added from now on were scored against it
+    def changePlan(self, plan_hash, phase=0, **metadata):
+        self.flush()
+        self._plan_changes += 1
+        t = time.monotonic()
+        plan = {"number": self._plan_changes, "plan_hash": plan_hash, "time": t}
+        plan.update(metadata)
+        plan = _chunk(PLAN_CHUNK, json.dumps(plan).encode())
+        if hasattr(self.output, "preamble"):
+            self.output.preamble = self._header + plan
+        self.output.write(plan)
+        self.addEvent(t, phase, PLAN_CHANGE, self._plan_changes)
+
+    def _reserve(self, count):
+        if self._count + count > len(self._buffer):
+            self.flush()
+            if count > len(self._buffer):
+                self._buffer = np.zeros(count, dtype=RECORD_DTYPE)
+        start = self._count
+        self._count += count
+        if self._since is None:
+            self._since = time.monotonic()
+        return self._buffer[start : self._count]
+
+    def _flushIfDue(self):
+        if self._since is not None and time.monotonic() - self._since >= self.flush_interval:
+            self.flush()
+
+    # append (N, 7) poses taken at monotonic times, with the scores of scoring.scorePoses and
+    # the perf_counter_ns clock times (-1 for unknown) if available
+    def addPoses(
+        self, times, poses, phase, scores=None, sample_ns=-1, ingest_ns=-1, applied_ns=-1
+    ):
+        poses = np.atleast_2d(np.asarray(poses, dtype=np.float64))
+        records = self._reserve(len(poses))
+        records["kind"] = POSE
+        records["phase"] = phase
+        records["time"] = times
+        records["position"] = poses[:, 0:3]
+        records["quaternion"] = poses[:, 3:7]
+        if scores is None:
+            records["index"] = -1
+            records["position_precision"] = np.nan
+            records["angle_precision"] = np.nan
+            for field in PROGRESS_FIELDS:
+                records[field] = np.nan
+        else:
+            records["index"] = scores.index
+            records["position_precision"] = scores.position_precision
+            records["angle_precision"] = scores.angle_precision
+            for field in PROGRESS_FIELDS:
+                records[field] = getattr(scores, field)
+        records["sample_ns"] = sample_ns
+        records["ingest_ns"] = ingest_ns
+        records["applied_ns"] = applied_ns
+        self._flushIfDue()
+
+    # append a phase change (spacebar press) at monotonic time t
+    def addEvent(self, t, phase, kind=EVENT, index=-1):
+        record = self._reserve(1)
+        record["kind"] = kind
+        record["phase"] = phase
+        record["index"] = index
+        record["time"] = t
+        record["position"] = np.nan
+        record["quaternion"] = np.nan
+        record["position_precision"] = np.nan
+        record["angle_precision"] = np.nan
+        record["sample_ns"] = -1
+        record["ingest_ns"] = -1
+        record["applied_ns"] = -1
+        for field in PROGRESS_FIELDS:
+            record[field] = np.nan
+        self._flushIfDue()
+
+    # write the buffered records as one chunk
+    def flush(self):
+        if self._count:
+            self.output.write(_chunk(RECORDS_CHUNK, self._buffer[: self._count].tobytes()))
+        self._count = 0
+        self._since = None
+
+    def close(self):
+        self.flush()
+
+
+class LoggedSession:
+    """One session of a SessionLog: its header and its record chunks (views of the memory map).
+
+    `plans` holds the plans of the session by number: 0 for the plan of the
+    header, then one per plan chunk. `plan` is the number of the plan current
+    at the first record (for logs read from the middle of a session).
+    """
+
+    def __init__(self, header, dtype, plan=None):
+        self.header = header
+        self.dtype = dtype
+        self.chunks = []
+        self._records = None
+        self.plans = {
+            0: {"number": 0, "plan_hash": header.get("plan_hash"), "time": header["start_time"]}
+        }
+        if header.get("plan") is not None:
+            self.plans[0]["plan"] = header["plan"]
+        self.first_plan = 0
+        if plan is not None:
+            self.plans[plan["number"]] = plan
+            self.first_plan = plan["number"]
+
+    @property
+    def start_time(self):
+        return self.header["start_time"]
+
+    @property
+    def registration(self):
+        return np.array(self.header["registration"])
+
+    # all records of the session, a copy unless they are in a single chunk
+    @property
+    def records(self):
+        if self._records is None:
+            if len(self.chunks) == 1:
+                self._records = self.chunks[0]
+            else:
+                self._records = np.concatenate(self.chunks) if self.chunks else np.zeros(0, self.dtype)
+        return self._records
+
+    @property
+    def poses(self):
+        records = self.records
+        return records[records["kind"] == POSE]
+
+    @property
+    def events(self):
+        records = self.records
+        return records[records["kind"] == EVENT]
+
+    # (N, 8) array of `t x y z qw qx qy qz` rows, t in seconds since the session started
+    def poseTable(self):
+        poses = self.poses
+        return np.column_stack(
+            [poses["time"] - self.start_time, poses["position"], poses["quaternion"]]
+        )
+
+    # spacebar press times in seconds since the session started
+    def eventTimes(self):
+        return self.events["time"] - self.start_time
+
+    # number of the plan (see plans) current at each record
+    def recordPlans(self):
+        records = self.records
+        changes = np.where(records["kind"] == PLAN_CHANGE, records["index"], self.first_plan)
+        return np.maximum.accumulate(changes) if len(changes) else changes
+
+
+# kind and length of the chunk at offset of data, position is its byte offset in the file
+def _chunkHeader(data, offset, path, position=None):
+    chunk = data[offset : offset + CHUNK_HEADER_DTYPE.itemsize].view(CHUNK_HEADER_DTYPE)[0]
+    if chunk["magic"] != CHUNK_MAGIC:
+        position = offset if position is None else position
+        raise ValueError(f"{path}: no chunk at byte {position}, not a session log?")
+    return int(chunk["kind"]), int(chunk["length"])
+
+
+def _parseHeader(payload):
+    return json.loads(bytes(payload).rstrip(b"\0"))
+
+
+# header of the first session of a log file, without reading the rest of it
+def readHeader(path):
+    with open(path, "rb") as file:
+        data = np.frombuffer(file.read(CHUNK_HEADER_DTYPE.itemsize), dtype=np.uint8)
+        kind, length = _chunkHeader(data, 0, path)
+        if kind != HEADER_CHUNK:
+            raise ValueError(f"{path}: does not start with a session header")
+        return _parseHeader(file.read(length))
+
+
+# header of the session at byte offset of a log file and its last plan chunk before it (None
+# if the plan was not switched). Only the header and plan chunks are read
+def readSessionState(path, offset):
+    header = plan = None
+    with open(path, "rb") as file:
+        position = 0
+        while position < offset or header is None:
+            data = np.frombuffer(file.read(CHUNK_HEADER_DTYPE.itemsize), dtype=np.uint8)
+            if len(data) < CHUNK_HEADER_DTYPE.itemsize:
+                break
+            kind, length = _chunkHeader(data, 0, path, position)
+            if kind == HEADER_CHUNK:
+                session = _parseHeader(file.read(length))
+                if session != header:
+                    header, plan = session, None
+            elif kind == PLAN_CHUNK:
+                plan = _parseHeader(file.read(length))
+            else:
+                file.seek(length, os.SEEK_CUR)
+            position += CHUNK_HEADER_DTYPE.itemsize + length
+    if header is None:
+        raise ValueError(f"{path}: does not start with a session header")
+    return header, plan
+
+
+class SessionLog:
+    """Reader of a binary session log, memory-mapped from `path` or parsed from a `data` buffer.
+
+    `header` describes the records of a buffer that starts in the middle of a
+    session (before its first header chunk), `plan` is the last plan chunk of
+    that session before the buffer (see readSessionState).
+    """
+
+    def __init__(self, path=None, data=None, header=None, plan=None):
+        self.path = path
+        if data is None:
+            size = os.path.getsize(path)
+            data = np.memmap(path, dtype=np.uint8, mode="r") if size else np.zeros(0, np.uint8)
+        self.data = data
+        self.sessions = []
+        if header is not None:
+            self._addSession(header, plan)
+        self.truncated = False
+        self._parse()
+
+    def _addSession(self, header, plan=None):
+        dtype = np.dtype([tuple(field) for field in header["record_dtype"]])
+        self.sessions.append(LoggedSession(header, dtype, plan))
+
+    def _parse(self):
+        offset = 0
+        size = len(self.data)
+        header_size = CHUNK_HEADER_DTYPE.itemsize
+        while offset + header_size <= size:
+            kind, length = _chunkHeader(self.data, offset, self.path)
+            start = offset + header_size
+            end = start + length
+            if end > size:  # interrupted write
+                self.truncated = True
+                break
+            payload = self.data[start:end]
+            if kind == HEADER_CHUNK:
+                header = _parseHeader(payload)
+                # segments repeat the header of their session
+                if not self.sessions or self.sessions[-1].header != header:
+                    self._addSession(header)
+            elif kind == PLAN_CHUNK:
+                if not self.sessions:
+                    raise ValueError(f"{self.path}: plan switch before the first session header")
+                # segments repeat the last plan chunk of their session
+                plan = _parseHeader(payload)
+                self.sessions[-1].plans.setdefault(plan["number"], plan)
+            elif kind == RECORDS_CHUNK:
+                if not self.sessions:
+                    raise ValueError(f"{self.path}: records before the first session header")
+                session = self.sessions[-1]
+                count = len(payload) // session.dtype.itemsize
+                session.chunks.append(payload[: count * session.dtype.itemsize].view(session.dtype))
+            offset = end
+        if offset != size:
+            self.truncated = True
+
+    def __len__(self):
+        return len(self.sessions)
+
+    # write the sessions in the text layout of needle-timestamps.txt and timestamps.txt
+    def exportText(self, poses_path, markers_path=None):
+        with open(poses_path, "w") as file:
+            for session in self.sessions:
+                file.write("\n")
+                for row in session.poseTable():
+                    file.write(" ".join(str(value) for value in row.tolist()) + "\n")
+        if markers_path is not None:
+            with open(markers_path, "w") as file:
+                for session in self.sessions:
+                    file.write("\n")
+                    for t in session.eventTimes().tolist():
+                        file.write(f"{t}\n")
+
+    def describe(self):
+        lines = []
+        for number, session in enumerate(self.sessions, 1):
+            poses = session.poses
+            line = (
+                f"Session {number}: {len(poses)} poses, {len(session.events)} events, "
+                f"plan {session.header.get('plan_hash') or '-'}"
+            )
+            if len(session.plans) > 1:
+                line += f" ({len(session.plans) - 1} plan switches)"
+            if len(poses):
+                duration = poses["time"][-1] - session.start_time
+                line += (
+                    f", {duration:.1f} s, precision position "
+                    f"{100 * np.nanmean(poses['position_precision']):.0f}% "
+                    f"angle {100 * np.nanmean(poses['angle_precision']):.0f}%"
+                )
+            lines.append(line)
+        if self.truncated:
+            lines.append("Last chunk incomplete (interrupted write), ignored")
+        return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+    info = commands.add_parser("info", help="list the sessions of a log")
+    info.add_argument("log", nargs="+", help="log file, or the segments of a log in order")
+    export = commands.add_parser("export", help="convert a log to the text layout")
+    export.add_argument("log", nargs="+", help="log file, or the segments of a log in order")
+    export.add_argument("--poses", default="needle-timestamps.txt", help="pose output file")
+    export.add_argument("--markers", default="timestamps.txt", help="spacebar press output file")
+    args = parser.parse_args()
+
+    if len(args.log) == 1:
+        log = SessionLog(args.log[0])
+    else:
+        log = SessionLog(data=np.concatenate([np.fromfile(path, dtype=np.uint8) for path in args.log]))
+    if args.command == "info":
+        print(log.describe())
+    else:
+        log.exportText(args.poses, args.markers)
+        print(f"{len(log)} sessions written to {args.poses} and {args.markers}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Session folders for the study logs.
+
+Every session (from the first spacebar press until the environment is cleared)
+gets its own folder in the sessions folder, named after the participant and
+the start time. Each log of the session is split into numbered segments of at
+most `segment_bytes` (needle-timestamps-0001.txt, needle-timestamps-0002.txt,
+...), so no file grows without bound, and session.json indexes the session:
+its segments and, per trial (spacebar press), the segment and byte offset
+every log was at when the trial started and stopped. A trial can be read
+without scanning the rest of the session:
+
+    poses = loadTrial("NeedleSessions/p01-20240501-101500", 3)
+"""
+
+import json
+import os
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.sessionlog import SessionLog, readSessionState
+
+INDEX_FILE = "session.json"
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+
+class SegmentedLog:
+    """Log written as numbered segment files of at most `max_bytes` each.
+
+    Data is passed to an AsyncLogWriter as bytes, so the byte offsets kept for
+    the index are exact on every platform. `preamble` (the header of a binary
+    log) is repeated at the start of every new segment, so each segment can be
+    read on its own.
+    """
+
+    def __init__(self, directory, name, extension, writer, max_bytes, on_rotate=None):
+        self.directory = directory
+        self.name = name
+        self.extension = extension
+        self.writer = writer
+        self.max_bytes = max_bytes
+        self.on_rotate = on_rotate
+        self.segments = []
+        self.size = 0  # bytes in the current segment
+        self.preamble = b""
+
+    @property
+    def path(self):
+        return os.path.join(self.directory, self.segments[-1])
+
+    def _rotate(self):
+        self.segments.append(f"{self.name}-{len(self.segments) + 1:04d}{self.extension}")
+        self.size = 0
+        if self.preamble:
+            self.writer.write(self.path, self.preamble)
+            self.size = len(self.preamble)
+        if self.on_rotate is not None:
+            self.on_rotate()
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode()
+        if not data:
+            return
+        if not self.segments or (
+            self.size + len(data) > self.max_bytes and self.size > len(self.preamble)
+        ):
+            self._rotate()
+        self.writer.write(self.path, data)
+        self.size += len(data)
+
+    # segment and byte offset the next write goes to
+    def position(self):
+        if not self.segments:
+            self._rotate()
+        return {"segment": self.segments[-1], "offset": self.size}
+
+
+class SessionManager:
+    """Creates a folder per session in `root` and keeps its index of logs and trials."""
+
+    def __init__(self, root, writer, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.root = root
+        self.writer = writer
+        self.segment_bytes = segment_bytes
+        self.directory = None
+        self.index = None
+        self.logs = {}
+
+    @property
+    def active(self):
+        return self.directory is not None
+
+    def startSession(self, participant="", **metadata):
+        if self.active:
+            self.close()
+        name = f"{participant or 'session'}-{time.strftime('%Y%m%d-%H%M%S')}"
+        directory = os.path.join(self.root, name)
+        number = 1
+        while os.path.exists(directory):
+            number += 1
+            directory = os.path.join(self.root, f"{name}-{number}")
+        os.makedirs(directory)
+
+        self.directory = directory
+        self.logs = {}
+        self.index = {
+            "participant": participant,
+            "started": time.time(),
+            "stopped": None,
+            "metadata": metadata,
+            "logs": {},
+            "trials": [],
+        }
+        self._saveIndex()
+        print(f"Logging session to {directory}")
+        return directory
+
+    # log of the session by name (file names without extension), created on first use
+    def log(self, name, extension=".txt"):
+        if name not in self.logs:
+            log = SegmentedLog(
+                self.directory, name, extension, self.writer, self.segment_bytes, self._saveIndex
+            )
+            self.logs[name] = log
+            self.index["logs"][name] = log.segments
+        return self.logs[name]
+
+    def _positions(self):
+        return {name: log.position() for name, log in self.logs.items()}
+
+    # end the current trial (if any) and start the next one where the logs are now
+    def startTrial(self, phase=None):
+        self.stopTrial(save=False)
+        self.index["trials"].append(
+            {
+                "trial": len(self.index["trials"]) + 1,
+                "phase": phase,
+                "start_time": time.time(),
+                "start": self._positions(),
+                "stop_time": None,
+                "stop": None,
+            }
+        )
+        self._saveIndex()
+
+    def stopTrial(self, save=True):
+        if self.index["trials"] and self.index["trials"][-1]["stop"] is None:
+            trial = self.index["trials"][-1]
+            trial["stop_time"] = time.time()
+            trial["stop"] = self._positions()
+            if save:
+                self._saveIndex()
+
+    def close(self):
+        if not self.active:
+            return
+        self.stopTrial(save=False)
+        self.index["stopped"] = time.time()
+        self._saveIndex()
+        self.directory = None
+        self.index = None
+        self.logs = {}
+
+    def _saveIndex(self):
+        path = os.path.join(self.directory, INDEX_FILE)
+        with open(path + ".tmp", "w") as file:
+            json.dump(self.index, file, indent=1)
+        os.replace(path + ".tmp", path)
+
+
+def readSessionIndex(directory):
+    with open(os.path.join(directory, INDEX_FILE)) as file:
+        return json.load(file)
+
+
+def isSessionDirectory(directory):
+    return os.path.isfile(os.path.join(directory, INDEX_FILE))
+
+
+# raw bytes of one log between two index positions (None: start or end of the log)
+def readLogRange(directory, segments, start=None, stop=None):
+    if not segments:
+        return b""
+    start = start or {"segment": segments[0], "offset": 0}
+    first = segments.index(start["segment"])
+    last = segments.index(stop["segment"]) if stop else len(segments) - 1
+    parts = []
+    for number in range(first, last + 1):
+        path = os.path.join(directory, segments[number])
+        if not os.path.isfile(path):
+            continue
+        with open(path, "rb") as file:
+            offset = start["offset"] if number == first else 0
+            file.seek(offset)
+            if stop and number == last:
+                parts.append(file.read(max(stop["offset"] - offset, 0)))
+            else:
+                parts.append(file.read())
+    return b"".join(parts)
+
+
+def _trialRange(directory, trial, name, index):
+    index = index or readSessionIndex(directory)
+    segments = index["logs"].get(name)
+    if segments is None:
+        raise KeyError(f"No {name} log in {directory}")
+    entry = index["trials"][trial - 1]
+    start = entry["start"].get(name)
+    stop = (entry["stop"] or {}).get(name)
+    return segments, start, readLogRange(directory, segments, start, stop)
+
+
+# binary session log (sessionlog.SessionLog) of one trial (numbered from 1) of a session folder,
+# with the plan the trial started with
+def loadTrialLog(directory, trial, name="needle-session", index=None):
+    return _trialLog(directory, *_trialRange(directory, trial, name, index))
+
+
+def _trialLog(directory, segments, start, data):
+    # the session state where the trial starts describes its records
+    start = start or {"segment": segments[0], "offset": 0}
+    header, plan = readSessionState(os.path.join(directory, start["segment"]), start["offset"])
+    return SessionLog(data=np.frombuffer(data, dtype=np.uint8), header=header, plan=plan)
+
+
+# data of one trial (numbered from 1) of a session folder: an (N, columns) array for text
+# logs, the records for binary session logs
+def loadTrial(directory, trial, name="needle-timestamps", index=None):
+    segments, start, data = _trialRange(directory, trial, name, index)
+    if segments[0].endswith(".txt"):
+        lines = data.decode().splitlines()
+        return np.loadtxt(lines, dtype=np.float64, ndmin=2) if any(lines) else np.empty((0, 0))
+    log = _trialLog(directory, segments, start, data)
+    return np.concatenate([session.records for session in log.sessions])
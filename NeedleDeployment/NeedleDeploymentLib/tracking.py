@@ -0,0 +1,483 @@
+import logging
+import os
+import select
+import socket
+import struct
+import threading
+import time
+
+import numpy as np
+
+from NeedleDeploymentLib.poses import PoseSample
+from NeedleDeploymentLib.ringbuffer import PoseRingBuffer
+
+# number of values per tracker line: position (x, y, z) + quaternion (qw, qx, qy, qz)
+POSE_FIELDS = 7
+
+# binary pose packet used by the socket backends: 7 little-endian doubles
+POSE_PACKET = struct.Struct("<%dd" % POSE_FIELDS)
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 5005
+
+
+# parse one tracker line into a pose array, returns None for malformed lines
+def parsePoseLine(line, num_fields=POSE_FIELDS):
+    fields = line.split()
+    if len(fields) != num_fields:
+        return None
+    try:
+        return np.array([float(f) for f in fields])
+    except ValueError:
+        return None
+
+
+# last `count` complete lines of a file, oldest first, without line endings. The file is read
+# backwards from the end in blocks of block_size bytes, so the cost does not depend on its
+# size. A final line without a newline is still being written and is left out.
+def readLastLines(path, count=1, block_size=4096):
+    if count <= 0:
+        return []
+    with open(path, "rb") as file:
+        file.seek(0, os.SEEK_END)
+        position = file.tell()
+        data = b""
+        lines = []
+        while position > 0:
+            step = min(block_size, position)
+            position -= step
+            file.seek(position)
+            data = file.read(step) + data
+            if data.count(b"\n") <= count:  # cannot hold enough complete lines yet
+                continue
+            lines = _completeLines(data, position > 0)
+            if len(lines) >= count:
+                break
+        else:
+            lines = _completeLines(data, False)
+    return lines[-count:]
+
+
+# non-blank lines in a chunk read from the end of a file; the first one is incomplete
+# unless the chunk starts at the beginning of the file, the last one unless it ends with a newline
+def _completeLines(data, cut_first):
+    lines = data.split(b"\n")
+    lines.pop()
+    if cut_first:
+        lines = lines[1:]
+    return [line.rstrip(b"\r") for line in lines if line.strip()]
+
+
+# newest valid pose in a tracker file, None if the file has none among its last lines
+def readLastPose(path, num_fields=POSE_FIELDS, search_lines=8):
+    for line in reversed(readLastLines(path, search_lines)):
+        pose = parsePoseLine(line, num_fields)
+        if pose is not None:
+            return pose
+    return None
+
+
+# valid poses among the last `count` lines of a tracker file as an (N, num_fields) array
+def readLastPoses(path, count, num_fields=POSE_FIELDS):
+    poses = [parsePoseLine(line, num_fields) for line in readLastLines(path, count)]
+    poses = [pose for pose in poses if pose is not None]
+    if not poses:
+        return np.empty((0, num_fields))
+    return np.array(poses)
+
+
+class TrackerFileTail:
+    """Incrementally reads poses appended to a tracker text file.
+
+    The reader remembers the byte offset of the last complete line it has seen,
+    so every poll only reads and parses what was written since the previous one.
+    With `from_end` the lines already in the file when it is first read are
+    skipped, so the tail starts with the tracker's live poses instead of the
+    backlog of an earlier run. Truncation (file shorter than the offset, or
+    rewritten in place) and rotation (file replaced by a new inode) restart
+    reading at the beginning of the file.
+    """
+
+    def __init__(self, path, num_fields=POSE_FIELDS, from_end=True):
+        self.path = path
+        self.num_fields = num_fields
+        self._skip_existing = from_end
+        self._file = None
+        self._file_id = None
+        self._offset = 0
+        self._mtime = None
+        self._last_byte = b""
+        self._partial = b""
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._file_id = None
+        self._offset = 0
+        self._mtime = None
+        self._last_byte = b""
+        self._partial = b""
+
+    def _reopen(self, stat):
+        self.close()
+        self._file = open(self.path, "rb")
+        self._file_id = (stat.st_dev, stat.st_ino)
+        self._mtime = stat.st_mtime_ns
+
+    # continue after the complete lines already in the file, a final line that is still being
+    # written is kept to be completed
+    def _skipExisting(self, stat, block_size=4096):
+        position = stat.st_size
+        tail = b""
+        while position > 0 and b"\n" not in tail:
+            step = min(block_size, position)
+            position -= step
+            self._file.seek(position)
+            tail = self._file.read(step) + tail
+        self._offset = position + len(tail)
+        self._last_byte = tail[-1:]
+        self._partial = tail[tail.rfind(b"\n") + 1 :]
+
+    # true if the bytes already consumed are no longer the start of the file
+    def _wasRewritten(self, stat):
+        if stat.st_size < self._offset:
+            return True
+        if stat.st_size == self._offset:
+            return stat.st_mtime_ns != self._mtime
+        if self._offset > 0:
+            self._file.seek(self._offset - 1)
+            return self._file.read(1) != self._last_byte
+        return False
+
+    # complete lines appended since the previous call, as bytes without line endings
+    def readLines(self):
+        # only a file that exists when reading starts has a backlog
+        skip_existing, self._skip_existing = self._skip_existing, False
+        try:
+            stat = os.stat(self.path)
+            if self._file is None or self._file_id != (stat.st_dev, stat.st_ino):
+                self._reopen(stat)
+                if skip_existing:
+                    self._skipExisting(stat)
+            elif self._wasRewritten(stat):
+                self._reopen(stat)
+        except OSError:
+            self.close()
+            return []
+
+        if stat.st_size == self._offset:
+            return []
+
+        self._file.seek(self._offset)
+        chunk = self._file.read(stat.st_size - self._offset)
+        if not chunk:
+            return []
+        self._offset += len(chunk)
+        self._mtime = stat.st_mtime_ns
+        self._last_byte = chunk[-1:]
+
+        lines = (self._partial + chunk).split(b"\n")
+        # last element is an incomplete line (or empty if chunk ended with a newline)
+        self._partial = lines.pop()
+        return [line.rstrip(b"\r") for line in lines]
+
+    # newest valid pose written since the previous call, None if there is none
+    def poll(self):
+        for line in reversed(self.readLines()):
+            pose = parsePoseLine(line, self.num_fields)
+            if pose is not None:
+                return pose
+        return None
+
+    # all valid poses written since the previous call, stamped with the read time
+    def readSamples(self):
+        lines = self.readLines()
+        timestamp = time.time()
+        ingest_ns = time.perf_counter_ns()
+        samples = []
+        for line in lines:
+            pose = parsePoseLine(line, self.num_fields)
+            if pose is not None:
+                samples.append(PoseSample(timestamp, pose, ingest_ns, ingest_ns))
+        return samples
+
+
+def packPose(pose):
+    return POSE_PACKET.pack(*[float(v) for v in pose[:POSE_FIELDS]])
+
+
+def unpackPose(packet):
+    return np.array(POSE_PACKET.unpack(packet))
+
+
+class SocketPoseSource:
+    """Receives binary pose packets on a localhost socket.
+
+    Each packet is POSE_PACKET (pos + quat, the layout expected by updateNeedle).
+    With "udp" every datagram carries one packet; with "tcp" the source listens for
+    a single tracker connection and reads a continuous stream of packets. The socket
+    is non-blocking, so poll() can be called from the GUI timer and drains whatever
+    has arrived since the previous call.
+    """
+
+    def __init__(self, protocol="udp", host=DEFAULT_HOST, port=DEFAULT_PORT):
+        if protocol not in ("udp", "tcp"):
+            raise ValueError(f"Unknown pose socket protocol: {protocol}")
+        self.protocol = protocol
+        self.host = host
+        self.port = port
+        self._client = None
+        self._buffer = b""
+
+        if protocol == "udp":
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        if protocol == "tcp":
+            self._socket.listen(1)
+        self._socket.setblocking(False)
+
+    def close(self):
+        if self._client is not None:
+            self._client.close()
+            self._client = None
+        if self._socket is not None:
+            self._socket.close()
+            self._socket = None
+        self._buffer = b""
+
+    def _readUdp(self):
+        packets = []
+        while True:
+            try:
+                data = self._socket.recv(65536)
+            except OSError:  # no more datagrams queued
+                break
+            if len(data) == POSE_PACKET.size:
+                packets.append(data)
+        return packets
+
+    def _readTcp(self):
+        if self._client is None:
+            try:
+                self._client, _ = self._socket.accept()
+            except (BlockingIOError, InterruptedError):
+                return []
+            self._client.setblocking(False)
+            self._buffer = b""
+
+        while True:
+            try:
+                data = self._client.recv(65536)
+            except (BlockingIOError, InterruptedError):
+                break
+            except OSError:
+                data = b""
+            if not data:  # tracker disconnected, wait for the next connection
+                self._client.close()
+                self._client = None
+                break
+            self._buffer += data
+
+        size = POSE_PACKET.size
+        count = len(self._buffer) // size
+        packets = [self._buffer[i * size : (i + 1) * size] for i in range(count)]
+        self._buffer = self._buffer[count * size :]
+        return packets
+
+    # descriptor that becomes readable when a packet (or a tcp connection) arrives
+    def fileno(self):
+        if self._client is not None:
+            return self._client.fileno()
+        return self._socket.fileno()
+
+    # raw packets received since the previous call
+    def readPackets(self):
+        if self._socket is None:
+            return []
+        if self.protocol == "udp":
+            return self._readUdp()
+        return self._readTcp()
+
+    # newest pose received since the previous call, None if there is none
+    def poll(self):
+        for packet in reversed(self.readPackets()):
+            pose = unpackPose(packet)
+            if np.all(np.isfinite(pose)):
+                return pose
+        return None
+
+    # all valid poses received since the previous call, stamped with the receive time
+    def readSamples(self):
+        packets = self.readPackets()
+        timestamp = time.time()
+        ingest_ns = time.perf_counter_ns()
+        samples = []
+        for packet in packets:
+            pose = unpackPose(packet)
+            if np.all(np.isfinite(pose)):
+                samples.append(PoseSample(timestamp, pose, ingest_ns, ingest_ns))
+        return samples
+
+
+# create a live pose source: "file" tails a tracker text file, "ring" reads a
+# memory-mapped pose ring buffer file, "udp"/"tcp" listen on localhost
+def createPoseSource(kind, path=None, host=DEFAULT_HOST, port=DEFAULT_PORT):
+    if kind == "file":
+        return TrackerFileTail(path)
+    if kind == "ring":
+        return PoseRingBuffer(path)
+    if kind in ("udp", "tcp"):
+        return SocketPoseSource(kind, host, port)
+    raise ValueError(f"Unknown pose source: {kind}")
+
+
+class LatestPoseSlot:
+    """Thread-safe pose mailbox between the ingest thread and the GUI.
+
+    This is also the coalescing stage: when the tracker delivers several samples
+    between two GUI refreshes, take() hands out only the newest pose for
+    rendering, while takeSamples() hands out all of them (oldest first) so the
+    intermediate ones can still be archived. The counters record how many
+    samples were merged into each rendered frame.
+
+    For event-driven refresh, notifier() returns a socket descriptor that becomes
+    readable whenever samples are published, to be watched by a Qt socket notifier.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = []
+        self._notify_read = None
+        self._notify_write = None
+        self.resetCounters()
+
+    def resetCounters(self):
+        self.frames = 0
+        self.samples = 0
+        self.last_merged = 0
+        self.max_merged = 0
+
+    def notifier(self):
+        if self._notify_read is None:
+            self._notify_read, self._notify_write = socket.socketpair()
+            self._notify_read.setblocking(False)
+            self._notify_write.setblocking(False)
+        return self._notify_read.fileno()
+
+    def closeNotifier(self):
+        if self._notify_read is not None:
+            self._notify_read.close()
+            self._notify_write.close()
+        self._notify_read = None
+        self._notify_write = None
+
+    def publish(self, samples):
+        if not samples:
+            return
+        with self._lock:
+            self._pending.extend(samples)
+            notify = self._notify_write
+        if notify is not None:
+            try:
+                notify.send(b"\0")
+            except OSError:  # buffer full, the reader is already signalled
+                pass
+
+    # all samples published since the previous take, oldest first
+    def takeSamples(self):
+        if self._notify_read is not None:
+            try:
+                while self._notify_read.recv(4096):
+                    pass
+            except OSError:
+                pass
+        with self._lock:
+            samples = self._pending
+            self._pending = []
+        if samples:
+            self.frames += 1
+            self.samples += len(samples)
+            self.last_merged = len(samples)
+            self.max_merged = max(self.max_merged, len(samples))
+        return samples
+
+    # newest pose published since the previous take, None if there is none
+    def take(self):
+        samples = self.takeSamples()
+        if not samples:
+            return None
+        return samples[-1].pose
+
+    def clear(self):
+        with self._lock:
+            self._pending = []
+
+    def summary(self):
+        mean = self.samples / self.frames if self.frames else 0.0
+        return (
+            f"{self.samples} samples in {self.frames} frames "
+            f"({mean:.2f} merged per frame on average, max {self.max_merged})"
+        )
+
+
+class PoseIngestThread(threading.Thread):
+    """Polls a pose source off the GUI thread and publishes into a LatestPoseSlot.
+
+    File reads, socket reads and parsing all happen here, so a slow disk never
+    blocks rendering. Sources with a fileno() (sockets) are waited on with
+    select(). Otherwise the thread polls adaptively: the wait starts at `interval`
+    seconds and doubles up to `max_interval` while no data arrives, and wake()
+    (e.g. from a file-change notification) cuts it short. The source is owned by
+    the caller and is not closed when the thread stops.
+    """
+
+    def __init__(self, source, slot, interval=0.002, max_interval=0.05):
+        threading.Thread.__init__(self, name="PoseIngestThread", daemon=True)
+        self.source = source
+        self.slot = slot
+        self.interval = interval
+        self.max_interval = max_interval
+        self.samples = 0
+        self._stop_event = threading.Event()
+        self._wake_event = threading.Event()
+
+    def _waitForData(self, timeout):
+        if hasattr(self.source, "fileno"):
+            try:
+                select.select([self.source.fileno()], [], [], timeout)
+                return
+            except (OSError, ValueError):  # source closed or not selectable
+                pass
+        self._wake_event.wait(timeout)
+        self._wake_event.clear()
+
+    def run(self):
+        wait = self.interval
+        while not self._stop_event.is_set():
+            try:
+                samples = self.source.readSamples()
+            except Exception:
+                logging.exception("Pose ingestion failed")
+                samples = []
+
+            if samples:
+                self.samples += len(samples)
+                self.slot.publish(samples)
+                wait = self.interval
+                continue
+
+            self._waitForData(wait)
+            wait = min(wait * 2, self.max_interval)
+
+    def wake(self):
+        self._wake_event.set()
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        self._wake_event.set()
+        if self.is_alive():
+            self.join(timeout)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# NeedleDeploymentLib is imported from the module folder, as Slicer does
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
@@ -0,0 +1,137 @@
+import os
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib import batchscore
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.logwriter import AsyncLogWriter
+from NeedleDeploymentLib.scoring import NeedlePlan
+from NeedleDeploymentLib.sessionlog import SessionLog, SessionLogWriter
+from NeedleDeploymentLib.sessions import SessionManager, loadTrialLog
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+@pytest.fixture
+def plans(tmp_path, monkeypatch):
+    with open(os.path.join(DATA, "needle_deployment.txt")) as file:
+        header = file.readline().rstrip("\n")
+    data = loadData(os.path.join(DATA, "needle_deployment.txt"), 1)
+    shifted = data.copy()
+    shifted[:, 7:10] += 5.0
+    paths = []
+    for name, plan in [("needle_deployment.txt", data), ("needle_deployment_b.txt", shifted)]:
+        paths.append(str(tmp_path / name))
+        np.savetxt(paths[-1], plan, fmt="%.6f", header=header, comments="")
+    monkeypatch.setattr(batchscore, "_plans", {})
+    monkeypatch.setattr(batchscore, "_plan_names", {})
+    monkeypatch.setattr(batchscore, "_plan", None)
+    batchscore._initWorker(batchscore.findPlans([str(tmp_path)]), None)
+    return [NeedlePlan.fromFile(path) for path in paths]
+
+
+def _planPoses(plan, count=10):
+    return np.column_stack([plan.positions[:count], plan.quaternions[:count]])
+
+
+# trial 1 on plan a, trial 2 on plan b, trial 3 switches back to a halfway
+def _writeSession(writer, a, b):
+    writer.startSession(plan_hash=a.content_hash, plan="needle_deployment")
+    t = writer.start_time + 0.01 * np.arange(10)
+    writer.addPoses(t, _planPoses(a), 1)
+    writer.addEvent(t[-1] + 0.005, 1)
+    writer.changePlan(b.content_hash, 1, plan="needle_deployment_b")
+    writer.addPoses(t + 0.1, _planPoses(b), 2)
+    writer.addEvent(t[-1] + 0.105, 2)
+    writer.addPoses(t[:5] + 0.2, _planPoses(b, 5), 3)
+    writer.changePlan(a.content_hash, 3, plan="needle_deployment")
+    writer.addPoses(t[5:] + 0.2, _planPoses(a)[5:], 3)
+    writer.close()
+
+
+def test_binary_log_scored_against_logged_plans(tmp_path, plans):
+    a, b = plans
+    path = str(tmp_path / "session.ndlog")
+    with open(path, "wb") as file:
+        _writeSession(SessionLogWriter(file), a, b)
+
+    log = SessionLog(path)
+    assert len(log) == 1
+    session = log.sessions[0]
+    assert [plan["plan_hash"] for plan in session.plans.values()] == [
+        a.content_hash,
+        b.content_hash,
+        a.content_hash,
+    ]
+
+    rows = batchscore.scoreFile(path)
+    assert [(row["trial"], row["plan"]) for row in rows] == [
+        (1, "needle_deployment"),
+        (2, "needle_deployment_b"),
+    ]
+    for row in rows:
+        assert row["frames"] == 10
+        assert row["final_distance"] == pytest.approx(0.0, abs=1e-5)
+
+
+def test_unknown_plan_skipped(tmp_path, plans):
+    a, _ = plans
+    path = str(tmp_path / "session.ndlog")
+    with open(path, "wb") as file:
+        writer = SessionLogWriter(file)
+        writer.startSession(plan_hash="0" * 40)
+        writer.addPoses(writer.start_time + np.arange(3), _planPoses(a, 3), 1)
+        writer.close()
+    assert batchscore.scoreFile(path) == []
+
+
+def test_session_folder_trials_keep_their_plan(tmp_path, plans):
+    a, b = plans
+    log_writer = AsyncLogWriter()
+    manager = SessionManager(str(tmp_path / "sessions"), log_writer, segment_bytes=4096)
+    directory = manager.startSession("p01")
+    writer = SessionLogWriter(manager.log("needle-session", ".ndlog"), chunk_records=4)
+    writer.startSession(plan_hash=a.content_hash)
+    t = writer.start_time + 0.01 * np.arange(10)
+    manager.startTrial(1)
+    writer.addPoses(t, _planPoses(a), 1)
+    writer.flush()
+    writer.changePlan(b.content_hash, 1)
+    writer.flush()
+    manager.startTrial(2)
+    for repeat in range(4):  # several segments, each starting with the header and plan chunk
+        writer.addPoses(t + 0.1 * (repeat + 1), _planPoses(b), 2)
+    writer.close()
+    manager.close()
+    log_writer.close()
+
+    index = batchscore.readSessionIndex(directory)
+    assert len(index["logs"]["needle-session"]) > 1
+    last = loadTrialLog(directory, 2, index=index).sessions[0]
+    assert last.first_plan == 1
+    assert set(last.recordPlans().tolist()) == {1}
+
+    rows = batchscore.scoreFile(directory)
+    assert [(row["trial"], row["plan"], row["frames"]) for row in rows] == [
+        (1, "needle_deployment", 10),
+        (2, "needle_deployment_b", 40),
+    ]
+
+
+def test_recording_with_timestamps(tmp_path, plans):
+    a, _ = plans
+    poses = _planPoses(a)
+    times = 0.02 * np.arange(len(poses))
+    plain = tmp_path / "recording-plain.txt"
+    timed = tmp_path / "recording-timed.txt"
+    np.savetxt(plain, poses, fmt="%.6f")
+    np.savetxt(timed, np.column_stack([times, poses]), fmt="%.6f")
+
+    expected = batchscore.scoreFile(str(plain), rate=50.0)[0]
+    row = batchscore.scoreFile(str(timed))[0]
+    assert row["frames"] == 10
+    assert row["duration"] == pytest.approx(times[-1])
+    assert row["final_distance"] == pytest.approx(0.0, abs=1e-5)
+    for name in ("position_precision", "angle_precision", "final_distance", "final_angle"):
+        assert row[name] == pytest.approx(expected[name])
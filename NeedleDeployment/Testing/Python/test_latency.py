@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.latency import distribution, latencyDistribution
+from NeedleDeploymentLib.sessionlog import EVENT, POSE, RECORD_DTYPE
+
+MS = 1_000_000
+
+
+def _records(count):
+    records = np.zeros(count, dtype=RECORD_DTYPE)
+    records["kind"] = POSE
+    records["sample_ns"] = records["ingest_ns"] = records["applied_ns"] = -1
+    return records
+
+
+def test_distribution_percentiles():
+    stats = distribution(np.arange(1, 101) * MS)
+    assert stats["count"] == 100
+    assert stats["mean"] == pytest.approx(50.5)
+    assert stats["p50"] == pytest.approx(50.5)
+    assert stats["p90"] == pytest.approx(90.1)
+    assert stats["p99"] == pytest.approx(99.01)
+    assert stats["max"] == pytest.approx(100.0)
+    assert distribution([]) == {"count": 0}
+
+
+def test_stages_of_fixed_clock_stamps():
+    records = _records(100)
+    start = 10_000 * MS
+    # a pose sampled every 20 ms, read 1 to 100 ms later and applied 5 ms after that
+    records["sample_ns"] = start + np.arange(100) * 20 * MS
+    records["ingest_ns"] = records["sample_ns"] + np.arange(1, 101) * MS
+    records["applied_ns"] = records["ingest_ns"] + 5 * MS
+    result = latencyDistribution(records)
+
+    tracker = result["tracker to ingest"]
+    assert tracker["count"] == 100
+    assert (tracker["p50"], tracker["p90"], tracker["max"]) == pytest.approx((50.5, 90.1, 100.0))
+    assert result["ingest to applied"]["p99"] == pytest.approx(5.0)
+    assert result["tracker to applied"]["mean"] == pytest.approx(55.5)
+    assert result["frame interval"]["count"] == 99
+    assert result["frame interval"]["p50"] == pytest.approx(21.0)
+
+
+def test_missing_stages_are_left_out():
+    records = _records(6)
+    records["kind"][5] = EVENT  # only pose records are counted
+    records["sample_ns"][5] = 0
+    records["ingest_ns"][5] = 1000 * MS
+    # unknown sample time (socket sources stamp it on receipt), only logged, or both known
+    records["ingest_ns"][:4] = np.arange(4) * 10 * MS
+    records["sample_ns"][2:4] = records["ingest_ns"][2:4] - 2 * MS
+    records["applied_ns"][[1, 3]] = records["ingest_ns"][[1, 3]] + 4 * MS
+    result = latencyDistribution(records)
+
+    assert result["tracker to ingest"]["count"] == 2
+    assert result["tracker to ingest"]["max"] == pytest.approx(2.0)
+    assert result["ingest to applied"]["count"] == 2
+    assert result["ingest to applied"]["mean"] == pytest.approx(4.0)
+    assert result["tracker to applied"]["count"] == 1
+    assert result["tracker to applied"]["mean"] == pytest.approx(6.0)
+    assert result["frame interval"]["count"] == 1
+    assert result["frame interval"]["mean"] == pytest.approx(20.0)
+
+    assert all(stats["count"] == 0 for stats in latencyDistribution(_records(3)).values())
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from NeedleDeploymentLib.logwriter import AsyncLogWriter
+
+
+def _waitFor(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            return False
+        time.sleep(0.01)
+    return True
+
+
+def _read(path):
+    return path.read_text() if path.exists() else ""
+
+
+def test_lines_written_after_flush_interval(tmp_path):
+    path = tmp_path / "needle-timestamps.txt"
+    writer = AsyncLogWriter(flush_interval=0.3, max_pending_bytes=1 << 20)
+    start = time.monotonic()
+    writer.write(str(path), "1\n")
+    writer.write(str(path), "2\n")
+    assert _read(path) == ""
+    assert _waitFor(lambda: _read(path) == "1\n2\n")
+    assert time.monotonic() - start >= 0.25
+    writer.close()
+
+
+def test_lines_written_once_enough_are_pending(tmp_path):
+    path = tmp_path / "needle-timestamps.txt"
+    writer = AsyncLogWriter(flush_interval=60.0, max_pending_bytes=100)
+    writer.write(str(path), "x" * 60 + "\n")
+    time.sleep(0.1)
+    assert _read(path) == ""
+    writer.write(str(path), "y" * 60 + "\n")
+    assert _waitFor(lambda: len(_read(path)) == 122)
+    writer.close()
+
+
+def test_flush_and_close_drain_the_queue(tmp_path):
+    text, binary = tmp_path / "timestamps.txt", tmp_path / "needle-session.ndlog"
+    writer = AsyncLogWriter(flush_interval=60.0, max_pending_bytes=1 << 20)
+    writer.write(str(text), "0\n")
+    writer.write(str(binary), b"\x00\x01")
+    assert writer.flush(timeout=2.0)
+    assert _read(text) == "0\n" and binary.read_bytes() == b"\x00\x01"
+
+    for number in range(1, 2000):
+        writer.write(str(text), f"{number}\n")
+    writer.close()
+    assert not writer.running
+    assert _read(text).split() == [str(number) for number in range(2000)]
+    with pytest.raises(ValueError):
+        writer.write(str(text), "late\n")
+
+
+def test_failing_file_does_not_stop_other_logs(tmp_path, capsys):
+    good, bad = tmp_path / "timestamps.txt", tmp_path / "mixed.txt"
+    writer = AsyncLogWriter(flush_interval=60.0)
+    writer.write(str(bad), "text\n")
+    assert writer.flush(timeout=2.0)
+    writer.write(str(bad), b"bytes")  # the file was opened for str
+    writer.write(str(good), "1\n")
+    assert writer.flush(timeout=2.0)
+    assert writer.running
+    assert writer.errors == 1 and isinstance(writer.last_error, TypeError)
+    assert "Failed to write" in capsys.readouterr().out
+    assert _read(good) == "1\n"
+    writer.close()
+
+
+def test_full_queue_drops_lines(tmp_path):
+    path = tmp_path / "needle-timestamps.txt"
+    writer = AsyncLogWriter(max_pending_bytes=1, max_queued=2, max_block=0.05)
+    release = threading.Event()
+    write_pending = writer._writePending
+    writer._writePending = lambda: (release.wait(), write_pending())
+    assert writer.write(str(path), "1\n")  # taken by the writer thread, which then blocks
+    assert _waitFor(lambda: writer._queue.empty())
+    assert writer.write(str(path), "2\n") and writer.write(str(path), "3\n")
+    start = time.monotonic()
+    assert not writer.write(str(path), "4\n")
+    assert time.monotonic() - start < 1.0
+    assert writer.dropped == 1
+    release.set()
+    writer.close(timeout=2.0)
+    assert _read(path) == "1\n2\n3\n"
+
+
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_dead_writer_thread_does_not_hang(tmp_path):
+    path = tmp_path / "needle-timestamps.txt"
+    writer = AsyncLogWriter(max_pending_bytes=1)
+
+    def fail():
+        raise RuntimeError("writer thread failure")
+
+    writer._writePending = fail
+    writer.write(str(path), "1\n")
+    assert _waitFor(lambda: not writer.running)
+
+    start = time.monotonic()
+    assert not writer.write(str(path), "2\n")
+    assert writer.dropped == 1
+    assert not writer.flush()
+    writer.close()
+    assert time.monotonic() - start < 1.0
@@ -0,0 +1,91 @@
+import os
+import shutil
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib import plancache
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.plancache import PlanCache, derivePlanArrays
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+@pytest.fixture
+def plan_path(tmp_path):
+    path = tmp_path / "needle_deployment.txt"
+    shutil.copy(os.path.join(DATA, "needle_deployment.txt"), path)
+    return str(path)
+
+
+def _save(path):
+    cache = PlanCache(path)
+    arrays = derivePlanArrays(loadData(path, 1))
+    cache.save(arrays)
+    # the widget writes the meshes next to the arrays
+    with open(cache.meshPath("plan"), "wb") as file:
+        file.write(b"mesh")
+    return cache, arrays
+
+
+def test_cache_hit(plan_path):
+    cache = PlanCache(plan_path)
+    assert cache.load() is None
+    assert cache.cache_directory == os.path.join(os.path.dirname(plan_path), ".plan-cache")
+
+    _, arrays = _save(plan_path)
+    cached = PlanCache(plan_path).load()
+    assert sorted(cached) == sorted(arrays)
+    for name, values in arrays.items():
+        np.testing.assert_array_equal(cached[name], values)
+    assert not [name for name in os.listdir(cache.cache_directory) if name.endswith(".tmp")]
+
+
+def test_edited_plan_invalidates_and_replaces_entry(plan_path):
+    old, _ = _save(plan_path)
+    with open(plan_path, "a") as file:
+        file.write(" ".join(["1"] * 21) + "\n")
+    cache = PlanCache(plan_path)
+    assert cache.key != old.key
+    assert cache.load() is None
+
+    _save(plan_path)
+    names = sorted(os.listdir(cache.cache_directory))
+    assert names == sorted(
+        os.path.basename(path) for path in [cache.arrays_path, cache.meshPath("plan")]
+    )
+    assert len(PlanCache(plan_path).load()["data"]) == 165
+
+
+def test_schema_change_invalidates(plan_path, monkeypatch):
+    old, _ = _save(plan_path)
+    monkeypatch.setattr(plancache, "PLAN_CACHE_SCHEMA", plancache.PLAN_CACHE_SCHEMA + 1)
+    cache = PlanCache(plan_path)
+    assert cache.key != old.key
+    assert cache.load() is None
+    _save(plan_path)
+    assert not os.path.exists(old.arrays_path)
+    assert not os.path.exists(old.meshPath("plan"))
+
+
+def test_cleanup_keeps_other_plans(plan_path):
+    other_path = os.path.join(os.path.dirname(plan_path), "needle_deployment_b.txt")
+    shutil.copy(plan_path, other_path)
+    with open(other_path, "a") as file:
+        file.write(" ".join(["2"] * 21) + "\n")
+    other, _ = _save(other_path)
+    _save(plan_path)
+
+    # an edit of needle_deployment.txt only replaces its own entries
+    with open(plan_path, "a") as file:
+        file.write(" ".join(["1"] * 21) + "\n")
+    _save(plan_path)
+    assert os.path.exists(other.arrays_path) and os.path.exists(other.meshPath("plan"))
+    assert PlanCache(other_path).load() is not None
+
+
+def test_corrupt_entry_is_a_miss(plan_path):
+    cache, _ = _save(plan_path)
+    with open(cache.arrays_path, "wb") as file:
+        file.write(b"not an npz file")
+    assert PlanCache(plan_path).load() is None
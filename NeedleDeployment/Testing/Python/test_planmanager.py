@@ -0,0 +1,79 @@
+import os
+import shutil
+import threading
+
+import pytest
+
+from NeedleDeploymentLib import planmanager
+from NeedleDeploymentLib.datafiles import DataFileError
+from NeedleDeploymentLib.planmanager import PlanManager
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+@pytest.fixture
+def plan_folder(tmp_path):
+    for name in ["needle_deployment_b.txt", "needle_deployment.txt"]:
+        shutil.copy(os.path.join(DATA, "needle_deployment.txt"), tmp_path / name)
+    (tmp_path / "needle_deployment_bad.txt").write_text("header\n1 2 3\n")
+    (tmp_path / "recording1.txt").write_text("0 0 0 1 0 0 0\n")
+    return tmp_path
+
+
+def test_activate_does_not_wait(plan_folder, monkeypatch):
+    # plan b stays loading until it is released
+    release = threading.Event()
+    load = planmanager.loadPlan
+
+    def loadPlan(path):
+        if path.endswith("_b.txt"):
+            release.wait(10)
+        return load(path)
+
+    monkeypatch.setattr(planmanager, "loadPlan", loadPlan)
+    manager = PlanManager()
+    try:
+        names = manager.scan(str(plan_folder))
+        assert names == ["needle_deployment", "needle_deployment_b", "needle_deployment_bad"]
+
+        manager.plan("needle_deployment", 10)
+        loaded = manager.activate("needle_deployment")
+        assert loaded.name == "needle_deployment"
+        assert manager.active == "needle_deployment" and manager.pending is None
+
+        assert manager.activate("needle_deployment_b") is None
+        assert manager.pending == "needle_deployment_b"
+        assert manager.poll() is None
+        assert manager.active == "needle_deployment"
+
+        release.set()
+        manager.plan("needle_deployment_b", 10)
+        loaded = manager.poll()
+        assert loaded.name == "needle_deployment_b"
+        assert manager.active == "needle_deployment_b" and manager.pending is None
+        assert manager.activePlan is loaded
+    finally:
+        release.set()
+        manager.close()
+
+
+def test_failed_plan_keeps_active_plan(plan_folder):
+    manager = PlanManager()
+    try:
+        manager.scan(str(plan_folder))
+        manager.plan("needle_deployment", 10)
+        manager.activate("needle_deployment")
+        with pytest.raises(DataFileError):
+            manager.plan("needle_deployment_bad", 10)
+        with pytest.raises(DataFileError):
+            manager.activate("needle_deployment_bad")
+        assert manager.active == "needle_deployment" and manager.pending is None
+        manager.plan("needle_deployment_b", 10)
+        names = [loaded.name for loaded in manager.ready()]
+        assert names == ["needle_deployment", "needle_deployment_b"]
+        with pytest.raises(KeyError):
+            manager.activate("needle_deployment_c")
+    finally:
+        manager.close()
+    # loading only reads the plan cache, the widget writes it with the meshes
+    assert not os.path.exists(plan_folder / ".plan-cache")
@@ -0,0 +1,178 @@
+import os
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.benchmarks import legacyPlanPreprocessing, syntheticPlan
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.plans import (
+    PlanGeometry,
+    PlanTracker,
+    coneTransforms,
+    insertMidpoints,
+    planTransforms,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+# closest point of every point on every segment: (segment, distance) per point
+def bruteForce(positions, points):
+    starts, vectors = positions[:-1], np.diff(positions, axis=0)
+    squared_lengths = np.einsum("ij,ij->i", vectors, vectors)
+    offsets = points[:, None, :] - starts
+    t = np.einsum("nkj,kj->nk", offsets, vectors)
+    t = np.clip(np.divide(t, squared_lengths, out=np.zeros_like(t), where=squared_lengths > 0), 0, 1)
+    distances = np.linalg.norm(offsets - t[..., None] * vectors, axis=2)
+    return np.argmin(distances, axis=1), distances.min(axis=1)
+
+
+def _bundledPlan():
+    return loadData(os.path.join(DATA, "needle_deployment.txt"), 1)[:, 7:10]
+
+
+# a tight zigzag of short segments, then one long segment passing next to it
+def _clusterPlan():
+    zigzag = np.column_stack([np.arange(40) * 0.1, 10 + (np.arange(40) % 2), np.zeros(40)])
+    return np.vstack([zigzag, [[-100.0, 0.0, 0.0], [100.0, 0.0, 0.0]]])
+
+
+# points near the plan and far from it (more than the plan length away)
+def _points(positions, count=500, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(positions), count)
+    directions = rng.normal(size=(count, 3))
+    directions /= np.linalg.norm(directions, axis=1, keepdims=True)
+    size = np.ptp(positions, axis=0).max()
+    near, far = rng.uniform(0, 5, count), rng.uniform(2, 10, count) * size
+    scale = np.where(np.arange(count) % 2 == 0, near, far)
+    return positions[rows] + directions * scale[:, None]
+
+
+@pytest.mark.parametrize(
+    "positions",
+    [_bundledPlan(), syntheticPlan(5000)[:, 7:10], _clusterPlan()],
+    ids=["bundled", "synthetic", "cluster"],
+)
+@pytest.mark.parametrize("k", [1, 2, 8])
+def test_project_matches_brute_force(positions, k):
+    geometry = PlanGeometry(positions, k=k)
+    points = _points(positions)
+    projection = geometry.project(points)
+    _, expected = bruteForce(positions, points)
+    np.testing.assert_allclose(projection.distance, expected, rtol=1e-12, atol=1e-9)
+    np.testing.assert_allclose(
+        np.linalg.norm(points - projection.point, axis=1), expected, rtol=1e-12, atol=1e-9
+    )
+
+
+def test_far_points_fall_back_to_ball_query():
+    positions = _clusterPlan()
+    geometry = PlanGeometry(positions)
+    points = _points(positions, count=2000)[1::2]
+    projection = geometry.project(points)
+    np.testing.assert_allclose(projection.distance, bruteForce(positions, points)[1], atol=1e-9)
+
+    # both paths of project() are taken: far points near the long segment need the search
+    # around every plan point within the bound, the others are settled by the k nearest
+    vertex_distances, _ = geometry.kdtree.query(points, k=geometry.k)
+    bound = np.sqrt(projection.distance ** 2 + geometry.half_max_length ** 2)
+    fallback = vertex_distances[:, -1] <= bound
+    assert fallback.any() and not fallback.all()
+
+
+def test_fallback_finds_long_segment():
+    positions = _clusterPlan()
+    geometry = PlanGeometry(positions, k=2)
+    points = np.array([[2.0, 4.0, 0.0], [1.0, 2.0, 0.5]])
+    projection = geometry.project(points)
+    np.testing.assert_array_equal(projection.segment, [len(positions) - 2] * 2)
+    np.testing.assert_allclose(projection.distance, [4.0, np.hypot(2.0, 0.5)])
+
+    # the segments of the nearest plan points alone miss it
+    _, vertices = geometry.kdtree.query(points, k=2)
+    segments = geometry.adjacentSegments(vertices).reshape(len(points), -1)
+    _, _, distance = geometry.closestOnSegments(points, segments)
+    assert np.all(distance > projection.distance + 0.5)
+
+
+def test_projection_fields():
+    positions = np.array([[0.0, 0, 0], [10, 0, 0], [10, 10, 0]])
+    geometry = PlanGeometry(positions, funnel_radii=[1.0, 3.0, 5.0], max_angle=[0.2, 0.4, 0.6])
+    projection = geometry.project([[2.5, 1, 0], [10, 8, 3], [-5, 0, 0]])
+    np.testing.assert_array_equal(projection.segment, [0, 1, 0])
+    np.testing.assert_allclose(projection.t, [0.25, 0.8, 0])
+    np.testing.assert_array_equal(projection.index, [0, 2, 0])
+    np.testing.assert_allclose(projection.arc_length, [2.5, 18, 0])
+    np.testing.assert_allclose(projection.distance, [1, 3, 5])
+    np.testing.assert_allclose(projection.radius, [1.5, 4.6, 1])
+    np.testing.assert_allclose(projection.max_angle, [0.25, 0.56, 0.2])
+
+
+# needle tips moving slowly along a plan at an offset, with a jump back towards the start halfway
+def _trajectory(positions, frames=400, offset=0.01, seed=0):
+    rng = np.random.default_rng(seed)
+    along = np.concatenate(
+        [np.linspace(0.4, 0.45, frames // 2), np.linspace(0.02, 0.07, frames // 2)]
+    )
+    rows = np.minimum((along * (len(positions) - 1)).astype(int), len(positions) - 1)
+    return positions[rows] + rng.normal(scale=offset, size=(frames, 3))
+
+
+def test_tracker_matches_global_search():
+    data = syntheticPlan(50000)
+    geometry = PlanGeometry(data[:, 7:10], funnel_radii=np.full(len(data), 2.0))
+    tracker = PlanTracker(geometry)
+    points = _trajectory(geometry.positions)
+    expected = geometry.project(points)
+    fallback_frames = []
+    for frame, point in enumerate(points):
+        fallbacks = tracker.fallbacks
+        projection = tracker.project(point)
+        if tracker.fallbacks > fallbacks:
+            fallback_frames.append(frame)
+        assert projection.distance[0] == pytest.approx(expected.distance[frame], abs=1e-9)
+        assert projection.arc_length[0] == pytest.approx(expected.arc_length[frame], abs=1e-6)
+    # the first frame and the jump need the global search, the rest is tracked locally
+    assert fallback_frames[:2] == [0, len(points) // 2]
+    assert len(fallback_frames) <= 4
+    assert tracker.local_hits == len(points) - tracker.fallbacks
+
+    # after a reset (plan switch) the next frame is searched globally
+    fallbacks = tracker.fallbacks
+    tracker.reset()
+    tracker.project(points[0])
+    assert tracker.fallbacks == fallbacks + 1
+
+
+def test_tracker_falls_back_outside_the_funnel():
+    positions = np.array([[0.0, 0, 0], [10, 0, 0], [10, 10, 0], [0, 10, 0]])
+    tracker = PlanTracker(PlanGeometry(positions, funnel_radii=np.full(4, 1.0)), window=1)
+    tracker.project([0.5, 0.2, 0])
+    # outside the funnel of the first segments, the last one is closer
+    projection = tracker.project([0.5, 8.0, 0])
+    np.testing.assert_array_equal(projection.segment, [2])
+    assert projection.distance[0] == pytest.approx(2.0)
+    assert tracker.fallbacks == 2
+
+
+# the plan and cone frames of the bundled plan match the per-sample loops of the widget they replace
+def test_plan_frames_match_legacy():
+    data = loadData(os.path.join(DATA, "needle_deployment.txt"), 1)
+    legacy_midpoints, legacy_plan, legacy_cone = legacyPlanPreprocessing(data)
+
+    np.testing.assert_array_equal(insertMidpoints(data[:, 7:10]), legacy_midpoints)
+    transforms = planTransforms(data[:, 7:10], data[:, 10:14])
+    np.testing.assert_allclose(transforms[:, :3, :], legacy_plan, atol=1e-12)
+    np.testing.assert_array_equal(transforms[:, 3], np.tile([0.0, 0.0, 0.0, 1.0], (len(data), 1)))
+    np.testing.assert_allclose(coneTransforms(data[:, 18:21]), legacy_cone, atol=1e-12)
+
+
+def test_midpoints_of_plan_points():
+    positions = loadData(os.path.join(DATA, "plan.txt"), 1)
+    legacy = []
+    for previous, position in zip(positions[:-1], positions[1:]):
+        legacy += [(position + previous) / 2, position]
+    np.testing.assert_array_equal(insertMidpoints(positions), [positions[0]] + legacy)
+    assert insertMidpoints(positions[:1]).shape == (1, 3)
+    assert insertMidpoints(np.empty((0, 3))).shape == (0, 3)
@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.datafiles import DataFileError, loadData
+from NeedleDeploymentLib.playback import PlaybackEngine
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _poses(count):
+    poses = np.zeros((count, 7))
+    poses[:, 0] = np.arange(count)
+    poses[:, 3] = 1.0
+    return poses
+
+
+def _write(path, rows):
+    np.savetxt(path, rows, fmt="%.6f")
+    return str(path)
+
+
+def test_load_timestamped_recording(tmp_path):
+    times = np.array([0.0, 0.1, 0.3, 0.6])
+    path = _write(tmp_path / "recording-1.txt", np.column_stack([times + 12.0, _poses(4)]))
+    data = loadData(path)
+    assert data.shape == (4, 8)
+
+    clock = FakeClock()
+    engine = PlaybackEngine(data, clock=clock)
+    np.testing.assert_allclose(engine.times, times)
+    engine.start()
+    clock.now = 0.35
+    np.testing.assert_allclose(engine.update(), _poses(4)[2])
+    clock.now = 1.0
+    assert engine.finished()
+    np.testing.assert_allclose(engine.update(), _poses(4)[3])
+
+
+def test_load_plain_recording(tmp_path):
+    path = _write(tmp_path / "demo.txt", _poses(5))
+    data = loadData(path)
+    assert data.shape == (5, 7)
+
+    clock = FakeClock()
+    engine = PlaybackEngine(data, rate=10.0, clock=clock)
+    engine.start()
+    clock.now = 0.25
+    np.testing.assert_allclose(engine.update(), _poses(5)[2])
+    assert engine.dropped == 1
+
+
+def test_recording_column_count_checked(tmp_path):
+    path = _write(tmp_path / "recording.txt", np.zeros((3, 6)))
+    with pytest.raises(DataFileError) as error:
+        loadData(path)
+    assert error.value.rows[0][0] == 1
+
+    path = tmp_path / "recording-mixed.txt"
+    path.write_text("0 0 0 0 1 0 0\n0.1 0 0 0 0 1 0 0\n")
+    with pytest.raises(DataFileError) as error:
+        loadData(str(path))
+    assert [row for row, _ in error.value.rows] == [2]
+
+
+# 4 Hz recording, so frame times (k / 4) and the clock times below are exact in binary
+@pytest.fixture
+def engine():
+    clock = FakeClock()
+    return PlaybackEngine(_poses(40), rate=4.0, clock=clock), clock
+
+
+def _frame(engine):
+    engine.update()
+    return engine.index
+
+
+def test_speed_change_mid_run(engine):
+    engine, clock = engine
+    engine.start()
+    clock.now = 1.0
+    assert _frame(engine) == 4
+    engine.setSpeed(2.0)
+    clock.now = 2.0
+    assert _frame(engine) == 12
+    engine.setSpeed(0.5)
+    clock.now = 4.0
+    assert _frame(engine) == 16
+
+    engine.setSpeed(100.0)
+    assert engine.speed == 10.0
+    engine.setSpeed(0.0)
+    assert engine.speed == pytest.approx(0.1)
+
+
+def test_seek_past_either_end(engine):
+    engine, clock = engine
+    engine.seek(-5)
+    assert engine.index == 0 and engine.currentTime() == 0.0
+    engine.seek(1000)
+    assert engine.index == 39 and engine.finished()
+    engine.seekTime(-1.0)
+    assert engine.index == 0
+    engine.seekTime(1e9)
+    assert engine.index == 39
+
+    # seeking while running keeps running from the new frame
+    engine.seek(0)
+    engine.start()
+    clock.now = 0.5
+    engine.seek(8)
+    clock.now = 1.5
+    assert engine.running and _frame(engine) == 12
+
+
+def test_step_at_the_boundaries(engine):
+    engine, clock = engine
+    engine.start()
+    clock.now = 0.5
+    engine.step(-1)
+    assert not engine.running and engine.index == 1
+    engine.step(-5)
+    assert engine.index == 0
+    engine.step(3)
+    assert engine.index == 3
+    clock.now = 10.0
+    assert _frame(engine) == 3  # stepping pauses playback
+    engine.seek(39)
+    engine.step(1)
+    assert engine.index == 39
+
+
+def test_stop_and_restart(engine):
+    engine, clock = engine
+    engine.start()
+    clock.now = 1.0
+    assert _frame(engine) == 4
+    engine.stop()
+    assert not engine.running
+    clock.now = 5.0
+    assert _frame(engine) == 4
+    engine.start()
+    engine.start()  # starting again does not move the clock anchor
+    clock.now = 6.0
+    assert _frame(engine) == 8
+    assert engine.dropped == 6  # frames 1-3 and 5-7
+
+    clock.now = 100.0
+    assert _frame(engine) == 39 and engine.finished()
+    engine.rewind()
+    assert engine.index == 0 and engine.dropped == 0
+    clock.now = 100.25
+    assert _frame(engine) == 1
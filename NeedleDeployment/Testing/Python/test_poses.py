@@ -0,0 +1,125 @@
+import os
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.poses import (
+    PoseInterpolator,
+    PosePredictor,
+    PoseSample,
+    evaluatePredictor,
+    slerp,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+# quaternion of a rotation by angle (radians) about axis
+def _rotation(angle, axis=(0.0, 0.0, 1.0)):
+    axis = np.asarray(axis) / np.linalg.norm(axis)
+    return np.concatenate([[np.cos(angle / 2)], np.sin(angle / 2) * axis])
+
+
+# rotation angle between quaternions, the same for q and -q
+def _angle(q0, q1):
+    return 2 * np.arccos(np.clip(abs(np.dot(q0, q1)), 0.0, 1.0))
+
+
+def test_slerp_endpoints_and_midpoint():
+    q0, q1 = _rotation(0.0), _rotation(1.0)
+    np.testing.assert_allclose(slerp(q0, q1, 0.0), q0, atol=1e-12)
+    np.testing.assert_allclose(slerp(q0, q1, 1.0), q1, atol=1e-12)
+    np.testing.assert_allclose(slerp(q0, q1, 0.25), _rotation(0.25), atol=1e-12)
+    # unnormalized inputs and arrays of times
+    result = slerp(2 * q0, 3 * q1, np.array([0.0, 0.5, 1.0]))
+    np.testing.assert_allclose(result, [q0, _rotation(0.5), q1], atol=1e-12)
+
+
+def test_slerp_takes_the_short_way():
+    q0, q1 = _rotation(0.2), -_rotation(0.6)  # the same rotation as _rotation(0.6)
+    middle = slerp(q0, q1, 0.5)
+    assert _angle(middle, _rotation(0.4)) < 1e-9
+    assert _angle(middle, q0) == pytest.approx(0.2)
+
+
+def test_slerp_of_nearly_identical_quaternions():
+    q0 = _rotation(0.3, (1.0, 2.0, 3.0))
+    q1 = _rotation(0.3 + 1e-9, (1.0, 2.0, 3.0))
+    for q in (q1, q0, -q0):
+        result = slerp(q0, q, 0.5)
+        assert np.all(np.isfinite(result))
+        assert np.linalg.norm(result) == pytest.approx(1.0)
+        assert _angle(result, q0) < 1e-8
+
+
+def _samples(times, angles):
+    return [
+        PoseSample(t, np.concatenate([[10.0 * t, 0.0, 0.0], _rotation(angle)]))
+        for t, angle in zip(times, angles)
+    ]
+
+
+def test_interpolator_between_and_past_the_samples():
+    interpolator = PoseInterpolator(delay=0.0)
+    assert interpolator.sample(1.0) is None
+    interpolator.addSamples(_samples([1.0, 2.0, 4.0], [0.0, 0.5, 1.5]))
+
+    # at the samples
+    for t, angle in [(1.0, 0.0), (2.0, 0.5), (4.0, 1.5)]:
+        pose = interpolator.sample(t)
+        assert pose[0] == pytest.approx(10.0 * t)
+        assert _angle(pose[3:7], _rotation(angle)) < 1e-9
+    # between them
+    pose = interpolator.sample(3.0)
+    assert pose[0] == pytest.approx(30.0)
+    assert _angle(pose[3:7], _rotation(1.0)) < 1e-9
+    # before the first and after the last sample the pose is held
+    np.testing.assert_allclose(interpolator.sample(0.0), interpolator.sample(1.0))
+    np.testing.assert_allclose(interpolator.sample(9.0), interpolator.sample(4.0))
+
+
+def test_interpolator_delay_and_batches():
+    interpolator = PoseInterpolator()
+    interpolator.addSamples(_samples([1.0], [0.0]))
+    assert interpolator.currentDelay() == 0.0
+    np.testing.assert_allclose(interpolator.sample(5.0)[0], 10.0)
+
+    # samples of one batch share a timestamp, the newest one is kept
+    interpolator.addSamples(_samples([1.5, 1.5, 2.0], [0.0, 0.2, 0.4]))
+    assert list(interpolator._times) == [1.0, 1.5, 2.0]
+    assert _angle(interpolator.sample(1.5 + 0.5)[3:7], _rotation(0.2)) < 1e-9
+    assert interpolator.currentDelay() == 0.5
+
+    interpolator.clear()
+    assert interpolator.sample(2.0) is None
+
+
+# predicting two samples (40 ms at 50 Hz) ahead must beat holding the last pose, including the
+# recordings with tracker jumps (5 and 6), at well under a millisecond per sample
+@pytest.mark.parametrize("number", range(1, 9))
+def test_prediction_beats_holding_the_pose(number):
+    poses = loadData(os.path.join(DATA, f"recording{number}.txt"))
+    errors, elapsed = evaluatePredictor(poses, rate=50.0, steps=2)
+    mean = errors.mean(axis=0)
+    p95 = np.percentile(errors, 95, axis=0)
+    assert mean[0] < mean[1]
+    assert mean[2] <= mean[3] + 1e-9
+    assert p95[2] <= p95[3] + 1e-9
+    assert elapsed < 0.001
+
+
+def test_jump_is_not_extrapolated():
+    predictor = PosePredictor()
+    turned = np.array([0.0, 0.0, 0.0, np.cos(1.0), np.sin(1.0), 0.0, 0.0])  # 2 rad about x
+    for i in range(5):
+        predictor.update(i * 0.02, [0, 0, 0, 1, 0, 0, 0])
+    predictor.update(0.1, turned)
+    np.testing.assert_array_equal(predictor.angular_velocity, 0.0)
+    np.testing.assert_allclose(np.abs(predictor.predict(0.04)[3:7]), np.abs(turned[3:7]))
+
+    # steady rotation after the jump is predicted again
+    for i in range(1, 10):
+        angle = 1.0 + 0.01 * i
+        predictor.update(0.1 + i * 0.02, [0, 0, 0, np.cos(angle), np.sin(angle), 0, 0])
+    np.testing.assert_allclose(predictor.angular_velocity, [1.0, 0.0, 0.0], rtol=1e-2)
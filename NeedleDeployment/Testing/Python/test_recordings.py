@@ -0,0 +1,66 @@
+import os
+
+import numpy as np
+
+from NeedleDeploymentLib.recordings import RecordingLibrary
+
+
+def _poses(count):
+    poses = np.zeros((count, 7))
+    poses[:, 0:3] = np.arange(count * 3).reshape(count, 3)
+    poses[:, 3] = 1.0
+    return poses
+
+
+def _write(path, rows):
+    np.savetxt(path, rows, fmt="%.6f")
+
+
+def test_scan_converts_plain_and_timestamped(tmp_path):
+    _write(tmp_path / "recording-plain.txt", _poses(11))
+    times = np.linspace(100.0, 102.5, 6)
+    _write(tmp_path / "recording-timed.txt", np.column_stack([times, _poses(6)]))
+    _write(tmp_path / "demo-broken.txt", np.zeros((2, 5)))
+    (tmp_path / "notes.txt").write_text("not a recording\n")
+
+    library = RecordingLibrary(str(tmp_path), cache_directory=str(tmp_path / "cache"), rate=10.0)
+    recordings = {recording.name: recording for recording in library.scan()}
+    assert sorted(recordings) == ["recording-plain.txt", "recording-timed.txt"]
+
+    plain = recordings["recording-plain.txt"]
+    assert plain.frames == 11
+    assert plain.duration == 1.0
+    np.testing.assert_allclose(plain.bbox_max, _poses(11)[-1, 0:3])
+
+    timed = recordings["recording-timed.txt"]
+    assert timed.frames == 6
+    assert timed.duration == 2.5
+    np.testing.assert_allclose(timed.bbox_min, [0, 1, 2])
+    data = library.load("recording-timed.txt")
+    assert data.shape == (6, 8)
+    np.testing.assert_allclose(data[:, 0], times)
+
+
+def test_scan_reuses_and_refreshes_cache(tmp_path):
+    path = tmp_path / "recording.txt"
+    _write(path, _poses(4))
+    cache = tmp_path / "cache"
+
+    library = RecordingLibrary(str(tmp_path), cache_directory=str(cache))
+    first = library.scan()[0]
+    converted = os.path.getmtime(first.cache_path)
+
+    # a new library finds the conversion through the index
+    again = RecordingLibrary(str(tmp_path), cache_directory=str(cache)).scan()[0]
+    assert again.cache_path == first.cache_path
+    assert os.path.getmtime(again.cache_path) == converted
+
+    # an edited recording is converted again and the old conversion removed
+    _write(path, np.column_stack([np.arange(7) * 0.5, _poses(7)]))
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    edited = RecordingLibrary(str(tmp_path), cache_directory=str(cache)).scan()[0]
+    assert edited.cache_path != first.cache_path
+    assert not os.path.exists(first.cache_path)
+    assert edited.frames == 7
+    assert edited.duration == 3.0
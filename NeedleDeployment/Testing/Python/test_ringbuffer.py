@@ -0,0 +1,124 @@
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.ringbuffer import (
+    HEADER_SIZE,
+    RECORD_DTYPE,
+    PoseRingBuffer,
+    PoseRingBufferWriter,
+)
+
+
+def _pose(value):
+    return np.array([value, 0, 0, 1, 0, 0, 0], dtype=float)
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "needle-tracker.ringbuffer")
+
+
+def test_reads_new_records(path):
+    writer = PoseRingBufferWriter(path, capacity=8)
+    reader = PoseRingBuffer(path)
+    assert reader.readSamples() == []
+    for value in range(3):
+        writer.write(_pose(value), timestamp=100.0 + value)
+    samples = reader.readSamples()
+    assert [sample.timestamp for sample in samples] == [100.0, 101.0, 102.0]
+    np.testing.assert_array_equal(samples[-1].pose, _pose(2))
+    assert reader.readSamples() == []
+    writer.write(_pose(3))
+    np.testing.assert_array_equal(reader.poll(), _pose(3))
+    assert reader.poll() is None
+    reader.close()
+    writer.close()
+
+
+def test_counts_overruns(path):
+    writer = PoseRingBufferWriter(path, capacity=4)
+    reader = PoseRingBuffer(path)
+    for value in range(10):
+        writer.write(_pose(value))
+    samples = reader.readSamples()
+    assert [sample.pose[0] for sample in samples] == [6, 7, 8, 9]
+    assert reader.overruns == 6
+    reader.close()
+    writer.close()
+
+
+def test_detects_torn_reads(path):
+    writer = PoseRingBufferWriter(path, capacity=4)
+    reader = PoseRingBuffer(path)
+    assert reader.readSamples() == []
+    writer.write(_pose(1))
+    writer.write(_pose(2))
+
+    # sequence 2 is published, then the writer wraps around and is halfway through sequence 6
+    # in the same slot: seq_begin is stamped, seq_end still belongs to sequence 2
+    writer._records[1]["seq_begin"] = 6
+    writer._records[1]["pose"] = _pose(6)
+    assert reader.read(2) is None
+    assert reader.latest() is None
+    assert reader.torn_reads == 4  # the direct read and every retry of latest
+    samples = reader.readSamples()
+    assert [sample.pose[0] for sample in samples] == [1]
+
+    # a record whose seq_end is stamped but not seq_begin is torn too
+    writer._records[2]["seq_end"] = 3
+    writer._header["sequence"] = 3
+    assert reader.readSamples() == []
+    assert reader.torn_reads == 6
+    reader.close()
+    writer.close()
+
+
+def test_follows_replaced_buffer(path):
+    writer = PoseRingBufferWriter(path, capacity=4)
+    reader = PoseRingBuffer(path)
+    for value in range(3):
+        writer.write(_pose(value))
+    assert len(reader.readSamples()) == 3
+
+    # the tracker restarts with a new buffer file, the old mapping stays at sequence 3
+    restarted = PoseRingBufferWriter(path, capacity=4)
+    restarted.write(_pose(10))
+    assert [sample.pose[0] for sample in reader.readSamples()] == [10]
+
+    again = PoseRingBufferWriter(path, capacity=4)
+    again.write(_pose(20))
+    np.testing.assert_array_equal(reader.poll(), _pose(20))
+    reader.close()
+    for buffer in (writer, restarted, again):
+        buffer.close()
+
+
+@pytest.mark.parametrize(
+    "content, error",
+    [
+        (b"\0" * 4096, "not a version 1 pose ring buffer"),
+        (b"NDRB\1\0\0\0", "header is cut short"),
+        (None, "records are cut short"),
+    ],
+)
+def test_reports_bad_files_once(path, capsys, content, error):
+    if content is None:  # a valid header, records cut off after the first one
+        PoseRingBufferWriter(path, capacity=8).close()
+        with open(path, "r+b") as file:
+            file.truncate(HEADER_SIZE + RECORD_DTYPE.itemsize)
+    else:
+        with open(path, "wb") as file:
+            file.write(content)
+    reader = PoseRingBuffer(path)
+    for _ in range(3):
+        assert reader.readSamples() == []
+        assert reader.poll() is None
+    assert capsys.readouterr().out.count(error) == 1
+
+    # the tracker replaces it with a valid buffer
+    writer = PoseRingBufferWriter(path, capacity=8)
+    writer.write(_pose(1))
+    assert [sample.pose[0] for sample in reader.readSamples()] == [1]
+    assert capsys.readouterr().out == ""
+    reader.close()
+    writer.close()
@@ -0,0 +1,136 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.spatial import cKDTree
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.scoring import NeedlePlan, precisionPercent, scoreNeedleTips, scorePoses
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+@pytest.fixture(scope="module")
+def data():
+    return loadData(os.path.join(DATA, "needle_deployment.txt"), 1)
+
+
+# onNeedleMove before scoring.py: nearest plan sample, then the legend math of
+# updateAllowedPosDevLine and updateAllowedAngle for one pose
+def legacyScore(data, ckdtree, needle_pos, needle_direction):
+    distance, index = ckdtree.query(needle_pos)
+    radius = data[index, 15]
+    if distance > radius:
+        position_precision = 0
+    else:
+        position_precision = (1 - distance / radius) if radius > 0 else 0
+
+    cone_direction = data[index, 18:21]
+    max_angle = data[index, 17]
+    cos_theta = np.dot(cone_direction, needle_direction) / (
+        np.linalg.norm(cone_direction) * np.linalg.norm(needle_direction)
+    )
+    theta = np.arccos(np.clip(cos_theta, -1, 1))
+    if theta > max_angle / 2:
+        angle_precision = 0
+    else:
+        angle_precision = 1 - theta / max_angle
+    return index, distance, radius, position_precision, theta, angle_precision
+
+
+# needle tips scattered around the plan, inside and outside of the funnel, pointing roughly
+# along the cone axes
+def _needles(data, count=2000, seed=0):
+    rng = np.random.default_rng(seed)
+    rows = rng.integers(0, len(data), count)
+    offsets = rng.normal(size=(count, 3))
+    scale = rng.uniform(0, 2, count) * (data[rows, 15] + 1.0)
+    offsets *= (scale / np.linalg.norm(offsets, axis=1))[:, None]
+    directions = data[rows, 18:21] + rng.normal(scale=0.3, size=(count, 3))
+    return data[rows, 7:10] + offsets, directions
+
+
+# projection of positions on their nearest plan sample, as the legacy code measured them
+def _sampleProjection(plan, positions):
+    distances, index = plan.geometry.kdtree.query(positions)
+    last_segment = len(plan.geometry.lengths) - 1
+    segment = np.minimum(index, last_segment)
+    t = (index > last_segment).astype(np.float64)
+    return plan.geometry.projection(segment, t, distances)
+
+
+def test_matches_legacy_per_pose_scoring(data):
+    plan = NeedlePlan(data)
+    positions, directions = _needles(data)
+    scores = scoreNeedleTips(positions, directions, plan, projection=_sampleProjection(plan, positions))
+
+    ckdtree = cKDTree(data[:, 7:10])
+    legacy = np.array(
+        [
+            legacyScore(data, ckdtree, position, direction)
+            for position, direction in zip(positions, directions)
+        ]
+    )
+    np.testing.assert_array_equal(scores.index, legacy[:, 0])
+    np.testing.assert_allclose(scores.distance, legacy[:, 1], rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(scores.radius, legacy[:, 2])
+    np.testing.assert_allclose(scores.position_precision, legacy[:, 3], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(scores.angle, legacy[:, 4], rtol=0, atol=1e-12)
+    np.testing.assert_allclose(scores.angle_precision, legacy[:, 5], rtol=0, atol=1e-12)
+    np.testing.assert_array_equal(scores.position_within, legacy[:, 1] <= legacy[:, 2])
+    np.testing.assert_array_equal(scores.angle_within, legacy[:, 4] <= data[legacy[:, 0].astype(int), 17] / 2)
+    assert 0 < scores.position_within.mean() < 1
+    assert 0 < scores.angle_within.mean() < 1
+
+
+def test_plan_samples_score_like_legacy(data):
+    plan = NeedlePlan(data)
+    positions = data[:, 7:10]
+    directions = data[:, 18:21]
+    scores = scoreNeedleTips(positions, directions, plan)
+    np.testing.assert_allclose(scores.distance, 0, atol=1e-12)
+    # samples may be projected at the end of the segment before them
+    np.testing.assert_allclose(scores.radius, data[:, 15], rtol=1e-5)
+    # the last samples, at the Target, allow no deviation and score 0
+    np.testing.assert_allclose(scores.position_precision, data[:, 15] > 0)
+    np.testing.assert_allclose(scores.angle_precision, data[:, 17] > 0, atol=1e-6)
+
+
+def test_polyline_never_farther_than_samples(data):
+    plan = NeedlePlan(data)
+    positions, directions = _needles(data, seed=1)
+    scores = scoreNeedleTips(positions, directions, plan)
+    sample_distance = _sampleProjection(plan, positions).distance
+    assert np.all(scores.distance <= sample_distance + 1e-12)
+
+
+def test_score_poses_applies_registration(data):
+    plan = NeedlePlan(data)
+    poses = np.column_stack([data[:20, 7:10], data[:20, 10:14]])
+    registration = np.eye(4)
+    registration[:3, 3] = [10.0, -5.0, 2.0]
+    moved = poses.copy()
+    moved[:, 0:3] -= registration[:3, 3]
+    np.testing.assert_allclose(
+        scorePoses(moved, plan, registration).distance, scorePoses(poses, plan).distance, atol=1e-9
+    )
+
+
+def test_zero_tolerances_score_zero(data):
+    data = data.copy()
+    data[:, 15] = 0.0
+    data[:, 17] = 0.0
+    plan = NeedlePlan(data)
+    scores = scoreNeedleTips(data[:5, 7:10], data[:5, 18:21], plan)
+    assert scores.position_within.all() and scores.angle_within.all()
+    np.testing.assert_array_equal(scores.position_precision, 0)
+    np.testing.assert_array_equal(scores.angle_precision, 0)
+
+
+def test_precision_percent():
+    precision = np.array([0.0, 1.0, 0.004, 0.005, 0.125, 0.135, 0.5, 0.995, 0.9951])
+    expected = [round(value * 100) for value in precision.tolist()]
+    np.testing.assert_array_equal(precisionPercent(precision), expected)
+    assert precisionPercent(precision).dtype.kind == "i"
+    assert int(precisionPercent(0.5)) == 50
+    assert precisionPercent([]).shape == (0,)
@@ -0,0 +1,118 @@
+import os
+
+import numpy as np
+
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.scoring import NeedlePlan, scorePoses
+from NeedleDeploymentLib.sessionlog import (
+    EVENT,
+    POSE,
+    SCHEMA_VERSION,
+    SESSION_START,
+    SessionLog,
+    SessionLogWriter,
+)
+
+DATA = os.path.join(os.path.dirname(__file__), "..", "..", "Resources", "Data")
+
+
+def _poses(count, start=0):
+    poses = np.zeros((count, 7))
+    poses[:, 0] = start + np.arange(count)
+    poses[:, 3] = 1.0
+    return poses
+
+
+# two sessions: poses and spacebar presses, the first with scores and latency clocks
+def _writeLog(path, chunk_records=4):
+    plan = NeedlePlan(loadData(os.path.join(DATA, "needle_deployment.txt"), 1))
+    registration = np.eye(4)
+    registration[:3, 3] = [1.0, 2.0, 3.0]
+    with open(path, "wb") as file:
+        writer = SessionLogWriter(file, chunk_records=chunk_records)
+        writer.startSession(registration, plan.content_hash, participant="p01")
+        start = writer.start_time
+        poses = np.column_stack([plan.positions[:10], plan.quaternions[:10]])
+        scores = scorePoses(poses, plan)
+        writer.addPoses(start + 0.1 * np.arange(1, 11), poses, 1, scores, 100, 200, 300)
+        writer.addEvent(start + 1.5, 2)
+        writer.addPoses(start + 2.0, _poses(1, 50), 2)
+
+        writer.startSession()
+        writer.addPoses(writer.start_time + np.arange(1, 4), _poses(3), 0)
+        writer.addEvent(writer.start_time + 5.0, 1)
+        writer.close()
+    return plan, poses, scores
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "needle-session.ndlog")
+    plan, poses, scores = _writeLog(path)
+    log = SessionLog(path)
+    assert len(log) == 2 and not log.truncated
+
+    first = log.sessions[0]
+    assert first.header["schema"] == SCHEMA_VERSION
+    assert first.header["plan_hash"] == plan.content_hash
+    assert first.header["participant"] == "p01"
+    np.testing.assert_array_equal(first.registration[:3, 3], [1, 2, 3])
+    assert first.records["kind"].tolist() == [SESSION_START] + [POSE] * 10 + [EVENT, POSE]
+    assert len(first.chunks) > 1
+
+    logged = first.poses
+    np.testing.assert_array_equal(logged["position"][:10], poses[:, 0:3])
+    np.testing.assert_array_equal(logged["quaternion"][:10], poses[:, 3:7])
+    np.testing.assert_array_equal(logged["index"][:10], scores.index)
+    np.testing.assert_allclose(logged["position_precision"][:10], scores.position_precision, rtol=1e-6)
+    np.testing.assert_allclose(logged["progress"][:10], scores.progress, rtol=1e-6)
+    assert logged["applied_ns"][:10].tolist() == [300] * 10
+    # unscored poses
+    assert logged["index"][10] == -1 and np.isnan(logged["position_precision"][10])
+    assert logged["sample_ns"][10] == -1
+
+    np.testing.assert_allclose(first.eventTimes(), [1.5])
+    table = first.poseTable()
+    assert table.shape == (11, 8)
+    np.testing.assert_allclose(table[:, 0], np.append(0.1 * np.arange(1, 11), 2.0))
+
+    second = log.sessions[1]
+    assert second.header["plan_hash"] is None
+    np.testing.assert_array_equal(second.registration, np.eye(4))
+    np.testing.assert_allclose(second.poseTable()[:, 0], [1, 2, 3])
+
+
+def test_export_text(tmp_path):
+    path = str(tmp_path / "needle-session.ndlog")
+    _, poses, _ = _writeLog(path)
+    log = SessionLog(path)
+    poses_path = str(tmp_path / "needle-timestamps.txt")
+    markers_path = str(tmp_path / "timestamps.txt")
+    log.exportText(poses_path, markers_path)
+
+    with open(poses_path) as file:
+        lines = file.read().split("\n")
+    assert lines[0] == "" and lines[12] == "" and lines[16:] == [""]
+    exported = np.loadtxt(lines[1:12])
+    np.testing.assert_allclose(exported, log.sessions[0].poseTable())
+    np.testing.assert_allclose(exported[:10, 1:8], poses)
+    assert loadData(poses_path).shape == (14, 8)
+
+    with open(markers_path) as file:
+        assert [float(line) if line else None for line in file.read().split("\n")] == [
+            None,
+            1.5,
+            None,
+            5.0,
+            None,
+        ]
+
+
+def test_interrupted_write_keeps_complete_chunks(tmp_path):
+    path = str(tmp_path / "needle-session.ndlog")
+    _writeLog(path)
+    data = np.fromfile(path, dtype=np.uint8)
+    log = SessionLog(data=data[:-10])
+    assert log.truncated
+    assert len(log) == 2
+    assert len(log.sessions[0].poses) == 11
+    assert len(log.sessions[1].records) < 5
@@ -0,0 +1,115 @@
+import os
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.logwriter import AsyncLogWriter
+from NeedleDeploymentLib.sessionlog import POSE, SessionLog, SessionLogWriter
+from NeedleDeploymentLib.sessions import (
+    SegmentedLog,
+    SessionManager,
+    isSessionDirectory,
+    loadTrial,
+    readLogRange,
+    readSessionIndex,
+)
+
+
+@pytest.fixture
+def writer():
+    writer = AsyncLogWriter()
+    yield writer
+    writer.close()
+
+
+def _line(t):
+    return f"{t} 1.0 2.0 3.0 1.0 0.0 0.0 0.0\n"
+
+
+def test_segments_roll_over_and_repeat_preamble(tmp_path, writer):
+    log = SegmentedLog(str(tmp_path), "needle-session", ".ndlog", writer, max_bytes=100)
+    log.preamble = b"HEADER\n"
+    for number in range(20):
+        log.write(f"record {number:02d}\n")
+    writer.flush()
+
+    assert log.segments[0] == "needle-session-0001.ndlog" and len(log.segments) > 2
+    records = []
+    for segment in log.segments:
+        with open(tmp_path / segment, "rb") as file:
+            data = file.read()
+        assert data.startswith(b"HEADER\n")
+        assert len(data) <= 100
+        records += data.decode().splitlines()[1:]
+    assert records == [f"record {number:02d}" for number in range(20)]
+
+    # a write larger than a segment still goes into a single segment
+    log.write("x" * 300)
+    writer.flush()
+    assert os.path.getsize(tmp_path / log.segments[-1]) == len(b"HEADER\n") + 300
+
+
+def test_read_log_range_across_segments(tmp_path, writer):
+    log = SegmentedLog(str(tmp_path), "needle-timestamps", ".txt", writer, max_bytes=120)
+    positions = []
+    for number in range(12):
+        positions.append(log.position())
+        log.write(_line(number))
+    positions.append(log.position())
+    writer.flush()
+    assert len(log.segments) > 3
+
+    data = readLogRange(str(tmp_path), log.segments, positions[2], positions[9])
+    assert data.decode() == "".join(_line(number) for number in range(2, 9))
+    assert readLogRange(str(tmp_path), log.segments, positions[5]).decode() == "".join(
+        _line(number) for number in range(5, 12)
+    )
+    assert readLogRange(str(tmp_path), log.segments).decode().count("\n") == 12
+
+
+def test_session_trials(tmp_path, writer):
+    manager = SessionManager(str(tmp_path), writer, segment_bytes=200)
+    directory = manager.startSession("p01", plan="needle_deployment")
+    assert isSessionDirectory(directory)
+    text = manager.log("needle-timestamps")
+    binary = SessionLogWriter(manager.log("needle-session", ".ndlog"), chunk_records=2)
+    binary.startSession()
+
+    t = 0
+    for trial in range(1, 4):
+        manager.startTrial(trial)
+        for _ in range(3 * trial):
+            t += 1
+            text.write(_line(t))
+            binary.addPoses(binary.start_time + t, np.array([[t, 0, 0, 1, 0, 0, 0]]), trial)
+        binary.flush()
+    binary.close()
+    manager.close()
+    writer.flush()
+
+    index = readSessionIndex(directory)
+    assert index["participant"] == "p01" and index["metadata"] == {"plan": "needle_deployment"}
+    assert [entry["phase"] for entry in index["trials"]] == [1, 2, 3]
+    assert index["stopped"] is not None
+    assert len(index["logs"]["needle-timestamps"]) > 1
+    assert len(index["logs"]["needle-session"]) > 1
+
+    first = 0
+    for trial in range(1, 4):
+        expected = np.arange(first + 1, first + 3 * trial + 1)
+        first = expected[-1]
+        samples = loadTrial(directory, trial, index=index)
+        np.testing.assert_array_equal(samples[:, 0], expected)
+        records = loadTrial(directory, trial, "needle-session", index)
+        records = records[records["kind"] == POSE]
+        np.testing.assert_array_equal(records["position"][:, 0], expected)
+        assert set(records["phase"].tolist()) == {trial}
+
+    # all segments of the binary log read as one session
+    segments = index["logs"]["needle-session"]
+    data = np.concatenate([np.fromfile(os.path.join(directory, name), dtype=np.uint8) for name in segments])
+    log = SessionLog(data=data)
+    assert len(log) == 1 and len(log.sessions[0].poses) == 18
+
+    with pytest.raises(KeyError):
+        loadTrial(directory, 1, "needle-tracker", index)
@@ -0,0 +1,329 @@
+import os
+import select
+import socket
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from NeedleDeploymentLib.replay import loadRecording, replay
+from NeedleDeploymentLib.poses import PoseSample
+from NeedleDeploymentLib.tracking import (
+    LatestPoseSlot,
+    PoseIngestThread,
+    SocketPoseSource,
+    TrackerFileTail,
+    packPose,
+    readLastLines,
+    readLastPose,
+)
+
+
+def _line(value):
+    return f"{value} 0 0 1 0 0 0\n"
+
+
+def _append(path, text):
+    with open(path, "a") as file:
+        file.write(text)
+
+
+def test_tail_skips_existing_lines(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text("".join(_line(value) for value in range(100)))
+    tail = TrackerFileTail(str(path))
+    assert tail.readLines() == []
+    assert tail.poll() is None
+
+    _append(path, _line(100) + _line(101))
+    samples = tail.readSamples()
+    assert [sample.pose[0] for sample in samples] == [100, 101]
+
+
+def test_tail_completes_line_being_written(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text(_line(1) + "2 0 0")
+    tail = TrackerFileTail(str(path))
+    assert tail.readLines() == []
+    _append(path, " 1 0 0 0\n" + _line(3))
+    np.testing.assert_array_equal(tail.poll(), [3, 0, 0, 1, 0, 0, 0])
+    _append(path, _line(4))
+    assert [line.split()[0] for line in tail.readLines()] == [b"4"]
+
+
+def test_tail_from_start(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text(_line(1) + _line(2))
+    tail = TrackerFileTail(str(path), from_end=False)
+    assert len(tail.readLines()) == 2
+
+
+def test_tail_reads_file_created_later(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    tail = TrackerFileTail(str(path))
+    assert tail.readLines() == []
+    path.write_text(_line(1) + _line(2))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [1, 2]
+
+
+def test_tail_restarts_after_truncation(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text(_line(1) + _line(2) + _line(3))
+    tail = TrackerFileTail(str(path), from_end=False)
+    assert len(tail.readLines()) == 3
+
+    # the tracker restarts and writes a shorter file in place
+    with open(path, "w") as file:
+        file.write(_line(4))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [4]
+    _append(path, _line(5))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [5]
+
+
+def test_tail_restarts_after_rewrite_of_same_size(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text(_line(1) + _line(2))
+    tail = TrackerFileTail(str(path), from_end=False)
+    assert len(tail.readLines()) == 2
+
+    # same size and last byte, only the modification time tells it was rewritten
+    stat = os.stat(path)
+    path.write_text(_line(3) + _line(4))
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [3, 4]
+
+    # longer rewrite whose byte before the old offset differs
+    path.write_text("10 0 0 1 0 0 0 \n" + _line(5) + _line(6))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [10, 5, 6]
+
+
+def test_tail_follows_replaced_file(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    tail = TrackerFileTail(str(path))
+    assert tail.readLines() == []
+    path.write_text(_line(1) + _line(2) + "3 0 0")
+    assert [sample.pose[0] for sample in tail.readSamples()] == [1, 2]
+
+    # a new file moved over the old one is read from its start, the old partial line is dropped
+    replacement = tmp_path / "needle-tracker.tmp"
+    replacement.write_text(_line(7) + _line(8) + _line(9) + _line(10))
+    os.replace(replacement, path)
+    assert [sample.pose[0] for sample in tail.readSamples()] == [7, 8, 9, 10]
+    _append(path, _line(11))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [11]
+
+
+def test_tail_waits_for_deleted_file(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_text(_line(1))
+    tail = TrackerFileTail(str(path), from_end=False)
+    assert len(tail.readLines()) == 1
+    os.remove(path)
+    assert tail.readLines() == []
+    path.write_text(_line(2))
+    assert [sample.pose[0] for sample in tail.readSamples()] == [2]
+
+
+def _receive(source, count, timeout=2.0):
+    samples = []
+    deadline = time.monotonic() + timeout
+    while len(samples) < count and time.monotonic() < deadline:
+        samples += source.readSamples()
+        time.sleep(0.005)
+    return samples
+
+
+def _pose(value):
+    return [value, 0, 0, 1, 0, 0, 0]
+
+
+@pytest.fixture
+def tcp_source():
+    source = SocketPoseSource("tcp", port=0)
+    yield source, source._socket.getsockname()[1]
+    source.close()
+
+
+def test_tcp_source_joins_partial_packets(tcp_source):
+    source, port = tcp_source
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        packet = packPose(_pose(1))
+        client.sendall(packet[:10])
+        assert _receive(source, 1, timeout=0.2) == []
+        client.sendall(packet[10:] + packPose(_pose(2)) + packPose(_pose(3))[:5])
+        assert [sample.pose[0] for sample in _receive(source, 2)] == [1, 2]
+        client.sendall(packPose(_pose(3))[5:])
+        assert [sample.pose[0] for sample in _receive(source, 1)] == [3]
+
+
+def test_tcp_source_accepts_reconnect(tcp_source):
+    source, port = tcp_source
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(packPose(_pose(1)) + packPose(_pose(2))[:20])
+        assert [sample.pose[0] for sample in _receive(source, 1)] == [1]
+    # the disconnect drops the incomplete packet, the next tracker connection is read from its start
+    deadline = time.monotonic() + 2.0
+    while source._client is not None and time.monotonic() < deadline:
+        source.readSamples()
+        time.sleep(0.005)
+    assert source._client is None
+    with socket.create_connection(("127.0.0.1", port)) as client:
+        client.sendall(packPose(_pose(5)) + packPose(_pose(6)))
+        assert [sample.pose[0] for sample in _receive(source, 2)] == [5, 6]
+
+
+def test_udp_source_skips_invalid_packets():
+    source = SocketPoseSource("udp", port=0)
+    port = source._socket.getsockname()[1]
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as client:
+        client.sendto(packPose(_pose(1))[:20], ("127.0.0.1", port))
+        client.sendto(packPose(_pose(float("nan"))), ("127.0.0.1", port))
+        client.sendto(packPose(_pose(2)), ("127.0.0.1", port))
+        assert [sample.pose[0] for sample in _receive(source, 1)] == [2]
+    source.close()
+
+
+def test_replay_timestamped_recording(tmp_path):
+    path = tmp_path / "recording-timed.txt"
+    np.savetxt(path, [[10.0 + 0.001 * i] + _pose(i) for i in range(5)])
+    poses, times = loadRecording(str(path))
+    np.testing.assert_array_equal(poses[:, 0], range(5))
+    np.testing.assert_allclose(times, 0.001 * np.arange(5), atol=1e-9)
+
+    source = SocketPoseSource("udp", port=0)
+    replay(str(path), "udp", port=source._socket.getsockname()[1])
+    assert [sample.pose[0] for sample in _receive(source, 5)] == [0, 1, 2, 3, 4]
+    source.close()
+
+
+def test_last_lines_of_empty_file(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_bytes(b"")
+    assert readLastLines(str(path), 3) == []
+    assert readLastPose(str(path)) is None
+    path.write_bytes(b"\n\n")
+    assert readLastLines(str(path), 3) == []
+
+
+def test_last_lines_leave_out_line_being_written(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_bytes(b"1\n2\n3 0 0")
+    assert readLastLines(str(path), 1) == [b"2"]
+    assert readLastLines(str(path), 5) == [b"1", b"2"]
+    path.write_bytes(b"3 0 0")
+    assert readLastLines(str(path), 1) == []
+
+
+@pytest.mark.parametrize("block_size", [4, 16, 4096])
+def test_last_lines_longer_than_a_block(tmp_path, block_size):
+    path = tmp_path / "needle-tracker.txt"
+    long = b"9" * 100
+    path.write_bytes(b"first\n" + long + b"\nshort\n" + long + b"\n")
+    assert readLastLines(str(path), 1, block_size) == [long]
+    assert readLastLines(str(path), 3, block_size) == [long, b"short", long]
+    assert readLastLines(str(path), 10, block_size) == [b"first", long, b"short", long]
+
+
+def test_last_lines_with_crlf_endings(tmp_path):
+    path = tmp_path / "needle-tracker.txt"
+    path.write_bytes(b"".join(_line(value).rstrip("\n").encode() + b"\r\n" for value in range(3)))
+    assert readLastLines(str(path), 2, block_size=8) == [
+        _line(1).rstrip("\n").encode(),
+        _line(2).rstrip("\n").encode(),
+    ]
+    np.testing.assert_array_equal(readLastPose(str(path)), [2, 0, 0, 1, 0, 0, 0])
+
+
+def _sample(value):
+    return PoseSample(float(value), np.full(7, float(value)))
+
+
+def test_slot_hands_out_the_latest_pose():
+    slot = LatestPoseSlot()
+    assert slot.take() is None
+    slot.publish([_sample(1), _sample(2)])
+    slot.publish([_sample(3)])
+    np.testing.assert_array_equal(slot.take(), np.full(7, 3.0))
+    assert slot.take() is None
+    slot.publish([_sample(4), _sample(5)])
+    assert [sample.timestamp for sample in slot.takeSamples()] == [4, 5]
+    assert (slot.frames, slot.samples, slot.max_merged) == (2, 5, 3)
+
+
+def test_slot_notifier_signals_published_samples():
+    slot = LatestPoseSlot()
+    descriptor = slot.notifier()
+    assert select.select([descriptor], [], [], 0)[0] == []
+    slot.publish([_sample(1)])
+    assert select.select([descriptor], [], [], 1.0)[0] == [descriptor]
+    slot.takeSamples()
+    assert select.select([descriptor], [], [], 0)[0] == []
+    slot.closeNotifier()
+
+
+def test_slot_readers_never_see_torn_poses():
+    slot = LatestPoseSlot()
+    stop = threading.Event()
+    count = 20000
+
+    def publish():
+        for value in range(1, count + 1):
+            slot.publish([_sample(value)])
+        stop.set()
+
+    writer = threading.Thread(target=publish)
+    writer.start()
+    seen = []
+    while not stop.is_set() or seen[-1:] != [count]:
+        for sample in slot.takeSamples():
+            # every field of a pose comes from the same publish
+            assert np.all(sample.pose == sample.timestamp)
+            seen.append(int(sample.timestamp))
+    writer.join()
+    assert seen == list(range(1, count + 1))
+
+
+class _CountingSource:
+    def __init__(self, count):
+        self.values = iter(range(1, count + 1))
+
+    def readSamples(self):
+        value = next(self.values, None)
+        return [] if value is None else [_sample(value)]
+
+
+def test_ingest_thread_publishes_every_sample():
+    slot = LatestPoseSlot()
+    thread = PoseIngestThread(_CountingSource(500), slot)
+    thread.start()
+    seen = []
+    deadline = time.monotonic() + 5.0
+    while len(seen) < 500 and time.monotonic() < deadline:
+        seen += [int(sample.timestamp) for sample in slot.takeSamples()]
+        time.sleep(0.001)
+    thread.stop()
+    assert seen == list(range(1, 501))
+    assert thread.samples == 500
+
+
+class _FailingSource:
+    def readSamples(self):
+        raise OSError("tracker gone")
+
+
+@pytest.mark.parametrize("kind", ["idle", "failing", "socket"])
+def test_ingest_thread_stops_within_timeout(kind):
+    if kind == "socket":
+        source = SocketPoseSource("udp", port=0)
+    else:
+        source = _CountingSource(0) if kind == "idle" else _FailingSource()
+    thread = PoseIngestThread(source, LatestPoseSlot(), max_interval=0.2)
+    thread.start()
+    time.sleep(0.3)  # backed off to max_interval
+    start = time.monotonic()
+    thread.stop(timeout=1.0)
+    assert not thread.is_alive()
+    assert time.monotonic() - start < 1.0
+    if kind == "socket":
+        source.close()
@@ -9,6 +9,17 @@ import Resources.UI.Layouts as layouts
 import re
 import time
 import LoadSegmentations
+from NeedleDeploymentLib.datafiles import loadData
+from NeedleDeploymentLib.logwriter import AsyncLogWriter
+from NeedleDeploymentLib.poses import PoseSample
+from NeedleDeploymentLib.sessions import SessionManager
+from NeedleDeploymentLib.tracking import (
+    LatestPoseSlot,
+    PoseIngestThread,
+    createPoseSource,
+    readLastPose,
+    readLastPoses,
+)
 
 _EPS = np.finfo(float).eps * 4.0
 #
@@ -27,7 +38,7 @@ class NeedleInterface(ScriptedLoadableModule):
             "NeedleInterface"
         )
         self.parent.categories = ["Needle Interface"]
-        self.parent.dependencies = []
+        self.parent.dependencies = ["NeedleDeployment"]
         self.parent.contributors = [
             "Janine Hoelscher"
         ]
@@ -83,6 +94,7 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
         print(self.inputFolder)
 
         defaultTimeInterval = 20
+        self.refresh_interval = defaultTimeInterval
         self.timer = qt.QTimer()
         self.timer.setInterval(defaultTimeInterval)
         self.timer.connect("timeout()", self.onTimeOut)
@@ -92,6 +104,32 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
         self.needle_file = self.inputFolder
         self.needle_pose_index = 0
         self.needle_data = []
+        self.pose_source = None
+        self.latest_pose = LatestPoseSlot()
+        self.ingest_thread = None
+
+        # live pose source: "file" tails needle-tracker.txt, "ring" maps needle-tracker.ring,
+        # "udp"/"tcp" receive pose packets on localhost
+        self.stream_source = "file"
+        self.stream_port = 5005
+
+        # live refresh: "timer" polls every defaultTimeInterval ms, "event" refreshes only when the
+        # ingest thread publishes a new pose, with a slow fallback timer in case a notification is missed
+        self.refresh_mode = "timer"
+        self.event_fallback_interval = 100
+        self.pose_notifier = None
+        self.tracker_watcher = None
+
+        # session logs (needle-timestamps.txt, timestamps.txt) are appended from a background
+        # thread in batches, at least every 0.5 s
+        self.log_writer = AsyncLogWriter()
+
+        # every session (first spacebar press until the environment is cleared) is logged to its own
+        # folder in sessions_folder, named after the participant. Logs are split into segments of at
+        # most 64 MB and session.json indexes where each trial (spacebar press) starts and stops
+        self.sessions_folder = os.path.join(os.path.expanduser("~"), "NeedleSessions")
+        self.participant = ""
+        self.session_manager = SessionManager(self.sessions_folder, self.log_writer)
 
         # hardcoded values for recorded data
         self.needle_registration = np.eye(4)
@@ -322,16 +360,16 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
     def eventChange(self):
         # record timestamps for when spacebar pressed, collect needle time/position/orientation data
         if not self.eventChanged:
-            with open(self.inputFolder + "timestamps.txt", "a") as file:
-                file.write("\n")
-            with open(self.inputFolder + "needle-timestamps.txt", "a") as file:
-                file.write("\n")
+            self.session_manager.startSession(self.participant, module="NeedleInterface")
+            self.session_manager.log("timestamps").write("\n")
+            self.session_manager.log("needle-timestamps").write("\n")
             self.startTime = time.time()
             self.eventChanged = True
         else:
             timePassed = time.time() - self.startTime
-            with open(self.inputFolder + "timestamps.txt", "a") as file:
-                file.write(f"{timePassed}\n")
+            self.session_manager.log("timestamps").write(f"{timePassed}\n")
+        # every spacebar press starts the next trial of the session index
+        self.session_manager.startTrial(self.eventCount)
 
         # boolean flag to decide whether insertion region should be a sphere or flat cylinder (circle)
         flag = self.eventCount < 15
@@ -551,7 +589,11 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
         return section
 
     def cleanup(self):
-        pass
+        self.stopPoseIngest()
+        if self.pose_source is not None:
+            self.pose_source.close()
+        self.session_manager.close()
+        self.log_writer.close()
 
     # if streaming, read sensor updates, if recording selected, begin playback
     def onStartNeedleClicked(self):
@@ -566,6 +608,7 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
             self.needle_update = False
             self.StartButton.text = "Start needle"
             self.timer.stop()
+            self.stopPoseIngest()
             self.resetNeedleButton.enabled = True
 
         # if not yet running, turn it on
@@ -577,8 +620,61 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
             self.streamingCheckBox.enabled = False
             self.needle_update = True
             self.StartButton.text = "Stop needle"
+            if self.stream_live_data:
+                self.startPoseIngest()
             self.timer.start()
 
+    # live poses are read and parsed on a worker thread, the refresh timer only picks up the newest one
+    def startPoseIngest(self):
+        self.stopPoseIngest()
+        self.latest_pose.clear()
+        self.latest_pose.resetCounters()
+        self.ingest_thread = PoseIngestThread(self.pose_source, self.latest_pose)
+        self.ingest_thread.start()
+
+        if self.refresh_mode == "event":
+            self.pose_notifier = qt.QSocketNotifier(
+                self.latest_pose.notifier(), qt.QSocketNotifier.Read
+            )
+            self.pose_notifier.connect("activated(int)", self.onPoseAvailable)
+            # file-change notifications wake the ingest thread before its next adaptive poll
+            if self.stream_source in ("file", "ring"):
+                self.tracker_watcher = qt.QFileSystemWatcher()
+                self.tracker_watcher.addPath(self.needle_file)
+                self.tracker_watcher.connect(
+                    "fileChanged(QString)", self.onTrackerFileChanged
+                )
+            self.timer.setInterval(self.event_fallback_interval)
+
+    def stopPoseIngest(self):
+        if self.ingest_thread is not None:
+            self.ingest_thread.stop()
+            self.ingest_thread = None
+            print("Pose ingestion: " + self.latest_pose.summary())
+        if self.pose_notifier is not None:
+            self.pose_notifier.setEnabled(False)
+            self.pose_notifier.disconnect("activated(int)", self.onPoseAvailable)
+            self.pose_notifier = None
+            self.latest_pose.closeNotifier()
+        if self.tracker_watcher is not None:
+            self.tracker_watcher.disconnect(
+                "fileChanged(QString)", self.onTrackerFileChanged
+            )
+            self.tracker_watcher = None
+        self.timer.setInterval(self.refresh_interval)
+
+    # event refresh mode: a new pose was published by the ingest thread
+    def onPoseAvailable(self, socket):
+        if self.needle_update:
+            self.onNeedleRefresh()
+
+    def onTrackerFileChanged(self, path):
+        if self.ingest_thread is not None:
+            self.ingest_thread.wake()
+        # watch is dropped when the tracker replaces the file
+        if path not in self.tracker_watcher.files():
+            self.tracker_watcher.addPath(path)
+
     def onTimeOut(self):
         self.timer.stop()
         if self.needle_update:
@@ -586,16 +682,16 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
             self.timer.start()
 
     def onNeedleRefresh(self):
-        if (not os.path.isfile(self.needle_file)) or (
-            not os.path.exists(self.needle_file)
-        ):
-            print(self.needle_file + " does not exist!")
-            return False
-
         # pre-recorded data
         if not self.stream_live_data:
+            if (not os.path.isfile(self.needle_file)) or (
+                not os.path.exists(self.needle_file)
+            ):
+                print(self.needle_file + " does not exist!")
+                return False
+
             if (
-                not self.needle_data
+                len(self.needle_data) == 0
             ):  # start streaming for the first time: load data from file
                 self.needle_data = self.loadDataFromFile(self.needle_file, 0)
                 self.needle_pose_index = 0
@@ -606,11 +702,15 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
 
             self.needle_pose_index += 1
 
-        # live data via ROS
+        # live data via ROS, samples published by the ingest thread since the last refresh.
+        # Only the newest one moves the needle, the intermediate ones are only logged.
         else:
-            d = self.loadDataFromFile(self.needle_file, 0)
-            if not d == []:
-                self.needle_data = d
+            samples = self.latest_pose.takeSamples()
+            if not samples:
+                return False
+            self.logNeedlePoses(samples[:-1])
+            newest = samples[-1]
+            return self.updateNeedle(newest.pose[0:3], newest.pose[3:7], newest.timestamp)
 
         data = self.needle_data[self.needle_pose_index]
         if not len(data) == 7:
@@ -624,21 +724,30 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
         success = self.updateNeedle(pos, quat)
         return success
 
-    def updateNeedle(self, pos, quat):
+    def updateNeedle(self, pos, quat, timestamp=None):
         if len(pos) != 3 or len(quat) != 4:
             return False
         current = self.getTransformRot(pos, self.quaternionToRotationMatrix(quat))
         T = np.matmul(self.needle_registration, current)
         print(T)
-        if self.startTime is not None:
-            timePassed = time.time() - self.startTime
-            with open(self.inputFolder + "needle-timestamps.txt", "a") as file:
-                file.write(
-                    f"{timePassed} {pos[0]} {pos[1]} {pos[2]} {quat[0]} {quat[1]} {quat[2]} {quat[3]}\n"
-                )
+        if timestamp is None:
+            timestamp = time.time()
+        self.logNeedlePoses([PoseSample(timestamp, list(pos) + list(quat))])
         self.composite_needle.SetMatrixTransformToParent(self.npToVtkMatrix(T))
         return True
 
+    # append needle poses to the needle-timestamps log of the session with their own capture times
+    def logNeedlePoses(self, samples):
+        if self.startTime is None or not samples:
+            return
+        self.session_manager.log("needle-timestamps").write(
+            "".join(
+                f"{sample.timestamp - self.startTime} {sample.pose[0]} {sample.pose[1]} {sample.pose[2]} "
+                f"{sample.pose[3]} {sample.pose[4]} {sample.pose[5]} {sample.pose[6]}\n"
+                for sample in samples
+            )
+        )
+
     # on recording selection in dropdown
     def onDropDownMovementSelect(self, index):
         text = self.dropDownMovement.itemText(index)
@@ -659,9 +768,19 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
             self.dropDownMovement.enabled = False
             self.dropDownMovementLabel.enabled = False
             self.stream_live_data = True
-            self.needle_file = self.inputFolder + "needle-tracker.txt"
+            if self.stream_source == "ring":
+                self.needle_file = self.inputFolder + "needle-tracker.ring"
+            else:
+                self.needle_file = self.inputFolder + "needle-tracker.txt"
+            self.pose_source = createPoseSource(
+                self.stream_source, self.needle_file, port=self.stream_port
+            )
             self.StartButton.enabled = True
         else:
+            self.stopPoseIngest()
+            if self.pose_source is not None:
+                self.pose_source.close()
+                self.pose_source = None
             self.StartButton.enabled = False
             self.stream_live_data = False
             self.needle_file = self.inputFolder
@@ -736,6 +855,9 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
     # soft reload on environment without restarting slicer
     def onClearEnvironmentClicked(self):
         slicer.mrmlScene.GetSubjectHierarchyNode().RemoveAllItems(True)
+        # everything logged so far is written before the logs are reopened for the next session
+        self.session_manager.close()
+        self.log_writer.close()
 
         self.dropDownMovement.setCurrentIndex(0)
         self.dropDownViewSelector.setCurrentIndex(0)
@@ -1263,10 +1385,7 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
 
     #creates markup representing steerable needle motion planning (currently unused)
     def createPlan(self):
-        plan_data = self.loadDataFromFile(
-            self.inputFolder + "plan.txt", ignoreFirstLines=1
-        )
-        plan = np.array(plan_data)
+        plan = self.loadDataFromFile(self.inputFolder + "plan.txt", ignoreFirstLines=1)
 
         plan_node = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLMarkupsCurveNode")
         plan_node.SetName("Plan")
@@ -1722,34 +1841,9 @@ class NeedleInterfaceWidget(ScriptedLoadableModuleWidget):
 
     def loadDataFromFile(self, fullPath, ignoreFirstLines=1):
         print("Loading points from " + str(fullPath))
-
-        planFile = open(fullPath)
-        lines = planFile.readlines()
-        count = 0
-
-        data = []
-        linecount = -1
-
-        for line in lines:
-            linecount += 1
-            if ignoreFirstLines > linecount:
-                continue
-            fields = line.split(" ")
-
-            if fields[-1] == "\n":  # Remove newline
-                fields = fields[:-1]
-
-            if fields[-1][-1] == "\n":  # Remove newline not separated from last number
-                fields[-1] = fields[-1][:-1]
-
-            if len(fields) > 1:
-                d = [float(f) for f in fields]
-                data.append(d)
-                count += 1
-
-        planFile.close()
-        print(str(count) + " lines loaded.")
-
+        # float64 array, one row per line, header lines skipped and column count checked
+        data = loadData(fullPath, ignoreFirstLines)
+        print(str(len(data)) + " lines loaded.")
         return data
 
 
@@ -1835,28 +1929,12 @@ class NeedleInterfaceLogic(ScriptedLoadableModuleLogic):
 
         return True
 
-    def readLastLine(self, filename):
-        fin = open(filename)
-        lines = fin.readlines()
-        pos = []
-        quat = []
-        if len(lines) > 0:
-            latestLine = lines[-1]
-            fields = latestLine.split(" ")
-            if fields[-1] == "\n":
-                n = len(fields)
-                fields = fields[0 : n - 1]
-
-            if len(fields) == 7:
-                fieldsPos = fields[:3]
-                fieldsQuat = fields[3:]
-                pos = map(float, fieldsPos)
-                quat = map(float, fieldsQuat)
-        # else:
-        # print(filename + " is empty!")
-
-        fin.close()
-        return [pos, quat]
+    # newest pose (pos + quat) in a tracker file, None if there is none. With count, the poses
+    # on the last count lines as an (N, 7) array instead. Only the end of the file is read.
+    def readLastLine(self, filename, count=None):
+        if count is not None:
+            return readLastPoses(filename, count)
+        return readLastPose(filename)
 
 
 class NeedleInterfaceTest(ScriptedLoadableModuleTest):